@@ -1,8 +1,16 @@
+import csv
+import gzip
+import io
+import json
+import math
 import os
+import re
+import threading
+import time
 from datetime import datetime
 
-from flask import (Flask, flash, jsonify, redirect, render_template, request,
-                   url_for)
+from flask import (Flask, Response, flash, g, jsonify, redirect,
+                   render_template, request, stream_with_context, url_for)
 from flask_caching import Cache
 from flask_login import (LoginManager, UserMixin, current_user, login_required,
                          login_user, logout_user)
@@ -12,7 +20,19 @@ from werkzeug.security import check_password_hash, generate_password_hash
 from wtforms import PasswordField, StringField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
 
+import aquecedor_cache
 import buscador_pncp
+import cache_sqlite
+import coalescencia
+import dados_locais
+import metricas
+import perfilamento
+
+# brotli é opcional: sem ele as respostas são comprimidas apenas com gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # --- Configuração Base ---
 app = Flask(__name__)
@@ -20,7 +40,8 @@ app.config['SECRET_KEY'] = 'uma-chave-secreta-muito-dificil-de-adivinhar'
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 # --- Configuração do Banco de Dados SQLite ---
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'site_colaborativo.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'site_colaborativo.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
@@ -31,13 +52,103 @@ login_manager.login_view = 'login'
 # Mensagem em português
 login_manager.login_message = 'Por favor, faça login para acessar esta página.'
 
-# --- Configuração do Cache (sem mudança) ---
+# --- Configuração do Cache ---
+# Padrão: SQLite compartilhado por todos os workers, com limite de tamanho (cache_sqlite.py).
+# CACHE_TYPE=FileSystemCache volta ao cache antigo em arquivos (usa CACHE_DIR).
 config_cache = {
-    "CACHE_TYPE": "FileSystemCache",
-    "CACHE_DIR": "cache"
+    "CACHE_TYPE": os.environ.get("CACHE_TYPE", "cache_sqlite.CacheSQLite"),
+    "CACHE_DIR": os.environ.get("CACHE_DIR", "cache"),
+    "CACHE_SQLITE_CAMINHO": os.environ.get("CACHE_SQLITE_CAMINHO", cache_sqlite.CAMINHO_CACHE_SQLITE),
+    "CACHE_SQLITE_LIMITE_MB": int(os.environ.get("CACHE_SQLITE_LIMITE_MB", cache_sqlite.LIMITE_CACHE_MB))
 }
 app.config.from_mapping(config_cache)
 cache = Cache(app)
+# Os itens de cada licitação vindos do PNCP também ficam no cache compartilhado:
+# relatórios de períodos que se sobrepõem não buscam de novo as mesmas licitações.
+buscador_pncp.CACHE_PNCP = cache.cache
+
+# --- Configuração das Métricas por Requisição ---
+@app.before_request
+def iniciar_cronometro_requisicao():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def registrar_metricas_requisicao(response):
+    """Conta requisições e mede a latência por endpoint e código de status."""
+    # Usa a regra da rota (ex: /api/gerar-relatorio), não a URL, para não explodir a cardinalidade
+    endpoint = request.url_rule.rule if request.url_rule else 'desconhecido'
+    metricas.incrementar('http_requisicoes_total', endpoint=endpoint, metodo=request.method,
+                         status=response.status_code)
+    if 'inicio_requisicao' in g:
+        metricas.observar('http_requisicao_duracao_segundos',
+                          time.perf_counter() - g.inicio_requisicao, endpoint=endpoint)
+    return response
+
+# --- Perfilamento de Requisições (só administradores) ---
+# Com ?perfil=1 ou o cabeçalho "X-Perfil: 1", a requisição de um administrador
+# é perfilada com cProfile e salva em perfis/ (ver perfilamento.py); o nome do
+# arquivo volta no cabeçalho X-Perfil-Arquivo. Respostas em fluxo (NDJSON) só
+# têm perfilado o trecho até o início do envio.
+ADMINISTRADORES = {
+    nome.strip() for nome in os.environ.get('ADMINISTRADORES', '').split(',') if nome.strip()
+}
+
+def _perfil_solicitado():
+    if request.args.get('perfil') != '1' and request.headers.get('X-Perfil') != '1':
+        return False
+    return current_user.is_authenticated and current_user.username in ADMINISTRADORES
+
+@app.before_request
+def iniciar_perfil_requisicao():
+    if not _perfil_solicitado():
+        return
+    perfilador = perfilamento.Perfilador()
+    if perfilador.iniciar():
+        g.perfilador = perfilador
+    else:
+        print("Perfilamento ignorado: já há outra requisição sendo perfilada.")
+
+@app.after_request
+def salvar_perfil_requisicao(response):
+    perfilador = g.pop('perfilador', None)
+    if perfilador is not None:
+        nome = (request.endpoint or 'requisicao').replace('.', '_')
+        caminho = perfilador.salvar(perfilamento.caminho_perfil(f"api_{nome}"), mostrar_resumo=False)
+        response.headers['X-Perfil-Arquivo'] = os.path.basename(caminho)
+    return response
+
+@app.teardown_request
+def encerrar_perfil_pendente(erro=None):
+    # Se a requisição falhou antes do after_request, libera o perfilamento
+    perfilador = g.pop('perfilador', None)
+    if perfilador is not None and perfilador.ativo:
+        perfilador.parar()
+
+# --- Configuração da Compressão das Respostas JSON ---
+TAMANHO_MINIMO_COMPRESSAO_BYTES = 1024
+NIVEL_COMPRESSAO_GZIP = 6
+NIVEL_COMPRESSAO_BROTLI = 5
+
+@app.after_request
+def comprimir_resposta(response):
+    """Comprime respostas JSON com brotli ou gzip, conforme o Accept-Encoding do cliente."""
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    dados = response.get_data()
+    if len(dados) < TAMANHO_MINIMO_COMPRESSAO_BYTES:
+        return response
+
+    if brotli is not None and request.accept_encodings.quality('br') > 0:
+        response.set_data(brotli.compress(dados, quality=NIVEL_COMPRESSAO_BROTLI))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings.quality('gzip') > 0:
+        response.set_data(gzip.compress(dados, compresslevel=NIVEL_COMPRESSAO_GZIP))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 # --- FIM DAS CONFIGURAÇÕES ---
 
@@ -186,12 +297,322 @@ def register():
 # --- FIM DAS ROTAS DE USUÁRIO ---
 
 
+# --- CONFIGURAÇÕES DO RELATÓRIO ---
+# Stale-while-revalidate: até o TTL "fresco" o relatório é servido direto; entre
+# ele e o TTL máximo é servido na hora (marcado como desatualizado) enquanto é
+# atualizado em segundo plano; depois do TTL máximo o cache expira e a busca bloqueia.
+TTL_FRESCO_RELATORIO_SEG = 43200 # 12 horas
+TTL_MAXIMO_RELATORIO_SEG = 7 * 24 * 3600 # 7 dias
+ITENS_POR_PAGINA_RELATORIO = 100
+MAXIMO_ITENS_POR_PAGINA_RELATORIO = 500
+TAMANHO_LOTE_CONSULTA_SQL = 500 # Limite de parâmetros por cláusula IN
+
+# Chaves aceitas no parâmetro 'ordenar' da API de relatório
+CHAVES_ORDENACAO_RELATORIO = {
+    'numero_item', 'descricao', 'quantidade', 'valor_unit_estimado',
+    'valor_total_estimado', 'licitacao_modalidade', 'licitacao_data_publicacao'
+}
+
+# Palavras que indicam que o item é um lote detalhado em anexo
+PALAVRAS_LOTE = ("TERMO DE REFERÊNCIA", "ANEXO", "EDITAL", "LOTE")
+
+
+# Formatos de resposta aceitos no parâmetro 'formato' da API de relatório
+FORMATOS_RELATORIO = {'completo', 'compacto', 'colunar'}
+
+
+def _eh_lote_suspeito(item):
+    """Mesma heurística usada pela tabela: palavras de lote ou Qtd=1 sem valor."""
+    descricao = (item.descricao or '').upper()
+    if any(palavra in descricao for palavra in PALAVRAS_LOTE):
+        return True
+    return not item.valor_unit_estimado and item.quantidade == 1
+
+
+def _em_lotes(lista, tamanho=TAMANHO_LOTE_CONSULTA_SQL):
+    for i in range(0, len(lista), tamanho):
+        yield lista[i:i + tamanho]
+
+
+def _parametro_decimal(nome):
+    """Lê um número opcional da query string; valor inválido é erro (não é ignorado)."""
+    valor = request.args.get(nome)
+    if valor in (None, ''):
+        return None
+    try:
+        numero = float(valor)
+    except ValueError:
+        raise ValueError(f"Parâmetro '{nome}' deve ser um número.")
+    if not math.isfinite(numero):
+        raise ValueError(f"Parâmetro '{nome}' deve ser um número.")
+    return numero
+
+
+def _parametro_inteiro(nome, padrao, minimo=1, maximo=None):
+    """Lê um inteiro opcional da query string (ex.: paginação); inválido ou fora da faixa é erro."""
+    valor = request.args.get(nome)
+    if valor in (None, ''):
+        return padrao
+    try:
+        numero = int(valor)
+    except ValueError:
+        raise ValueError(f"Parâmetro '{nome}' deve ser um número inteiro.")
+    if numero < minimo or (maximo is not None and numero > maximo):
+        if maximo is None:
+            raise ValueError(f"Parâmetro '{nome}' deve ser maior ou igual a {minimo}.")
+        raise ValueError(f"Parâmetro '{nome}' deve estar entre {minimo} e {maximo}.")
+    return numero
+
+
+def _parametro_booleano(nome):
+    """Lê filtros tri-estado: '1' (sim), '0' (não) ou ausente (todos)."""
+    valor = request.args.get(nome)
+    if valor in (None, ''):
+        return None
+    if valor not in ('0', '1'):
+        raise ValueError(f"Parâmetro '{nome}' deve ser 0 ou 1.")
+    return valor == '1'
+
+
+# Versão do formato guardado no cache; mude ao alterar a estrutura do relatório
+# para que entradas antigas não sejam lidas com o formato novo.
+VERSAO_CACHE_RELATORIO = 2
+
+
+def _chave_cache_relatorio(cnpj, data_inicio, data_fim):
+    return f"relatorio:v{VERSAO_CACHE_RELATORIO}:{cnpj}:{data_inicio}:{data_fim}"
+
+
+def _indexar_relatorio(relatorio):
+    """Guarda os itens no índice local para a busca textual (/api/buscar-itens)."""
+    if relatorio['itens']:
+        try:
+            dados_locais.indexar_itens(buscador_pncp.desnormalizar_itens(relatorio))
+        except Exception as e:
+            print(f"Erro ao indexar itens localmente: {e}")
+
+
+def _idade_entrada(entrada):
+    return time.time() - entrada['gerado_em']
+
+
+def _entrada_fresca(entrada):
+    return (
+        entrada is not None
+        and not entrada['relatorio']['erros']
+        and _idade_entrada(entrada) < TTL_FRESCO_RELATORIO_SEG
+    )
+
+
+_atualizacoes_em_andamento = set()
+_lock_atualizacoes = threading.Lock()
+
+
+def _obter_relatorio_pncp(cnpj, data_inicio, data_fim):
+    """
+    Busca os itens no PNCP (a parte lenta do relatório). O resultado fica em
+    cache no formato normalizado (cada licitação guardada uma única vez);
+    votos e sub-itens são cruzados a cada requisição, por isso uma nova
+    contribuição não precisa invalidar este cache.
+
+    Retorna a entrada do cache: {'gerado_em': timestamp, 'relatorio': {...}}.
+    Uma entrada completa mas vencida é devolvida na hora e atualizada em
+    segundo plano. Requisições simultâneas para o mesmo relatório (em
+    qualquer thread ou worker) são coalescidas: só uma consulta o PNCP.
+    """
+    chave = _chave_cache_relatorio(cnpj, data_inicio, data_fim)
+    entrada = cache.get(chave)
+
+    if _entrada_fresca(entrada):
+        metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='acerto')
+        return entrada
+
+    if entrada is not None and not entrada['relatorio']['erros']:
+        metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='desatualizado')
+        _agendar_atualizacao(chave, cnpj, data_inicio, data_fim)
+        return entrada
+
+    return coalescencia.executar_unico(
+        chave, lambda: _calcular_relatorio_pncp(chave, cnpj, data_inicio, data_fim)
+    )
+
+
+def _agendar_atualizacao(chave, cnpj, data_inicio, data_fim):
+    """Atualiza o relatório numa thread, no máximo uma por chave neste processo."""
+    with _lock_atualizacoes:
+        if chave in _atualizacoes_em_andamento:
+            return
+        _atualizacoes_em_andamento.add(chave)
+
+    def atualizar():
+        try:
+            with app.app_context():
+                coalescencia.executar_unico(
+                    chave, lambda: _calcular_relatorio_pncp(chave, cnpj, data_inicio, data_fim)
+                )
+        except Exception as e:
+            print(f"Erro ao atualizar relatório em segundo plano ({chave}): {e}")
+            metricas.incrementar('atualizacoes_segundo_plano_total', resultado='erro')
+        else:
+            metricas.incrementar('atualizacoes_segundo_plano_total', resultado='sucesso')
+        finally:
+            with _lock_atualizacoes:
+                _atualizacoes_em_andamento.discard(chave)
+
+    threading.Thread(target=atualizar, name=f"atualizar-{chave}", daemon=True).start()
+
+
+def _calcular_relatorio_pncp(chave, cnpj, data_inicio, data_fim):
+    """
+    Executado por uma única requisição por vez (ver _obter_relatorio_pncp).
+    Se o relatório em cache ainda está dentro do TTL fresco mas ficou
+    incompleto (falhas no PNCP), só as partes que falharam são buscadas de
+    novo; caso contrário o relatório é refeito do zero.
+    """
+    # Relê o cache: outro worker pode ter terminado enquanto esperávamos a trava
+    entrada = cache.get(chave)
+
+    if _entrada_fresca(entrada):
+        metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='coalescido')
+        return entrada
+
+    if entrada is not None and entrada['relatorio']['erros'] and _idade_entrada(entrada) < TTL_FRESCO_RELATORIO_SEG:
+        metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='incompleto')
+        print(f"Retomando relatório incompleto para CNPJ: {cnpj}...")
+        relatorio = buscador_pncp.retomar_relatorio(entrada['relatorio'], cnpj, data_inicio, data_fim)
+        # A idade continua sendo a da parte mais antiga dos dados
+        gerado_em = entrada['gerado_em']
+    else:
+        if entrada is None:
+            metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='falha')
+        print(f"Iniciando busca no PNCP para CNPJ: {cnpj}...")
+        gerado_em = time.time()
+        relatorio = buscador_pncp.gerar_relatorio_normalizado(cnpj, data_inicio, data_fim)
+
+    return _guardar_relatorio(chave, entrada, relatorio, gerado_em)
+
+
+def _guardar_relatorio(chave, entrada_anterior, relatorio, gerado_em):
+    """
+    Grava o relatório novo no cache e o devolve. Com o PNCP instável, um
+    relatório com mais falhas que o anterior não o substitui: continua
+    valendo o anterior (desatualizado, porém mais completo), que é devolvido.
+    """
+    if entrada_anterior is not None and len(relatorio['erros']) > len(entrada_anterior['relatorio']['erros']):
+        print(f"Atualização de {chave} descartada: {len(relatorio['erros'])} falha(s) no PNCP.")
+        metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='atualizacao_descartada')
+        return entrada_anterior
+
+    _indexar_relatorio(relatorio)
+    entrada = {'gerado_em': gerado_em, 'relatorio': relatorio}
+    cache.set(chave, entrada, timeout=TTL_MAXIMO_RELATORIO_SEG)
+    return entrada
+
+
+def aquecer_relatorio(cnpj, data_inicio, data_fim):
+    """
+    Usado pelo aquecedor de cache (aquecedor_cache.py): calcula o relatório
+    se o cache não estiver fresco. Retorna None se não havia nada a fazer.
+    """
+    chave = _chave_cache_relatorio(cnpj, data_inicio, data_fim)
+    with app.app_context():
+        if _entrada_fresca(cache.get(chave)):
+            return None
+        entrada = coalescencia.executar_unico(
+            chave, lambda: _calcular_relatorio_pncp(chave, cnpj, data_inicio, data_fim)
+        )
+    return entrada['relatorio']
+
+
+def _chaves_com_votos(item_keys):
+    chaves = set()
+    for lote in _em_lotes(item_keys):
+        chaves.update(db.session.scalars(
+            db.select(Contribution.item_key).where(Contribution.item_key.in_(lote)).distinct()
+        ).all())
+    return chaves
+
+
+def _totais_sub_itens(item_keys):
+    """
+    Soma os sub-itens de cada item pai direto no banco (GROUP BY), sem trazer
+    as linhas: {item_key: (total_de_sub_itens, soma de quantidade * valor_unitario)}.
+    """
+    totais = {}
+    for lote in _em_lotes(item_keys):
+        consulta = (
+            db.select(
+                SubItem.parent_item_key,
+                db.func.count(SubItem.id),
+                db.func.sum(SubItem.quantidade * SubItem.valor_unitario)
+            )
+            .where(SubItem.parent_item_key.in_(lote))
+            .group_by(SubItem.parent_item_key)
+        )
+        for item_key, quantidade, valor_total in db.session.execute(consulta):
+            totais[item_key] = (quantidade, valor_total)
+    return totais
+
+
+def _resumo_sub_itens(totais, quantidade_pai, valor_unit_pai):
+    """Compara a soma dos sub-itens com o preço unitário estimado do item pai."""
+    if totais is None:
+        return None
+    total_sub_itens, valor_total = totais
+    valor_unit_implicito = None
+    if valor_total is not None and quantidade_pai:
+        valor_unit_implicito = round(valor_total / quantidade_pai, 4)
+    diferenca_percentual = None
+    if valor_unit_implicito is not None and valor_unit_pai:
+        diferenca_percentual = round((valor_unit_implicito - valor_unit_pai) / valor_unit_pai * 100, 2)
+    return {
+        'total_sub_itens': total_sub_itens,
+        'valor_total': valor_total,
+        'valor_unit_implicito': valor_unit_implicito,
+        'diferenca_percentual': diferenca_percentual
+    }
+
+
+def _enriquecer_com_dados_colaborativos(itens):
+    """
+    Cruza os itens (apenas os da página pedida) com votos e sub-itens do banco.
+    Dos sub-itens vem só o resumo por item pai; as linhas ficam em /api/sub-itens/<item_key>.
+    """
+    item_keys = [item['item_key'] for item in itens]
+
+    contrib_map = {}
+    for lote in _em_lotes(item_keys):
+        contribuicoes = db.session.scalars(
+            db.select(Contribution).where(Contribution.item_key.in_(lote))
+        ).all()
+        for c in contribuicoes:
+            contrib_map.setdefault(c.item_key, []).append({'status': c.status, 'comment': c.comment})
+
+    totais_sub_itens = _totais_sub_itens(item_keys)
+
+    for item in itens:
+        item['contribuicoes'] = contrib_map.get(item['item_key'], [])
+        item['sub_itens'] = _resumo_sub_itens(
+            totais_sub_itens.get(item['item_key']), item.get('quantidade'), item.get('valor_unit_estimado')
+        )
+    return itens
+
+
 @app.route("/api/gerar-relatorio", methods=['GET'])
-@cache.cached(timeout=43200, query_string=True) 
 def api_relatorio():
     """
     API que busca os dados no PNCP, CRUZA com o banco de dados local
-    e retorna o JSON enriquecido.
+    e retorna o JSON enriquecido, paginado.
+
+    Parâmetros opcionais (aplicados sobre o resultado em cache):
+      pagina, por_pagina            -> paginação (padrão 1 e 100)
+      ordenar, direcao (asc|desc)   -> ordenação por um campo do item
+      modalidade                    -> nome exato da modalidade
+      com_votos, lote (0|1)         -> itens com/sem votos, lotes suspeitos ou não
+      formato                       -> 'completo' (padrão): cada item traz os dados da licitação;
+                                       'compacto': licitações enviadas uma vez em 'licitacoes'
+                                       e referenciadas por 'licitacao_id' nos itens;
+                                       'colunar': como 'compacto', com os itens em 'colunas'
     """
     
     cnpj = request.args.get('cnpj')
@@ -201,59 +622,237 @@ def api_relatorio():
     if not all([cnpj, data_inicio, data_fim]):
         return jsonify({"erro": "Parâmetros 'cnpj', 'inicio' e 'fim' são obrigatórios"}), 400
 
+    ordenar = request.args.get('ordenar')
+    direcao = request.args.get('direcao', 'asc')
+    modalidade = request.args.get('modalidade')
+    formato = request.args.get('formato', 'completo')
+
     try:
-        print(f"Iniciando busca no PNCP para CNPJ: {cnpj}...")
-        itens_pncp = buscador_pncp.gerar_relatorio_bruto(cnpj, data_inicio, data_fim)
-        
-        if not itens_pncp:
-             return jsonify([]) # Retorna lista vazia se nada for encontrado
+        pagina = _parametro_inteiro('pagina', 1)
+        por_pagina = _parametro_inteiro(
+            'por_pagina', ITENS_POR_PAGINA_RELATORIO, maximo=MAXIMO_ITENS_POR_PAGINA_RELATORIO
+        )
+        if ordenar and ordenar not in CHAVES_ORDENACAO_RELATORIO:
+            raise ValueError(f"Parâmetro 'ordenar' inválido: {ordenar}.")
+        if direcao not in ('asc', 'desc'):
+            raise ValueError("Parâmetro 'direcao' deve ser 'asc' ou 'desc'.")
+        if formato not in FORMATOS_RELATORIO:
+            raise ValueError(f"Parâmetro 'formato' inválido: {formato}.")
+        filtro_com_votos = _parametro_booleano('com_votos')
+        filtro_lote = _parametro_booleano('lote')
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    try:
+        entrada = _obter_relatorio_pncp(cnpj, data_inicio, data_fim)
+        relatorio = entrada['relatorio']
+        idade_segundos = int(_idade_entrada(entrada))
+        licitacoes = relatorio['licitacoes']
+
+        # Os filtros e a ordenação trabalham direto sobre os registros em cache
+        # (sem copiar); só os itens da página viram dicionários.
+        itens = relatorio['itens']
+
+        modalidades = sorted({
+            lic.licitacao_modalidade for lic in licitacoes.values() if lic.licitacao_modalidade
+        })
+        total_geral = len(itens)
+
+        # --- Filtros ---
+        if modalidade:
+            itens = [item for item in itens if item.licitacao.licitacao_modalidade == modalidade]
+        if filtro_lote is not None:
+            itens = [item for item in itens if _eh_lote_suspeito(item) == filtro_lote]
+        if filtro_com_votos is not None:
+            with metricas.medir_etapa('sobreposicao_db'):
+                chaves_votadas = _chaves_com_votos([item.item_key for item in itens])
+            itens = [item for item in itens if (item.item_key in chaves_votadas) == filtro_com_votos]
+
+        # --- Ordenação (valores ausentes sempre no fim) ---
+        if ordenar:
+            com_valor = [item for item in itens if item.valor(ordenar) is not None]
+            sem_valor = [item for item in itens if item.valor(ordenar) is None]
+            com_valor.sort(key=lambda item: item.valor(ordenar), reverse=(direcao == 'desc'))
+            itens = com_valor + sem_valor
+
+        # --- Paginação ---
+        total = len(itens)
+        inicio = (pagina - 1) * por_pagina
+        registros_pagina = itens[inicio:inicio + por_pagina]
+
+        itens_pagina = []
+        for registro in registros_pagina:
+            item = registro.para_dict()
+            item['item_key'] = registro.item_key
+            item['lote_suspeito'] = _eh_lote_suspeito(registro)
+            itens_pagina.append(item)
 
         print("Buscando dados colaborativos...")
-        item_keys = [
-            f"{item['cnpj']}-{item['ano']}-{item['sequencial']}-{item['numero_item']}" 
-            for item in itens_pncp if item.get('cnpj') # Garante que os dados estão lá
-        ]
-        
-        contribuicoes = db.session.scalars(
-            db.select(Contribution).where(Contribution.item_key.in_(item_keys))
-        ).all()
-        
-        sub_itens = db.session.scalars(
-            db.select(SubItem).where(SubItem.parent_item_key.in_(item_keys))
-        ).all()
-        
-        contrib_map = {}
-        for c in contribuicoes:
-            if c.item_key not in contrib_map:
-                contrib_map[c.item_key] = []
-            contrib_map[c.item_key].append({'status': c.status, 'comment': c.comment})
-            
-        sub_item_map = {}
-        for s in sub_itens:
-            if s.parent_item_key not in sub_item_map:
-                sub_item_map[s.parent_item_key] = []
-            sub_item_map[s.parent_item_key].append({
-                'descricao': s.descricao, 
-                'quantidade': s.quantidade,
-                'valor_unitario': s.valor_unitario
-            })
-        
-        itens_enriquecidos = []
-        for item in itens_pncp:
-            key = f"{item.get('cnpj')}-{item.get('ano')}-{item.get('sequencial')}-{item.get('numero_item')}"
-            item['item_key'] = key
-            item['contribuicoes'] = contrib_map.get(key, []) 
-            item['sub_itens'] = sub_item_map.get(key, []) 
-            itens_enriquecidos.append(item)
-            
-        print("Busca concluída, retornando JSON enriquecido.")
-        return jsonify(itens_enriquecidos)
+        with metricas.medir_etapa('sobreposicao_db'):
+            _enriquecer_com_dados_colaborativos(itens_pagina)
+
+        resposta = {
+            'total': total,
+            'total_geral': total_geral,
+            'pagina': pagina,
+            'por_pagina': por_pagina,
+            'total_paginas': (total + por_pagina - 1) // por_pagina,
+            'modalidades': modalidades,
+            # Partes que o PNCP não entregou (a próxima requisição tenta completar)
+            'completo': not relatorio['erros'],
+            # Idade dos dados do PNCP; 'desatualizado' indica que uma atualização já foi disparada
+            'gerado_em': datetime.fromtimestamp(entrada['gerado_em']).isoformat(timespec='seconds'),
+            'idade_segundos': idade_segundos,
+            'desatualizado': idade_segundos >= TTL_FRESCO_RELATORIO_SEG,
+            'erros': [
+                {campo: valor for campo, valor in erro.items() if campo != 'licitacao'}
+                for erro in relatorio['erros']
+            ]
+        }
+        if formato == 'completo':
+            resposta['itens'] = [
+                {**licitacoes[item['licitacao_id']].para_dict(), **item} for item in itens_pagina
+            ]
+        else:
+            resposta['licitacoes'] = {
+                item['licitacao_id']: licitacoes[item['licitacao_id']].para_dict() for item in itens_pagina
+            }
+            if formato == 'compacto':
+                resposta['itens'] = itens_pagina
+            else:
+                campos = list(dict.fromkeys(campo for item in itens_pagina for campo in item))
+                resposta['colunas'] = {
+                    campo: [item.get(campo) for item in itens_pagina] for campo in campos
+                }
+        return jsonify(resposta)
     
     except Exception as e:
         print(f"Erro ao processar API: {e}")
-        cache.delete_memoized(api_relatorio) 
+        cache.delete(_chave_cache_relatorio(cnpj, data_inicio, data_fim))
         return jsonify({"erro": f"Erro interno no servidor: {str(e)}"}), 500
     
+@app.route("/api/relatorio-fluxo", methods=['GET'])
+def api_relatorio_fluxo():
+    """
+    Relatório completo em NDJSON (um item por linha), enviado à medida que o
+    PNCP responde, sem montar o relatório em memória; útil para exportações
+    grandes. Se houver um relatório fresco em cache, ele é enviado de lá.
+    A última linha traz {"fim": true, "total": ..., "erros": [...]}.
+    """
+    cnpj = request.args.get('cnpj')
+    data_inicio = request.args.get('inicio')
+    data_fim = request.args.get('fim')
+
+    if not all([cnpj, data_inicio, data_fim]):
+        return jsonify({"erro": "Parâmetros 'cnpj', 'inicio' e 'fim' são obrigatórios"}), 400
+
+    chave = _chave_cache_relatorio(cnpj, data_inicio, data_fim)
+    entrada = cache.get(chave)
+    erros = []
+
+    if entrada is not None and not entrada['relatorio']['erros']:
+        # Completo em cache: enviado de lá, mesmo desatualizado (como em _obter_relatorio_pncp)
+        if _entrada_fresca(entrada):
+            metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='acerto')
+        else:
+            metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='desatualizado')
+            _agendar_atualizacao(chave, cnpj, data_inicio, data_fim)
+        itens = entrada['relatorio']['itens']
+    else:
+        try:
+            itens_pncp = buscador_pncp.iterar_relatorio(cnpj, data_inicio, data_fim, erros=erros)
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
+        itens = _itens_em_fluxo_coalescidos(chave, cnpj, data_inicio, data_fim, itens_pncp, erros)
+
+    def gerar_linhas():
+        total = 0
+        for item in itens:
+            yield json.dumps(item.para_dict(completo=True), ensure_ascii=False) + "\n"
+            total += 1
+        yield json.dumps({
+            'fim': True,
+            'total': total,
+            'erros': [{campo: valor for campo, valor in erro.items() if campo != 'licitacao'} for erro in erros]
+        }, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(gerar_linhas()), mimetype='application/x-ndjson')
+
+
+def _itens_em_fluxo_coalescidos(chave, cnpj, data_inicio, data_fim, itens_pncp, erros):
+    """
+    Gerador dos itens para o relatório em fluxo, com coalescência: só a
+    requisição líder consulta o PNCP, entregando os itens à medida que chegam
+    e guardando no cache o relatório montado se a busca for até o fim. As
+    demais esperam a líder e enviam o relatório do cache. Obs.: a trava fica
+    com a líder enquanto ela envia, então as demais esperam no ritmo do
+    cliente da líder (ver coalescencia.liderar). Se o cliente desconectar, o
+    fluxo é fechado, a trava é liberada e as seguidoras buscam de novo.
+    """
+    with coalescencia.liderar(chave) as voo:
+        entrada = cache.get(chave)
+        if voo is not None and not _entrada_fresca(entrada):
+            relatorio = {'licitacoes': {}, 'itens': [], 'erros': erros}
+            gerado_em = time.time()
+            if entrada is None:
+                metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='falha')
+            for item in itens_pncp:
+                relatorio['licitacoes'].setdefault(item.licitacao_id, item.licitacao)
+                relatorio['itens'].append(item)
+                yield item
+            voo.resultado = _guardar_relatorio(chave, entrada, relatorio, gerado_em)
+            return
+        itens_pncp.close()
+
+    # Seguidor (ou outro processo terminou antes): a líder já guardou o
+    # relatório; se ela não chegou ao fim, a busca é feita de forma coalescida
+    if voo is not None:
+        metricas.incrementar('cache_consultas_total', cache='relatorio', resultado='coalescido')
+    else:
+        entrada = _obter_relatorio_pncp(cnpj, data_inicio, data_fim)
+    erros.extend(entrada['relatorio']['erros'])
+    yield from entrada['relatorio']['itens']
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """Métricas deste processo no formato de exposição do Prometheus."""
+    if isinstance(cache.cache, cache_sqlite.CacheSQLite):
+        # Ocupação do cache compartilhado (vale para todos os processos)
+        for namespace, dados in cache.cache.estatisticas().items():
+            metricas.definir('cache_sqlite_entradas', dados['entradas'], namespace=namespace)
+            metricas.definir('cache_sqlite_bytes', dados['bytes'], namespace=namespace)
+    return Response(metricas.exportar_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/api/buscar-itens", methods=['GET'])
+def api_buscar_itens():
+    """
+    Busca textual (sem acentos, por relevância) nos itens já coletados do PNCP.
+    Usa apenas o índice local, nunca consulta o PNCP.
+    """
+    termo = request.args.get('q')
+    if not termo:
+        return jsonify({"erro": "Parâmetro 'q' é obrigatório"}), 400
+
+    try:
+        resultado = dados_locais.buscar_itens(
+            termo,
+            cnpj=request.args.get('cnpj'),
+            data_inicio=request.args.get('inicio'),
+            data_fim=request.args.get('fim'),
+            modalidade=request.args.get('modalidade'),
+            preco_min=_parametro_decimal('preco_min'),
+            preco_max=_parametro_decimal('preco_max'),
+            pagina=_parametro_inteiro('pagina', 1),
+            por_pagina=_parametro_inteiro(
+                'por_pagina', dados_locais.ITENS_POR_PAGINA_BUSCA, maximo=dados_locais.MAXIMO_ITENS_POR_PAGINA_BUSCA
+            )
+        )
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    return jsonify(resultado)
+
 @app.route('/api/contribuir', methods=['POST'])
 @login_required # Garante que só usuários logados podem chamar esta API
 def api_contribuir():
@@ -284,9 +883,8 @@ def api_contribuir():
         db.session.add(nova_contribuicao)
         db.session.commit()
         
-        # --- MUITO IMPORTANTE ---
-        # Limpa o cache para que a próxima busca já mostre o novo voto.
-        cache.clear()
+        # Não é preciso limpar o cache: os votos são cruzados com os itens
+        # do PNCP a cada requisição (ver _enriquecer_com_dados_colaborativos).
         
         print(f"Nova contribuição registrada por {current_user.username} para o item {item_key}")
         return jsonify({"sucesso": "Contribuição registrada com sucesso!"}), 201
@@ -298,6 +896,201 @@ def api_contribuir():
     
     
 
+# --- SUB-ITENS (DECOMPOSIÇÃO DE LOTES) ---
+
+LIMITE_SUB_ITENS_POR_IMPORTACAO = 5000
+TAMANHO_MAXIMO_DESCRICAO_SUB_ITEM = 500 # Mesmo tamanho da coluna SubItem.descricao
+# Mesmo formato de registros.Item.item_key: cnpj-ano-sequencial-numero_item
+PADRAO_ITEM_KEY = re.compile(r'\d{14}-\d{4}-\d+-\d+')
+
+
+# "1.234" sem vírgula: milhar em pt-BR ou decimal com ponto? Ambíguo, é recusado.
+PADRAO_MILHAR_SEM_DECIMAL = re.compile(r'\d{1,3}(\.\d{3})+')
+
+
+def _numero_importado(valor):
+    """
+    Aceita números do JSON ou texto do CSV, com decimal em vírgula ("1.234,56")
+    ou em ponto ("1234.56"). Texto só com pontos de milhar ("1.234") é recusado.
+    """
+    if valor is None or isinstance(valor, bool):
+        raise ValueError
+    if isinstance(valor, (int, float)):
+        numero = float(valor)
+    elif isinstance(valor, str):
+        texto = valor.strip()
+        if ',' in texto:
+            texto = texto.replace('.', '').replace(',', '.')
+        elif PADRAO_MILHAR_SEM_DECIMAL.fullmatch(texto):
+            raise ValueError
+        numero = float(texto)
+    else:
+        raise ValueError
+    if not math.isfinite(numero):
+        raise ValueError
+    return numero
+
+
+def _texto_importado(valor):
+    """Texto de uma célula/campo: aceita strings e números; outros tipos (listas, objetos) são inválidos."""
+    if valor is None:
+        return ''
+    if isinstance(valor, bool) or not isinstance(valor, (str, int, float)):
+        raise ValueError
+    return str(valor).strip()
+
+
+def _ler_linhas_importacao():
+    """Lê as linhas enviadas como JSON (lista ou {'sub_itens': [...]}) ou CSV (arquivo ou corpo)."""
+    if request.is_json:
+        dados = request.get_json(silent=True)
+        if isinstance(dados, dict):
+            dados = dados.get('sub_itens')
+        if not isinstance(dados, list):
+            raise ValueError("JSON deve ser uma lista de sub-itens ou {'sub_itens': [...]}.")
+        return dados
+
+    arquivo = request.files.get('arquivo')
+    conteudo = arquivo.read() if arquivo else request.get_data()
+    if not conteudo:
+        raise ValueError("Envie os sub-itens em JSON ou um CSV (campo 'arquivo').")
+    try:
+        texto = conteudo.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        texto = conteudo.decode('latin-1') # CSV salvo pelo Excel em pt-BR
+    # Aceita CSV com ';' (padrão do Excel em pt-BR, como o do buscador_pncp) ou ','
+    delimitador = ';' if texto.partition('\n')[0].count(';') >= texto.partition('\n')[0].count(',') else ','
+    return list(csv.DictReader(io.StringIO(texto), delimiter=delimitador))
+
+
+def _validar_sub_itens(linhas, item_key_padrao=None):
+    """Retorna (sub_itens válidos, erros por linha). Linhas começam em 1."""
+    validos, erros = [], []
+    for numero, linha in enumerate(linhas, start=1):
+        if not isinstance(linha, dict):
+            erros.append({'linha': numero, 'erro': "Cada sub-item deve ser um objeto."})
+            continue
+        problemas = []
+        try:
+            item_key = _texto_importado(
+                linha.get('parent_item_key') or linha.get('item_key') or item_key_padrao
+            )
+        except ValueError:
+            item_key = None
+        try:
+            descricao = _texto_importado(linha.get('descricao'))
+        except ValueError:
+            descricao = None
+
+        if item_key is None or not PADRAO_ITEM_KEY.fullmatch(item_key):
+            problemas.append(f"item_key inválido: {item_key!r}" if item_key is not None else "item_key deve ser texto")
+        if descricao is None:
+            problemas.append("descricao deve ser texto")
+        elif not descricao:
+            problemas.append("descricao é obrigatória")
+        elif len(descricao) > TAMANHO_MAXIMO_DESCRICAO_SUB_ITEM:
+            problemas.append(f"descricao passa de {TAMANHO_MAXIMO_DESCRICAO_SUB_ITEM} caracteres")
+        try:
+            quantidade = _numero_importado(linha.get('quantidade'))
+            if quantidade <= 0 or quantidade != int(quantidade):
+                raise ValueError
+        except ValueError:
+            problemas.append("quantidade deve ser um inteiro positivo")
+        try:
+            valor_unitario = _numero_importado(linha.get('valor_unitario'))
+            if valor_unitario < 0:
+                raise ValueError
+        except ValueError:
+            problemas.append("valor_unitario deve ser um número maior ou igual a zero")
+
+        if problemas:
+            erros.append({'linha': numero, 'erro': '; '.join(problemas)})
+        else:
+            validos.append({
+                'parent_item_key': item_key,
+                'descricao': descricao,
+                'quantidade': int(quantidade),
+                'valor_unitario': valor_unitario
+            })
+    return validos, erros
+
+
+@app.route('/api/sub-itens/importar', methods=['POST'])
+@login_required
+def api_importar_sub_itens():
+    """
+    Importa em lote a decomposição de lotes em sub-itens, a partir de JSON
+    ou CSV com as colunas parent_item_key (ou item_key), descricao,
+    quantidade e valor_unitario. 'item_key' na query string vale para as
+    linhas sem chave. Tudo ou nada: com qualquer linha inválida nada é
+    gravado e os erros voltam por linha.
+    """
+    try:
+        linhas = _ler_linhas_importacao()
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    except csv.Error as e:
+        return jsonify({"erro": f"CSV inválido: {e}"}), 400
+
+    if not linhas:
+        return jsonify({"erro": "Nenhum sub-item enviado."}), 400
+    if len(linhas) > LIMITE_SUB_ITENS_POR_IMPORTACAO:
+        return jsonify({"erro": f"Máximo de {LIMITE_SUB_ITENS_POR_IMPORTACAO} sub-itens por importação."}), 400
+
+    sub_itens, erros = _validar_sub_itens(linhas, request.args.get('item_key'))
+    if erros:
+        return jsonify({"erro": "Sub-itens inválidos; nada foi importado.", "linhas": erros}), 400
+
+    agora = datetime.utcnow()
+    for sub_item in sub_itens:
+        sub_item.update(user_id=current_user.id, created_at=agora)
+
+    try:
+        # Um único INSERT com executemany, numa única transação
+        with metricas.medir_etapa('importacao_sub_itens'):
+            db.session.execute(db.insert(SubItem), sub_itens)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao importar sub-itens: {e}")
+        return jsonify({"erro": "Erro interno ao salvar os sub-itens."}), 500
+
+    itens_pai = sorted({sub_item['parent_item_key'] for sub_item in sub_itens})
+    print(f"{current_user.username} importou {len(sub_itens)} sub-itens em {len(itens_pai)} item(ns).")
+    return jsonify({"importados": len(sub_itens), "itens": itens_pai}), 201
+
+
+@app.route('/api/sub-itens/<item_key>', methods=['GET'])
+def api_sub_itens(item_key):
+    """Linhas de sub-itens de um item, com os totais (os mesmos do relatório)."""
+    linhas = db.session.execute(
+        db.select(SubItem, User.username)
+        .join(User, SubItem.user_id == User.id)
+        .where(SubItem.parent_item_key == item_key)
+        .order_by(SubItem.id)
+    ).all()
+    totais = _totais_sub_itens([item_key]).get(item_key)
+    return jsonify({
+        'item_key': item_key,
+        'total_sub_itens': totais[0] if totais else 0,
+        'valor_total': totais[1] if totais else None,
+        'sub_itens': [{
+            'id': s.id,
+            'descricao': s.descricao,
+            'quantidade': s.quantidade,
+            'valor_unitario': s.valor_unitario,
+            'autor': autor,
+            'criado_em': s.created_at.isoformat(timespec='seconds') if s.created_at else None
+        } for s, autor in linhas]
+    })
+
+
+# --- AQUECEDOR DE CACHE ---
+# Com AQUECEDOR_CACHE=1 o agendador roda numa thread deste processo;
+# alternativamente, rode "python aquecedor_cache.py" como daemon separado.
+if os.environ.get('AQUECEDOR_CACHE') == '1':
+    aquecedor_cache.iniciar_em_segundo_plano(aquecer_relatorio)
+
 
 if __name__ == '__main__':
     # Cria o banco de dados se ele não existir
@@ -0,0 +1,213 @@
+"""
+Aquecedor do cache de relatórios: pré-calcula, fora do horário de pico, os
+relatórios dos órgãos monitorados (lista em JSON), para que os painéis da
+manhã abram direto do cache em vez de cada usuário disparar uma busca fria.
+
+Formato da lista monitorada:
+    {
+      "monitorados": [
+        {"cnpj": "12345678000199", "nome": "Prefeitura X",
+         "janelas": ["ultimos_30_dias", "mes_atual"]}
+      ]
+    }
+
+Janelas aceitas: 'mes_atual', 'mes_anterior' e 'ultimos_N_dias'.
+
+Uso:
+    python aquecedor_cache.py            # daemon: roda um ciclo por dia na janela fora de pico
+    python aquecedor_cache.py --agora    # roda um ciclo imediatamente e sai
+
+Ou dentro do app Flask, com AQUECEDOR_CACHE=1 no ambiente.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import coalescencia
+import metricas
+
+# --- CONFIGURAÇÕES ---
+basedir = os.path.abspath(os.path.dirname(__file__))
+CAMINHO_LISTA_MONITORADA = os.environ.get('LISTA_MONITORADA', os.path.join(basedir, 'monitorados.json'))
+CAMINHO_ESTADO_AQUECEDOR = os.environ.get('ESTADO_AQUECEDOR', os.path.join(basedir, 'aquecedor_estado.json'))
+
+# Janela fora de pico (hora local): das 2h às 6h
+HORA_INICIO_FORA_PICO = 2
+HORA_FIM_FORA_PICO = 6
+INTERVALO_VERIFICACAO_SEG = 300 # De quanto em quanto tempo o daemon confere o relógio
+PAUSA_ENTRE_RELATORIOS_SEG = 5 # Folga para o PNCP entre um órgão e outro
+
+JANELAS_PADRAO = ["ultimos_30_dias", "mes_atual"]
+
+
+# --- LISTA MONITORADA E JANELAS ---
+
+def carregar_lista_monitorada(caminho=None):
+    caminho = caminho or CAMINHO_LISTA_MONITORADA
+    with open(caminho, encoding='utf-8') as f:
+        dados = json.load(f)
+    monitorados = dados.get('monitorados', [])
+    for entrada in monitorados:
+        if not entrada.get('cnpj'):
+            raise ValueError(f"Entrada sem 'cnpj' na lista monitorada: {entrada}")
+        entrada.setdefault('janelas', JANELAS_PADRAO)
+    return monitorados
+
+
+def resolver_janela(janela, hoje=None):
+    """Converte o nome da janela em (data_inicio, data_fim) no formato AAAAMMDD da API."""
+    hoje = hoje or date.today()
+
+    if janela == 'mes_atual':
+        inicio, fim = hoje.replace(day=1), hoje
+    elif janela == 'mes_anterior':
+        fim = hoje.replace(day=1) - timedelta(days=1)
+        inicio = fim.replace(day=1)
+    else:
+        encontrado = re.fullmatch(r'ultimos_(\d+)_dias', janela)
+        if not encontrado:
+            raise ValueError(f"Janela desconhecida: {janela}")
+        inicio, fim = hoje - timedelta(days=int(encontrado.group(1))), hoje
+
+    return inicio.strftime('%Y%m%d'), fim.strftime('%Y%m%d')
+
+
+def dentro_do_horario_fora_pico(agora=None):
+    hora = (agora or datetime.now()).hour
+    return HORA_INICIO_FORA_PICO <= hora < HORA_FIM_FORA_PICO
+
+
+# --- ESTADO (TEMPOS DE EXECUÇÃO) ---
+
+def carregar_estado():
+    try:
+        with open(CAMINHO_ESTADO_AQUECEDOR, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'ultimo_ciclo': None, 'relatorios': {}}
+
+
+def salvar_estado(estado):
+    # Grava num arquivo temporário e renomeia, para não deixar o JSON pela metade
+    temporario = CAMINHO_ESTADO_AQUECEDOR + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, CAMINHO_ESTADO_AQUECEDOR)
+
+
+# --- CICLO DE AQUECIMENTO ---
+
+def executar_ciclo(aquecer, monitorados, hoje=None):
+    """
+    Aquece todos os relatórios da lista. 'aquecer(cnpj, inicio, fim)' deve
+    devolver None se o relatório em cache ainda estava fresco, ou o relatório
+    recém-calculado (ver app.aquecer_relatorio).
+    """
+    estado = carregar_estado()
+    inicio_ciclo = time.time()
+    resumo = {'aquecidos': 0, 'frescos': 0, 'falhas': 0}
+
+    print(f"--- Aquecendo cache: {len(monitorados)} órgão(s) monitorado(s) ---")
+    for monitorado in monitorados:
+        cnpj = monitorado['cnpj']
+        for janela in monitorado['janelas']:
+            data_inicio, data_fim = resolver_janela(janela, hoje)
+            chave = f"{cnpj}:{janela}"
+            registro = {'data_inicio': data_inicio, 'data_fim': data_fim,
+                        'executado_em': datetime.now().isoformat(timespec='seconds')}
+
+            inicio = time.perf_counter()
+            try:
+                relatorio = aquecer(cnpj, data_inicio, data_fim)
+            except Exception as e:
+                print(f"  {chave}: falha ao aquecer ({e})")
+                registro.update(resultado='falha', erro=str(e))
+                resumo['falhas'] += 1
+            else:
+                if relatorio is None:
+                    print(f"  {chave}: cache ainda fresco, nada a fazer.")
+                    registro['resultado'] = 'fresco'
+                    resumo['frescos'] += 1
+                else:
+                    print(f"  {chave}: {len(relatorio['itens'])} itens, {len(relatorio['erros'])} falha(s) no PNCP.")
+                    registro.update(resultado='aquecido', itens=len(relatorio['itens']),
+                                    erros_pncp=len(relatorio['erros']))
+                    resumo['aquecidos'] += 1
+            registro['duracao_seg'] = round(time.perf_counter() - inicio, 2)
+            metricas.incrementar('aquecimentos_total', resultado=registro['resultado'])
+
+            estado['relatorios'][chave] = registro
+            salvar_estado(estado)
+
+            if registro['resultado'] == 'aquecido':
+                time.sleep(PAUSA_ENTRE_RELATORIOS_SEG)
+
+    estado['ultimo_ciclo'] = {
+        'data': (hoje or date.today()).isoformat(),
+        'inicio': datetime.fromtimestamp(inicio_ciclo).isoformat(timespec='seconds'),
+        'duracao_seg': round(time.time() - inicio_ciclo, 2),
+        **resumo
+    }
+    salvar_estado(estado)
+    print(f"--- Aquecimento concluído em {estado['ultimo_ciclo']['duracao_seg']}s: {resumo} ---")
+    return resumo
+
+
+def _ciclo_pendente_hoje(agora=None):
+    """Um ciclo por dia, dentro da janela fora de pico."""
+    agora = agora or datetime.now()
+    if not dentro_do_horario_fora_pico(agora):
+        return False
+    ultimo_ciclo = carregar_estado().get('ultimo_ciclo')
+    return not ultimo_ciclo or ultimo_ciclo.get('data') != agora.date().isoformat()
+
+
+def executar_daemon(aquecer, parar=None):
+    """Laço do agendador. 'parar' (threading.Event) permite encerrá-lo."""
+    parar = parar or threading.Event()
+    print(f"Aquecedor de cache ativo (janela fora de pico: {HORA_INICIO_FORA_PICO}h-{HORA_FIM_FORA_PICO}h).")
+    while not parar.is_set():
+        # A trava evita que vários workers do Gunicorn aqueçam ao mesmo tempo;
+        # quem chegar depois encontra o ciclo do dia já registrado.
+        with coalescencia.trava_entre_processos('aquecedor_cache'):
+            if _ciclo_pendente_hoje():
+                try:
+                    executar_ciclo(aquecer, carregar_lista_monitorada())
+                except (OSError, ValueError) as e:
+                    print(f"Erro no ciclo do aquecedor: {e}")
+        parar.wait(INTERVALO_VERIFICACAO_SEG)
+
+
+def iniciar_em_segundo_plano(aquecer):
+    """Roda o agendador numa thread daemon dentro do próprio processo (app Flask)."""
+    parar = threading.Event()
+    threading.Thread(
+        target=executar_daemon, args=(aquecer, parar), name='aquecedor-cache', daemon=True
+    ).start()
+    return parar
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pré-calcula os relatórios dos órgãos monitorados.")
+    parser.add_argument('--lista', help="Arquivo JSON com os órgãos monitorados")
+    parser.add_argument('--agora', action='store_true',
+                        help="Roda um ciclo imediatamente, fora da janela, e sai")
+    args = parser.parse_args()
+
+    if args.lista:
+        CAMINHO_LISTA_MONITORADA = args.lista
+
+    # Importado aqui para usar o mesmo cache e a mesma configuração do site
+    from app import aquecer_relatorio
+
+    if args.agora:
+        executar_ciclo(aquecer_relatorio, carregar_lista_monitorada())
+    else:
+        try:
+            executar_daemon(aquecer_relatorio)
+        except KeyboardInterrupt:
+            print("\nAquecedor encerrado.")
@@ -0,0 +1,427 @@
+"""
+Benchmarks offline: roda os cenários contra o servidor mock (fixtures
+gravadas do PNCP e do Buscapé) e salva um relatório JSON comparável entre
+commits.
+
+Uso:
+    python -m benchmarks.executar --saida base.json
+    python -m benchmarks.executar --latencia 0.05 --taxa-429 0.05 --saida novo.json
+    python -m benchmarks.executar --comparar base.json novo.json
+"""
+import argparse
+import contextlib
+import gc
+import hashlib
+import io
+import json
+import os
+import pickle
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.servidor_mock import (
+    ARQUIVO_FIXTURE_PNCP, PREFIXO_CONSULTA, PREFIXO_INTEGRACAO, ROTA_BUSCAPE, ServidorMock
+)
+
+# --- CONFIGURAÇÕES PADRÃO ---
+REPETICOES_PADRAO = 3
+WORKERS_PADRAO = [1, 5, 10, 20]
+LIMIAR_VARIACAO_PERCENTUAL = 0.10 # Variações menores que 10% são consideradas ruído
+
+
+# --- UTILITÁRIOS ---
+
+def _commit_atual():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentil(valores, percentual):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, round(percentual * (len(ordenados) - 1)))
+    return ordenados[indice]
+
+
+def _medir(funcao, repeticoes, preparar=None, servidor=None):
+    """
+    Executa 'funcao' várias vezes, com a saída do terminal suprimida.
+    Retorna as estatísticas de tempo e o número de requisições ao mock
+    na última repetição.
+    """
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        if preparar:
+            preparar()
+        if servidor:
+            servidor.zerar_contagem()
+        with contextlib.redirect_stdout(io.StringIO()):
+            inicio = time.perf_counter()
+            resultado = funcao()
+            tempos.append(time.perf_counter() - inicio)
+
+    medicao = {
+        'repeticoes': repeticoes,
+        'tempos_seg': [round(t, 4) for t in tempos],
+        'min_seg': round(min(tempos), 4),
+        'mediana_seg': round(statistics.median(tempos), 4),
+        'p95_seg': round(_percentil(tempos, 0.95), 4)
+    }
+    if servidor:
+        medicao['requisicoes'] = dict(sorted(servidor.contagem_requisicoes.items()))
+    return medicao, resultado
+
+
+def _versao_fixture():
+    """Hash curto da fixture do PNCP: medições com fixtures diferentes não são comparáveis."""
+    with open(ARQUIVO_FIXTURE_PNCP, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def _configurar_buscador(servidor, args):
+    import buscador_pncp
+    import resiliencia
+    buscador_pncp.URL_API_PNCP_CONSULTA_BASE = servidor.url_base + PREFIXO_CONSULTA
+    buscador_pncp.URL_API_PNCP_INTEGRACAO_BASE = servidor.url_base + PREFIXO_INTEGRACAO
+    if args.pausa is not None:
+        buscador_pncp.PAUSA_ENTRE_REQUISICOES_SEG = args.pausa
+    # A poda depende do histórico acumulado entre execuções e mudaria o número de
+    # requisições de um cenário para outro; ela é medida só em relatorio_poda
+    buscador_pncp.PODAR_MODALIDADES = False
+    # Sem --taxa-maxima o limitador fica desligado: o balde se esvaziaria entre
+    # as repetições e o benchmark mediria só o teto de requisições por segundo
+    buscador_pncp.LIMITADOR_PNCP = (
+        resiliencia.LimitadorTaxa('pncp', args.taxa_maxima) if args.taxa_maxima else None
+    )
+    return buscador_pncp
+
+
+def _importar_monitor(servidor, pausa):
+    """O monitor depende do spaCy e do modelo pt_core_news_sm; sem eles o cenário é pulado."""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import monitor
+    except (ImportError, SystemExit):
+        return None
+    monitor.URL_BUSCAPE_BUSCA = servidor.url_base + ROTA_BUSCAPE
+    if pausa is not None:
+        monitor.PAUSA_ENTRE_REQUISICOES_SEG = pausa
+    return monitor
+
+
+# --- CENÁRIOS ---
+
+def cenario_relatorio_bruto(servidor, args, workers):
+    buscador_pncp = _configurar_buscador(servidor, args)
+    fixture = servidor.fixture_pncp
+    buscador_pncp.MAX_WORKERS_THREADS = workers
+
+    medicao, itens = _medir(
+        lambda: buscador_pncp.gerar_relatorio_bruto(fixture['cnpj'], fixture['data_inicio'], fixture['data_fim']),
+        args.repeticoes, servidor=servidor
+    )
+    medicao['itens'] = len(itens)
+    return medicao
+
+
+def cenario_relatorio_poda(servidor, args):
+    """
+    Relatório bruto com a poda de modalidades ligada e o histórico já formado
+    (as modalidades vazias da fixture são puladas). O histórico é zerado antes,
+    e o período termina hoje para a poda valer (o mock ignora as datas).
+    """
+    buscador_pncp = _configurar_buscador(servidor, args)
+    import dados_locais
+    buscador_pncp.PODAR_MODALIDADES = True
+    fixture = servidor.fixture_pncp
+    hoje = datetime.now()
+    periodo = (fixture['cnpj'], (hoje - timedelta(days=20)).strftime('%Y%m%d'), hoje.strftime('%Y%m%d'))
+
+    conexao = dados_locais.conectar()
+    try:
+        with conexao:
+            conexao.execute("DELETE FROM estatisticas_modalidades")
+    finally:
+        conexao.close()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(dados_locais.MINIMO_CONSULTAS_VAZIAS_PARA_PODAR):
+            buscador_pncp.gerar_relatorio_bruto(*periodo)
+
+    medicao, itens = _medir(lambda: buscador_pncp.gerar_relatorio_bruto(*periodo), args.repeticoes, servidor=servidor)
+    medicao['itens'] = len(itens)
+    return medicao
+
+
+def cenario_memoria_relatorio(servidor, args):
+    """
+    Memória do relatório normalizado, medida com tracemalloc: o pico durante
+    a geração e o que continua ocupado depois de pronto. Use --fator-escala
+    para simular relatórios grandes.
+    """
+    buscador_pncp = _configurar_buscador(servidor, args)
+    fixture = servidor.fixture_pncp
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            relatorio = buscador_pncp.gerar_relatorio_normalizado(
+                fixture['cnpj'], fixture['data_inicio'], fixture['data_fim']
+            )
+        gc.collect()
+        retida, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    itens = len(relatorio['itens'])
+    return {
+        'itens': itens,
+        'pico_memoria_mb': round(pico / 2**20, 3),
+        'memoria_retida_mb': round(retida / 2**20, 3),
+        'bytes_por_item': round(retida / itens) if itens else None,
+        # Tamanho da entrada serializada no cache do Flask
+        'bytes_cache': len(pickle.dumps(relatorio))
+    }
+
+
+def cenario_nlp_monitor(servidor, args):
+    monitor = _importar_monitor(servidor, args.pausa)
+    if monitor is None:
+        return {'pulado': "spaCy ou modelo pt_core_news_sm não instalado"}
+
+    descricoes = [item['descricao'] for itens in servidor.fixture_pncp['itens'].values() for item in itens]
+
+    def analisar():
+        # Quantidade=1 força a análise completa (heurísticas de kit e plural)
+        for descricao in descricoes:
+            monitor.detectar_inconsistencia_quantidade(descricao, 1)
+
+    medicao, _ = _medir(analisar, args.repeticoes)
+    medicao['descricoes'] = len(descricoes)
+    return medicao
+
+
+def cenario_extracao_preco(servidor, args):
+    monitor = _importar_monitor(servidor, args.pausa)
+    if monitor is None:
+        return {'pulado': "spaCy ou modelo pt_core_news_sm não instalado"}
+
+    descricoes = sorted({
+        item['descricao'] for itens in servidor.fixture_pncp['itens'].values() for item in itens
+        if item.get('materialOuServicoNome') == 'Material'
+    })
+
+    def buscar(descricao):
+        try:
+            return monitor.buscar_preco_varejo(descricao)
+        except monitor.ErroBuscaVarejo: # Ex.: --taxa-erro
+            return None
+
+    def extrair():
+        return [buscar(descricao) for descricao in descricoes]
+
+    medicao, precos = _medir(extrair, args.repeticoes, servidor=servidor)
+    medicao['descricoes'] = len(descricoes)
+    medicao['precos_encontrados'] = sum(1 for preco in precos if preco is not None)
+    return medicao
+
+
+def cenarios_api_relatorio(servidor, args, pasta_temporaria):
+    """Requisição completa ao Flask: cache frio (busca no PNCP) e cache quente."""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(pasta_temporaria, 'site.db')
+    os.environ['CACHE_DIR'] = os.path.join(pasta_temporaria, 'cache')
+    os.environ['CACHE_SQLITE_CAMINHO'] = os.path.join(pasta_temporaria, 'cache.db')
+
+    _configurar_buscador(servidor, args)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as aplicacao
+    with aplicacao.app.app_context():
+        aplicacao.db.create_all()
+
+    fixture = servidor.fixture_pncp
+    url = f"/api/gerar-relatorio?cnpj={fixture['cnpj']}&inicio={fixture['data_inicio']}&fim={fixture['data_fim']}"
+    cliente = aplicacao.app.test_client()
+
+    def requisitar():
+        response = cliente.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200, response.status_code
+        return response
+
+    def limpar_cache():
+        with aplicacao.app.app_context():
+            aplicacao.cache.clear()
+
+    resultados = {}
+    resultados['api_relatorio_frio'], response = _medir(
+        requisitar, args.repeticoes, preparar=limpar_cache, servidor=servidor
+    )
+    resultados['api_relatorio_frio']['bytes_resposta'] = len(response.data)
+    resultados['api_relatorio_quente'], _ = _medir(requisitar, args.repeticoes, servidor=servidor)
+    return resultados
+
+
+def executar_cenarios(args):
+    relatorio = {
+        'commit': _commit_atual(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'configuracao': {
+            'repeticoes': args.repeticoes,
+            'latencia_seg': args.latencia,
+            'variacao_latencia_seg': args.variacao_latencia,
+            'taxa_erro': args.taxa_erro,
+            'taxa_429': args.taxa_429,
+            'fator_escala': args.fator_escala,
+            'pausa_seg': args.pausa,
+            'taxa_maxima': args.taxa_maxima,
+            'semente': args.semente,
+            'fixture_pncp': _versao_fixture()
+        },
+        'cenarios': {},
+        # {cenario: motivo}; o cenário também fica em 'cenarios' como {'pulado': motivo}
+        'cenarios_pulados': {}
+    }
+    cenarios = relatorio['cenarios']
+
+    def selecionado(nome):
+        return not args.cenarios or any(nome.startswith(prefixo) for prefixo in args.cenarios)
+
+    servidor = ServidorMock(
+        latencia_seg=args.latencia, variacao_latencia_seg=args.variacao_latencia,
+        taxa_erro=args.taxa_erro, taxa_429=args.taxa_429, retry_after_seg=args.retry_after,
+        fator_escala=args.fator_escala, semente=args.semente
+    )
+    with servidor, tempfile.TemporaryDirectory() as pasta_temporaria:
+        # Banco local (índice e estatísticas de modalidades) isolado por execução;
+        # precisa ser definido antes do primeiro import de dados_locais
+        os.environ['DADOS_PNCP_DB'] = os.path.join(pasta_temporaria, 'dados_pncp.db')
+
+        for workers in args.workers:
+            nome = f"relatorio_bruto[workers={workers}]"
+            if selecionado(nome):
+                print(f"Executando {nome}...")
+                cenarios[nome] = cenario_relatorio_bruto(servidor, args, workers)
+
+        if selecionado('relatorio_poda'):
+            print("Executando relatorio_poda...")
+            cenarios['relatorio_poda'] = cenario_relatorio_poda(servidor, args)
+
+        if selecionado('memoria_relatorio'):
+            print("Executando memoria_relatorio...")
+            cenarios['memoria_relatorio'] = cenario_memoria_relatorio(servidor, args)
+
+        if selecionado('nlp_monitor'):
+            print("Executando nlp_monitor...")
+            cenarios['nlp_monitor'] = cenario_nlp_monitor(servidor, args)
+
+        if selecionado('extracao_preco'):
+            print("Executando extracao_preco...")
+            cenarios['extracao_preco'] = cenario_extracao_preco(servidor, args)
+
+        if selecionado('api_relatorio'):
+            print("Executando api_relatorio...")
+            cenarios.update(cenarios_api_relatorio(servidor, args, pasta_temporaria))
+
+    for nome, medicao in cenarios.items():
+        if 'pulado' in medicao:
+            relatorio['cenarios_pulados'][nome] = medicao['pulado']
+            print(f"Aviso: cenário {nome} pulado ({medicao['pulado']}).")
+    return relatorio
+
+
+# --- COMPARAÇÃO ENTRE EXECUÇÕES ---
+
+def _sem_comparacao(medicao_base, medicao_nova):
+    """Motivo para não comparar um cenário (pulado ou ausente em uma das execuções), ou None."""
+    for rotulo, medicao in (('base', medicao_base), ('novo', medicao_nova)):
+        if medicao is None:
+            return f"ausente em {rotulo}"
+        if 'pulado' in medicao:
+            return f"pulado em {rotulo}: {medicao['pulado']}"
+    return None
+
+
+def comparar(caminho_base, caminho_novo):
+    with open(caminho_base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(caminho_novo, encoding='utf-8') as f:
+        novo = json.load(f)
+
+    if base.get('configuracao') != novo.get('configuracao'):
+        print("Aviso: as execuções usaram configurações diferentes; a comparação pode não ser justa.")
+
+    nomes = list(novo['cenarios']) + [nome for nome in base['cenarios'] if nome not in novo['cenarios']]
+    print(f"\n{'Cenário':<32} {base.get('commit') or 'base':>12} {novo.get('commit') or 'novo':>12} {'Variação':>10}")
+    for nome in nomes:
+        medicao_base, medicao_nova = base['cenarios'].get(nome), novo['cenarios'].get(nome)
+        motivo = _sem_comparacao(medicao_base, medicao_nova)
+        if motivo:
+            print(f"{nome:<32} (sem comparação: {motivo})")
+            continue
+        if 'mediana_seg' not in medicao_base or 'mediana_seg' not in medicao_nova:
+            continue
+
+        antes, depois = medicao_base['mediana_seg'], medicao_nova['mediana_seg']
+        variacao = (depois - antes) / antes if antes else 0.0
+        marcador = ""
+        if variacao > LIMIAR_VARIACAO_PERCENTUAL:
+            marcador = " (mais lento)"
+        elif variacao < -LIMIAR_VARIACAO_PERCENTUAL:
+            marcador = " (mais rápido)"
+        print(f"{nome:<32} {antes:>11.3f}s {depois:>11.3f}s {variacao:>+9.1%}{marcador}")
+
+    print(f"\n{'Memória':<32} {base.get('commit') or 'base':>12} {novo.get('commit') or 'novo':>12} {'Variação':>10}")
+    for nome in nomes:
+        medicao_base, medicao_nova = base['cenarios'].get(nome), novo['cenarios'].get(nome)
+        if _sem_comparacao(medicao_base, medicao_nova):
+            continue
+        for campo in ('pico_memoria_mb', 'memoria_retida_mb'):
+            if campo not in medicao_nova or not medicao_base.get(campo):
+                continue
+            antes, depois = medicao_base[campo], medicao_nova[campo]
+            variacao = (depois - antes) / antes
+            print(f"{nome + ' ' + campo:<32} {antes:>10.2f}MB {depois:>10.2f}MB {variacao:>+9.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks offline do monitor de licitações.")
+    parser.add_argument('--comparar', nargs=2, metavar=('BASE', 'NOVO'), help="Compara dois relatórios JSON")
+    parser.add_argument('--saida', help="Arquivo JSON onde salvar o relatório")
+    parser.add_argument('--cenarios', nargs='*', help="Prefixos dos cenários a executar (padrão: todos)")
+    parser.add_argument('--repeticoes', type=int, default=REPETICOES_PADRAO)
+    parser.add_argument('--workers', type=int, nargs='+', default=WORKERS_PADRAO,
+                        help="Valores de MAX_WORKERS_THREADS para o cenário relatorio_bruto")
+    parser.add_argument('--pausa', type=float, default=None,
+                        help="Sobrescreve PAUSA_ENTRE_REQUISICOES_SEG (padrão: valor do código)")
+    parser.add_argument('--taxa-maxima', type=float, default=None,
+                        help="Requisições/s do limitador do PNCP (padrão: sem limite)")
+    parser.add_argument('--latencia', type=float, default=0.0)
+    parser.add_argument('--variacao-latencia', type=float, default=0.0)
+    parser.add_argument('--taxa-erro', type=float, default=0.0)
+    parser.add_argument('--taxa-429', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--fator-escala', type=int, default=1)
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.comparar:
+        comparar(*args.comparar)
+        sys.exit(0)
+
+    relatorio = executar_cenarios(args)
+
+    print(json.dumps(relatorio['cenarios'], ensure_ascii=False, indent=2))
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"\nRelatório salvo em {args.saida}")
@@ -0,0 +1,99 @@
+"""
+Grava respostas reais do PNCP e do Buscapé nas fixtures usadas pelo
+servidor mock dos benchmarks. Precisa de acesso à internet.
+
+Uso:
+    python -m benchmarks.gravar_fixtures --cnpj 13825484000150 --inicio 20251001 --fim 20251021
+"""
+import argparse
+import json
+import time
+
+import requests
+
+import buscador_pncp
+from benchmarks.servidor_mock import ARQUIVO_FIXTURE_BUSCAPE, ARQUIVO_FIXTURE_PNCP
+
+PAUSA_ENTRE_REQUISICOES_SEG = 1
+TAMANHO_PAGINA_GRAVACAO = 50
+TERMO_BUSCA_BUSCAPE = "papel sulfite a4"
+
+
+def gravar_consulta(cnpj, data_inicio, data_fim):
+    """Guarda, por modalidade, todas as licitações (dados crus da API de consulta)."""
+    url = f"{buscador_pncp.URL_API_PNCP_CONSULTA_BASE}{buscador_pncp.ENDPOINT_PNCP_BUSCA_LICITACOES}"
+    consulta = {}
+    for cod_modalidade in buscador_pncp.MODALIDADES:
+        pagina = 1
+        while True:
+            print(f"  Gravando Modalidade {cod_modalidade}, Página {pagina}...")
+            time.sleep(PAUSA_ENTRE_REQUISICOES_SEG)
+            response = requests.get(url, headers={'Accept': 'application/json'}, timeout=60, params={
+                "dataInicial": data_inicio,
+                "dataFinal": data_fim,
+                "cnpj": cnpj,
+                "codigoModalidadeContratacao": cod_modalidade,
+                "pagina": pagina,
+                "tamanhoPagina": TAMANHO_PAGINA_GRAVACAO
+            })
+            if response.status_code != 200:
+                break
+            dados = response.json()
+            consulta.setdefault(str(cod_modalidade), []).extend(dados.get('data', []))
+            if pagina >= dados.get('totalPaginas', 1):
+                break
+            pagina += 1
+    return consulta
+
+
+def gravar_itens(cnpj, consulta):
+    itens = {}
+    for licitacoes in consulta.values():
+        for lic in licitacoes:
+            ano, sequencial = lic.get('anoCompra'), lic.get('sequencialCompra')
+            print(f"  Gravando itens da licitação {ano}/{sequencial}...")
+            url = f"{buscador_pncp.URL_API_PNCP_INTEGRACAO_BASE}/v1/orgaos/{cnpj}/compras/{ano}/{sequencial}/itens"
+            time.sleep(PAUSA_ENTRE_REQUISICOES_SEG)
+            response = requests.get(url, headers={'Accept': 'application/json'}, timeout=20)
+            if response.status_code == 200:
+                itens[f"{ano}/{sequencial}"] = response.json()
+    return itens
+
+
+def gravar_buscape(termo):
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+    response = requests.get("https://www.buscape.com.br/search", params={'q': termo}, headers=headers, timeout=20)
+    response.raise_for_status()
+    return response.content
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grava fixtures reais para os benchmarks.")
+    parser.add_argument('--cnpj', required=True)
+    parser.add_argument('--inicio', required=True, help="YYYYMMDD")
+    parser.add_argument('--fim', required=True, help="YYYYMMDD")
+    parser.add_argument('--sem-buscape', action='store_true', help="Não regrava a página do Buscapé")
+    args = parser.parse_args()
+
+    print("--- Gravando consulta de licitações ---")
+    consulta = gravar_consulta(args.cnpj, args.inicio, args.fim)
+    print("--- Gravando itens ---")
+    itens = gravar_itens(args.cnpj, consulta)
+
+    with open(ARQUIVO_FIXTURE_PNCP, 'w', encoding='utf-8') as f:
+        json.dump({
+            '_origem': f"Gravado do PNCP em {time.strftime('%Y-%m-%d')}",
+            'cnpj': args.cnpj,
+            'data_inicio': args.inicio,
+            'data_fim': args.fim,
+            'consulta': consulta,
+            'itens': itens
+        }, f, ensure_ascii=False, indent=1)
+    print(f"Fixture salva em {ARQUIVO_FIXTURE_PNCP}")
+
+    if not args.sem_buscape:
+        with open(ARQUIVO_FIXTURE_BUSCAPE, 'wb') as f:
+            f.write(gravar_buscape(TERMO_BUSCA_BUSCAPE))
+        print(f"Fixture salva em {ARQUIVO_FIXTURE_BUSCAPE}")
@@ -0,0 +1,233 @@
+"""
+Servidor HTTP local que reproduz respostas gravadas do PNCP (consulta e
+integração) e páginas de busca do Buscapé, para medir desempenho sem rede.
+
+Uso avulso:
+    python -m benchmarks.servidor_mock --porta 8765 --latencia 0.05 --taxa-429 0.1
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# --- CONFIGURAÇÕES ---
+PASTA_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+ARQUIVO_FIXTURE_PNCP = os.path.join(PASTA_FIXTURES, 'pncp.json')
+ARQUIVO_FIXTURE_BUSCAPE = os.path.join(PASTA_FIXTURES, 'buscape.html')
+
+# Licitações clonadas pelo fator de escala recebem sequenciais a partir daqui
+DESLOCAMENTO_SEQUENCIAL_CLONE = 100000
+
+# --- ROTAS (mesmos caminhos das APIs reais) ---
+PREFIXO_CONSULTA = "/api/consulta"
+PREFIXO_INTEGRACAO = "/api/pncp"
+ROTA_BUSCA_LICITACOES = PREFIXO_CONSULTA + "/v1/contratacoes/publicacao"
+# Publicadas ou alteradas no período; o mock responde com as mesmas licitações
+ROTA_BUSCA_ATUALIZADAS = PREFIXO_CONSULTA + "/v1/contratacoes/atualizacao"
+ROTA_ITENS = re.compile(PREFIXO_INTEGRACAO + r"/v1/orgaos/(\d+)/compras/(\d+)/(\d+)/itens$")
+ROTA_BUSCAPE = "/search"
+
+
+class ServidorMock:
+    """
+    Sobe o servidor em uma thread. Comportamento configurável:
+      latencia_seg / variacao_latencia_seg -> atraso de cada resposta
+      taxa_erro   -> fração das requisições respondidas com 503
+      taxa_429    -> fração respondida com 429 + Retry-After
+      fator_escala -> multiplica o número de licitações (clones das gravadas)
+    """
+
+    def __init__(self, porta=0, latencia_seg=0.0, variacao_latencia_seg=0.0, taxa_erro=0.0,
+                 taxa_429=0.0, retry_after_seg=1, fator_escala=1, semente=None):
+        with open(ARQUIVO_FIXTURE_PNCP, encoding='utf-8') as f:
+            self.fixture_pncp = json.load(f)
+        with open(ARQUIVO_FIXTURE_BUSCAPE, 'rb') as f:
+            self.fixture_buscape = f.read()
+
+        self.latencia_seg = latencia_seg
+        self.variacao_latencia_seg = variacao_latencia_seg
+        self.taxa_erro = taxa_erro
+        self.taxa_429 = taxa_429
+        self.retry_after_seg = retry_after_seg
+        self.fator_escala = fator_escala
+        self._random = random.Random(semente)
+        self._lock = threading.Lock()
+        self.contagem_requisicoes = {}
+
+        servidor = self
+
+        class _Handler(ManipuladorMock):
+            mock = servidor
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', porta), _Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    # --- Ciclo de vida ---
+
+    @property
+    def url_base(self):
+        host, porta = self._httpd.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+    def zerar_contagem(self):
+        with self._lock:
+            self.contagem_requisicoes = {}
+
+    # --- Comportamento simulado ---
+
+    def _sortear(self, taxa):
+        with self._lock:
+            return self._random.random() < taxa
+
+    def _registrar(self, rota, status):
+        with self._lock:
+            chave = f"{rota} {status}"
+            self.contagem_requisicoes[chave] = self.contagem_requisicoes.get(chave, 0) + 1
+
+    def _atrasar(self):
+        atraso = self.latencia_seg
+        if self.variacao_latencia_seg:
+            with self._lock:
+                atraso += self._random.uniform(0, self.variacao_latencia_seg)
+        if atraso > 0:
+            time.sleep(atraso)
+
+    def licitacoes_da_modalidade(self, cod_modalidade):
+        originais = self.fixture_pncp['consulta'].get(str(cod_modalidade), [])
+        licitacoes = list(originais)
+        for copia in range(1, self.fator_escala):
+            for lic in originais:
+                clone = dict(lic)
+                clone['sequencialCompra'] = lic['sequencialCompra'] + copia * DESLOCAMENTO_SEQUENCIAL_CLONE
+                clone['numeroControlePNCP'] = f"{lic['numeroControlePNCP']}-{copia}"
+                licitacoes.append(clone)
+        return licitacoes
+
+    def itens_da_licitacao(self, ano, sequencial):
+        sequencial_original = int(sequencial) % DESLOCAMENTO_SEQUENCIAL_CLONE
+        return self.fixture_pncp['itens'].get(f"{ano}/{sequencial_original}")
+
+
+class ManipuladorMock(BaseHTTPRequestHandler):
+    mock = None  # Definido pela subclasse criada em ServidorMock
+
+    def log_message(self, format, *args):
+        pass  # Silencioso: o benchmark não deve medir a escrita no terminal
+
+    def _responder(self, rota, status, corpo=b'', tipo='application/json', cabecalhos=None):
+        self.mock._registrar(rota, status)
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _responder_json(self, rota, dados):
+        self._responder(rota, 200, json.dumps(dados, ensure_ascii=False).encode('utf-8'))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {chave: valores[0] for chave, valores in parse_qs(url.query).items()}
+
+        if url.path in (ROTA_BUSCA_LICITACOES, ROTA_BUSCA_ATUALIZADAS):
+            rota = 'consulta'
+        elif ROTA_ITENS.match(url.path):
+            rota = 'itens'
+        elif url.path == ROTA_BUSCAPE:
+            rota = 'buscape'
+        else:
+            self._responder('desconhecida', 404)
+            return
+
+        self.mock._atrasar()
+
+        if self.mock._sortear(self.mock.taxa_429):
+            self._responder(rota, 429, cabecalhos={'Retry-After': str(self.mock.retry_after_seg)})
+            return
+        if self.mock._sortear(self.mock.taxa_erro):
+            self._responder(rota, 503)
+            return
+
+        if rota == 'consulta':
+            self._consulta(params)
+        elif rota == 'itens':
+            ano, sequencial = ROTA_ITENS.match(url.path).group(2, 3)
+            itens = self.mock.itens_da_licitacao(ano, sequencial)
+            if itens is None:
+                self._responder(rota, 404)
+            else:
+                self._responder_json(rota, itens)
+        else:
+            self._responder(rota, 200, self.mock.fixture_buscape, tipo='text/html; charset=utf-8')
+
+    def _consulta(self, params):
+        """Pagina as licitações gravadas do mesmo jeito que a API de consulta."""
+        licitacoes = self.mock.licitacoes_da_modalidade(params.get('codigoModalidadeContratacao'))
+        if not licitacoes:
+            self._responder('consulta', 204)
+            return
+
+        tamanho_pagina = int(params.get('tamanhoPagina', 50))
+        pagina = int(params.get('pagina', 1))
+        total_paginas = (len(licitacoes) + tamanho_pagina - 1) // tamanho_pagina
+        inicio = (pagina - 1) * tamanho_pagina
+        dados_pagina = licitacoes[inicio:inicio + tamanho_pagina]
+
+        self._responder_json('consulta', {
+            'data': dados_pagina,
+            'totalRegistros': len(licitacoes),
+            'totalPaginas': total_paginas,
+            'numeroPagina': pagina,
+            'paginasRestantes': max(total_paginas - pagina, 0),
+            'empty': not dados_pagina
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que imita PNCP e Buscapé.")
+    parser.add_argument('--porta', type=int, default=8765)
+    parser.add_argument('--latencia', type=float, default=0.0, help="Atraso fixo por resposta (s)")
+    parser.add_argument('--variacao-latencia', type=float, default=0.0, help="Atraso aleatório extra (s)")
+    parser.add_argument('--taxa-erro', type=float, default=0.0, help="Fração de respostas 503")
+    parser.add_argument('--taxa-429', type=float, default=0.0, help="Fração de respostas 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Valor do cabeçalho Retry-After (s)")
+    parser.add_argument('--fator-escala', type=int, default=1, help="Multiplica as licitações gravadas")
+    parser.add_argument('--semente', type=int, default=None)
+    args = parser.parse_args()
+
+    servidor = ServidorMock(
+        porta=args.porta, latencia_seg=args.latencia, variacao_latencia_seg=args.variacao_latencia,
+        taxa_erro=args.taxa_erro, taxa_429=args.taxa_429, retry_after_seg=args.retry_after,
+        fator_escala=args.fator_escala, semente=args.semente
+    )
+    print(f"Servidor mock em {servidor.url_base} (Ctrl+C para sair)")
+    print(f"  Consulta PNCP:   {servidor.url_base}{PREFIXO_CONSULTA}")
+    print(f"  Integração PNCP: {servidor.url_base}{PREFIXO_INTEGRACAO}")
+    print(f"  Buscapé:         {servidor.url_base}{ROTA_BUSCAPE}")
+    try:
+        servidor._httpd.serve_forever()
+    except KeyboardInterrupt:
+        servidor.parar()
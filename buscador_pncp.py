@@ -1,12 +1,19 @@
+import argparse
 import concurrent.futures
 import json
+import queue
 import re
+import sqlite3
+import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import partial
 
-import pandas as pd
-import requests
+import dados_locais
+import metricas
+import perfilamento
+import registros
+import resiliencia
 
 # --- CONFIGURAÇÕES ---
 # O controle será feito pelo número de threads
@@ -15,6 +22,11 @@ ITENS_POR_PAGINA_LICITACOES = 50
 MAXIMO_PAGINAS_POR_MODALIDADE = 2
 # <<< Número máximo de requisições paralelas >>>
 MAX_WORKERS_THREADS = 10 
+# Licitações com busca de itens em andamento (ou na fila do pool), por thread
+TAREFAS_EM_ANDAMENTO_POR_THREAD = 2
+# Quanto iterar_itens espera a listagem terminar quando o consumidor desiste
+# (ex.: cliente desconectado); depois disso ela termina sozinha em segundo plano
+ESPERA_ENCERRAMENTO_LISTAGEM_SEG = 2
 
 # --- URLs DAS APIs ---
 URL_API_PNCP_CONSULTA_BASE = "https://pncp.gov.br/api/consulta"
@@ -23,11 +35,31 @@ URL_API_PNCP_INTEGRACAO_BASE = "https://pncp.gov.br/api/pncp"
 
 # --- Códigos de Modalidade ---
 MODALIDADES = list(range(1, 14)) # 1 a 13
+# Pula modalidades que nunca trouxeram licitações para o CNPJ (ver dados_locais)
+PODAR_MODALIDADES = True
+# O histórico reflete o que o CNPJ publica hoje: períodos que terminaram há
+# mais de N dias consultam todas as modalidades e não entram nas estatísticas
+JANELA_PODA_DIAS = 30
+
+# --- Disjuntor e limitador compartilhados pelas APIs de consulta e integração (mesmo servidor) ---
+DISJUNTOR_PNCP = resiliencia.DisjuntorCircuito('pncp')
+# Teto de requisições por segundo ao PNCP somando todas as threads do processo
+TAXA_MAXIMA_REQUISICOES_PNCP_SEG = 10
+LIMITADOR_PNCP = resiliencia.LimitadorTaxa('pncp', TAXA_MAXIMA_REQUISICOES_PNCP_SEG, capacidade=20)
+
+# --- Cache opcional das respostas de itens (qualquer objeto com get/set, ex.: cache_sqlite.CacheSQLite) ---
+# O app Flask aponta para o mesmo cache dos relatórios; na linha de comando fica desligado.
+CACHE_PNCP = None
+TIMEOUT_CACHE_ITENS_PNCP_SEG = 6 * 3600
 
 # --- FUNÇÃO 1: BUSCAR LICITAÇÕES (REFEITA PARA PARALELISMO) ---
 
 def _fetch_pagina_modalidade(params_base, cod_modalidade, pagina_atual):
-    """Função auxiliar que busca UMA PÁGINA de UMA MODALIDADE."""
+    """
+    Função auxiliar que busca UMA PÁGINA de UMA MODALIDADE.
+    Retorna (licitacoes, parar_busca, cod_modalidade, erro); 'erro' só é
+    preenchido quando a página não pôde ser obtida mesmo após as retentativas.
+    """
     print(f"  Buscando Modalidade: {cod_modalidade}, Página: {pagina_atual}...")
     
     url_busca = f"{URL_API_PNCP_CONSULTA_BASE}{ENDPOINT_PNCP_BUSCA_LICITACOES}"
@@ -40,7 +72,10 @@ def _fetch_pagina_modalidade(params_base, cod_modalidade, pagina_atual):
     try:
         # A pausa é pequena, pois o ThreadPool já limita o número de requisições
         time.sleep(PAUSA_ENTRE_REQUISICOES_SEG) 
-        response = requests.get(url_busca, headers=headers, params=params, timeout=60)
+        response = resiliencia.requisitar(
+            'pncp_consulta', url_busca, DISJUNTOR_PNCP, params=params, headers=headers, timeout=60,
+            limitador=LIMITADOR_PNCP
+        )
 
         if response.status_code == 200:
             dados = response.json()
@@ -60,22 +95,73 @@ def _fetch_pagina_modalidade(params_base, cod_modalidade, pagina_atual):
             
             # Retorna as licitações E se deve parar de buscar esta modalidade
             parar_busca = (pagina_atual >= dados.get('totalPaginas', 1)) or (not licitacoes_pagina)
-            return licitacoes_processadas, parar_busca, cod_modalidade
+            return licitacoes_processadas, parar_busca, cod_modalidade, None
         
         elif response.status_code == 204:
             print(f"  Nenhuma licitação encontrada para Modalidade {cod_modalidade}.")
-            return [], True, cod_modalidade # Parar busca
+            return [], True, cod_modalidade, None # Parar busca
         else:
-            print(f"  Erro ao buscar Modalidade {cod_modalidade} (Pág {pagina_atual}): Status {response.status_code}")
-            return [], True, cod_modalidade # Parar busca
+            erro = f"Status {response.status_code}"
 
-    except Exception as e:
-        print(f"  Erro de conexão/timeout (Modalidade {cod_modalidade}, Pág {pagina_atual}): {e}")
-        return [], True, cod_modalidade # Parar busca
+    except resiliencia.ErroPNCP as e:
+        erro = str(e)
+    except ValueError as e: # JSON inválido
+        erro = f"Resposta inválida: {e}"
+
+    print(f"  Erro ao buscar Modalidade {cod_modalidade} (Pág {pagina_atual}): {erro}")
+    return [], True, cod_modalidade, erro # Parar busca (pode ser retomada desta página)
 
 
-def buscar_licitacoes_recentes(cnpj, data_inicial_str, data_final_str):
-    """Busca licitações publicadas no PNCP iterando por todas as modalidades EM PARALELO."""
+def _poda_vale_para(data_final_str):
+    """A poda (e o registro das estatísticas) só vale para períodos recentes."""
+    if not PODAR_MODALIDADES:
+        return False
+    try:
+        data_final = datetime.strptime(data_final_str, '%Y%m%d')
+    except (TypeError, ValueError):
+        return False
+    return data_final >= datetime.now() - timedelta(days=JANELA_PODA_DIAS)
+
+
+def _modalidades_a_consultar(cnpj, data_final_str):
+    """Modalidades da listagem, sem as que o histórico do CNPJ indica estarem sempre vazias."""
+    if not _poda_vale_para(data_final_str):
+        return MODALIDADES
+    try:
+        modalidades = dados_locais.modalidades_a_consultar(cnpj, MODALIDADES)
+    except sqlite3.Error as e:
+        print(f"  Erro ao ler estatísticas de modalidades ({e}); consultando todas.")
+        return MODALIDADES
+
+    puladas = len(MODALIDADES) - len(modalidades)
+    if puladas:
+        print(f"  {puladas} modalidade(s) sem histórico de licitações para {cnpj} puladas nesta busca.")
+        metricas.incrementar('modalidades_puladas_total', puladas)
+    return modalidades
+
+
+def _registrar_consultas_modalidades(cnpj, resultados):
+    try:
+        dados_locais.registrar_consultas_modalidades(cnpj, resultados)
+    except sqlite3.Error as e:
+        print(f"  Erro ao salvar estatísticas de modalidades: {e}")
+
+
+def iterar_licitacoes(cnpj, data_inicial_str, data_final_str, erros=None, paginas_iniciais=None):
+    """
+    Busca licitações publicadas no PNCP iterando por todas as modalidades EM PARALELO
+    e as entrega (gerador) página a página, na ordem em que as respostas chegam.
+    Há no máximo uma página por modalidade em andamento.
+
+    erros: lista onde são anotadas as páginas que falharam
+           ({'etapa': 'listagem', 'modalidade', 'pagina', 'erro'}).
+    paginas_iniciais: {cod_modalidade: pagina} para retomar só essas modalidades
+                      a partir da página que falhou (padrão: desde a página 1, todas
+                      as modalidades menos as podadas pelo histórico do CNPJ,
+                      se o período for recente; ver JANELA_PODA_DIAS).
+
+    Se o consumidor parar de iterar, as páginas ainda não iniciadas são canceladas.
+    """
     print(f"\n--- Buscando licitações para {cnpj} (EM PARALELO) ---")
     
     params_base = {
@@ -85,37 +171,48 @@ def buscar_licitacoes_recentes(cnpj, data_inicial_str, data_final_str):
         "tamanhoPagina": ITENS_POR_PAGINA_LICITACOES
     }
 
-    licitacoes_encontradas_total = []
-    # Cria uma lista de "tarefas" para a primeira página de cada modalidade
-    tarefas = []
-    for cod_modalidade in MODALIDADES:
-        tarefas.append((cod_modalidade, 1)) # (modalidade, pagina)
+    if paginas_iniciais is None:
+        paginas_iniciais = {
+            cod_modalidade: 1 for cod_modalidade in _modalidades_a_consultar(cnpj, data_final_str)
+        }
 
-    modalidades_ativas = set(MODALIDADES)
+    modalidades_ativas = set(paginas_iniciais)
+    # Resultado da primeira página de cada modalidade, para as estatísticas de poda
+    primeiras_paginas = {}
 
-    # Usa o ThreadPoolExecutor para rodar as buscas em paralelo
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS_THREADS) as executor:
-        
-        # Prepara a função a ser chamada, fixando o argumento 'params_base'
-        func_partial = partial(_fetch_pagina_modalidade, params_base)
-        
-        # Mapeia as tarefas para os threads. 
-        # 'futures' é uma lista de tarefas sendo executadas
-        futures = {executor.submit(func_partial, cod, pag): (cod, pag) for (cod, pag) in tarefas}
+    # Prepara a função a ser chamada, fixando o argumento 'params_base'
+    # (propagar: se esta thread está sendo perfilada, as tarefas do pool também são)
+    func_partial = perfilamento.propagar(partial(_fetch_pagina_modalidade, params_base))
 
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS_THREADS)
+    # Uma tarefa para a primeira página de cada modalidade: {future: (modalidade, pagina)}
+    futures = {executor.submit(func_partial, cod, pag): (cod, pag) for cod, pag in paginas_iniciais.items()}
+    try:
         while futures:
-            # Espera a próxima tarefa ser concluída
-            done_future = next(concurrent.futures.as_completed(futures))
-            tarefa_original = futures.pop(done_future) # Remove da lista de ativas
-            
-            try:
-                licitacoes, parar_busca, cod_modalidade = done_future.result()
-                
-                if licitacoes:
-                    licitacoes_encontradas_total.extend(licitacoes)
+            metricas.definir('tarefas_pendentes', len(futures), etapa='listagem')
+            # Espera a próxima tarefa ser concluída (qualquer uma)
+            concluidas, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for done_future in concluidas:
+                tarefa_original = futures.pop(done_future) # Remove da lista de ativas
+                try:
+                    licitacoes, parar_busca, cod_modalidade, erro = done_future.result()
+                except Exception as e:
+                    print(f"  Erro ao processar resultado da tarefa {tarefa_original}: {e}")
+                    continue
+
+                pagina_atual = tarefa_original[1]
+                if pagina_atual == 1 and not erro:
+                    primeiras_paginas[cod_modalidade] = bool(licitacoes)
+                if erro and erros is not None:
+                    erros.append({
+                        'etapa': 'listagem',
+                        'modalidade': cod_modalidade,
+                        'pagina': pagina_atual,
+                        'erro': erro
+                    })
                 
                 # Se não devemos parar e não atingimos o limite de páginas
-                pagina_atual = tarefa_original[1]
                 if not parar_busca and (pagina_atual < MAXIMO_PAGINAS_POR_MODALIDADE) and (cod_modalidade in modalidades_ativas):
                     # Adiciona a próxima página desta modalidade na fila de tarefas
                     proxima_pagina = pagina_atual + 1
@@ -127,148 +224,386 @@ def buscar_licitacoes_recentes(cnpj, data_inicial_str, data_final_str):
                     print(f"  Modalidade {cod_modalidade}: Fim dos resultados.")
                     modalidades_ativas.remove(cod_modalidade)
 
-            except Exception as e:
-                print(f"  Erro ao processar resultado da tarefa {tarefa_original}: {e}")
+                # Entrega a página já, enquanto as outras continuam em andamento
+                yield from licitacoes
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        metricas.definir('tarefas_pendentes', 0, etapa='listagem')
+        if _poda_vale_para(data_final_str):
+            _registrar_consultas_modalidades(cnpj, primeiras_paginas)
+
 
+def buscar_licitacoes_recentes(cnpj, data_inicial_str, data_final_str, erros=None, paginas_iniciais=None):
+    """Mesma busca de iterar_licitacoes, devolvendo a lista completa."""
+    licitacoes_encontradas_total = list(
+        iterar_licitacoes(cnpj, data_inicial_str, data_final_str, erros=erros, paginas_iniciais=paginas_iniciais)
+    )
     print(f"\n--- Total de {len(licitacoes_encontradas_total)} licitações encontradas. ---")
     return licitacoes_encontradas_total
 
 
 # --- FUNÇÃO 2: BUSCAR ITENS (Modificada para ser chamada em paralelo) ---
 
-def buscar_itens_licitacao(cnpj, ano, sequencial):
-    """Busca os itens de UMA licitação específica."""
+def _baixar_itens_licitacao(cnpj, ano, sequencial):
+    """Baixa do PNCP a lista (JSON) de itens de uma licitação; [] se não houver itens."""
     # Esta função será chamada em paralelo, então o print é importante
     print(f"  Buscando itens para licitação {ano}/{sequencial}...")
-    itens_encontrados = []
     url_itens = f"{URL_API_PNCP_INTEGRACAO_BASE}/v1/orgaos/{cnpj}/compras/{ano}/{sequencial}/itens"
     headers = {'Accept': 'application/json'}
 
+    # A pausa é pequena, pois o ThreadPool já limita o número de requisições
+    time.sleep(PAUSA_ENTRE_REQUISICOES_SEG) 
+    response = resiliencia.requisitar(
+        'pncp_itens', url_itens, DISJUNTOR_PNCP, headers=headers, timeout=20, limitador=LIMITADOR_PNCP
+    )
+
+    if response.status_code in (204, 404):
+        print(f"  Nenhum item encontrado para {ano}/{sequencial}.")
+        return []
+    if response.status_code != 200:
+        raise resiliencia.ErroPNCP(f"Status {response.status_code}", status=response.status_code)
+
     try:
-        # A pausa é pequena, pois o ThreadPool já limita o número de requisições
-        time.sleep(PAUSA_ENTRE_REQUISICOES_SEG) 
-        response = requests.get(url_itens, headers=headers, timeout=20)
+        return response.json()
+    except ValueError as e:
+        raise resiliencia.ErroPNCP(f"Resposta inválida: {e}")
 
-        if response.status_code == 200:
-            itens_bruto = response.json()
-            for item in itens_bruto:
-                itens_encontrados.append({
-                    'numero_item': item.get('numeroItem'),
-                    'tipo': item.get('materialOuServicoNome'),
-                    'descricao': item.get('descricao', '').strip(),
-                    'quantidade': item.get('quantidade'),
-                    'valor_unit_estimado': item.get('valorUnitarioEstimado'),
-                    'valor_total_estimado': item.get('valorTotalEstimado')
-                })
-        else:
-            print(f"  Erro ao buscar itens para {ano}/{sequencial}: Status {response.status_code}")
-        
+
+# O cache é só um atalho: uma falha dele (ex.: "database is locked" no
+# cache_sqlite, ou outro backend fora do ar) não pode derrubar o relatório.
+# Qualquer exceção é registrada e a busca segue direto no PNCP.
+
+def _ler_cache_pncp(chave):
+    if CACHE_PNCP is None:
+        return None
+    try:
+        return CACHE_PNCP.get(chave)
     except Exception as e:
-        print(f"  Erro de conexão ao buscar itens para {ano}/{sequencial}: {e}")
+        print(f"  Erro ao ler '{chave}' do cache ({e}); buscando no PNCP.")
+        metricas.incrementar('cache_pncp_erros_total', operacao='leitura')
+        return None
+
+
+def _gravar_cache_pncp(chave, valor):
+    if CACHE_PNCP is None:
+        return
+    try:
+        CACHE_PNCP.set(chave, valor, timeout=TIMEOUT_CACHE_ITENS_PNCP_SEG)
+    except Exception as e:
+        print(f"  Erro ao gravar '{chave}' no cache: {e}")
+        metricas.incrementar('cache_pncp_erros_total', operacao='gravacao')
+
+
+def buscar_itens_licitacao(cnpj, ano, sequencial, licitacao=None):
+    """
+    Busca os itens de UMA licitação específica, como registros.Item que
+    apontam para 'licitacao' (um registros.Licitacao; criado se omitido).
+    Lança resiliencia.ErroPNCP se os itens não puderem ser obtidos
+    (em vez de devolver uma lista vazia, que seria confundida com "sem itens").
+    """
+    chave_cache = f"pncp_itens:{cnpj}:{ano}:{sequencial}"
+    itens_bruto = _ler_cache_pncp(chave_cache)
+    if itens_bruto is None:
+        itens_bruto = _baixar_itens_licitacao(cnpj, ano, sequencial)
+        _gravar_cache_pncp(chave_cache, itens_bruto)
 
-    return itens_encontrados
+    if licitacao is None:
+        licitacao = registros.Licitacao(cnpj=cnpj, ano=ano, sequencial=sequencial)
+    return [registros.Item.do_pncp(item, licitacao) for item in itens_bruto]
 
 
 # --- FUNÇÃO 3: FUNÇÃO "MESTRA" ---
 
-def _fetch_e_enriquece_itens(licitacao, cnpj):
-    """Função auxiliar que busca itens E já enriquece com dados da licitação."""
-    
-    # Pega os dados que precisamos para a URL
-    ano = licitacao.get('ano')
-    sequencial = licitacao.get('sequencial')
+def _fetch_itens_normalizados(licitacao, cnpj):
+    """
+    Função auxiliar que busca os itens de uma licitação.
+    Retorna (licitacao_id, registro_licitacao, itens, erro); cada item só
+    referencia o registro da licitação em vez de copiar os campos dela.
+    """
+    try:
+        # Pega os dados que precisamos para a URL
+        ano = licitacao.get('ano')
+        sequencial = licitacao.get('sequencial')
 
-    if not ano or not sequencial:
-        return []
-        
-    itens = buscar_itens_licitacao(cnpj, ano, sequencial)
-    
-    itens_enriquecidos = []
-    for item in itens:
-        # Adicionamos os componentes da URL individualmente
-        item['cnpj'] = cnpj
-        item['ano'] = ano
-        item['sequencial'] = sequencial
-        
-        item['id_pncp'] = licitacao.get('id_pncp') 
-        item['licitacao_id'] = f"{ano}/{sequencial}"
-        item['licitacao_objeto'] = licitacao['objeto']
-        item['licitacao_modalidade'] = licitacao['modalidade_nome']
-        item['licitacao_data_publicacao'] = licitacao['data_publicacao']
-        itens_enriquecidos.append(item)
-    return itens_enriquecidos
+        if not ano or not sequencial:
+            return None, None, [], None
+            
+        registro = registros.Licitacao.do_pncp(licitacao, cnpj)
+        try:
+            itens = buscar_itens_licitacao(cnpj, ano, sequencial, licitacao=registro)
+        except resiliencia.ErroPNCP as e:
+            print(f"  Erro ao buscar itens para {registro.licitacao_id}: {e}")
+            return registro.licitacao_id, None, [], str(e)
 
+        return registro.licitacao_id, registro, itens, None
+    finally:
+        metricas.ajustar('tarefas_pendentes', -1, etapa='itens')
 
-def gerar_relatorio_bruto(cnpj, data_inicio_str, data_fim_str):
+
+def desnormalizar_itens(relatorio):
     """
-    Função principal que orquestra a busca de licitações e seus itens,
-    agora usando paralelismo para ambas as etapas.
+    Gera os itens de um relatório normalizado como dicionários no formato
+    "bruto", com os campos da licitação copiados em cada item.
     """
-    
+    for item in relatorio['itens']:
+        yield item.para_dict(completo=True)
+
+
+_FIM_LISTAGEM = object() # Avisa iterar_itens que a listagem acabou
+
+
+def _alimentar_itens(licitacoes, executor, tarefa, vagas, parar, concluidas, submetidas):
+    """
+    Roda numa thread própria: consome 'licitacoes' (que pode bloquear, ex.:
+    a listagem paginada do PNCP) e submete a busca de itens de cada uma,
+    esperando uma vaga ('vagas') antes de cada submissão. Cada tarefa
+    concluída vai para a fila 'concluidas'; no fim vai (_FIM_LISTAGEM, erro).
+    """
+    erro = None
+    try:
+        for licitacao in licitacoes:
+            vagas.acquire()
+            if parar.is_set():
+                break
+            metricas.ajustar('tarefas_pendentes', 1, etapa='itens')
+            future = executor.submit(tarefa, licitacao)
+            submetidas[future] = licitacao
+            future.add_done_callback(concluidas.put)
+            if parar.is_set():
+                break
+    except Exception as e:
+        erro = e
+    finally:
+        # O gerador da listagem só pode ser fechado pela thread que o consome
+        if hasattr(licitacoes, 'close'):
+            licitacoes.close()
+        concluidas.put((_FIM_LISTAGEM, erro))
+
+
+def iterar_itens(licitacoes, cnpj, erros=None, max_em_andamento=None):
+    """
+    Busca os itens das licitações EM PARALELO e entrega (gerador) os
+    registros.Item de cada licitação assim que ela termina, sem esperar as
+    anteriores. 'licitacoes' pode ser outro gerador (ex.: iterar_licitacoes),
+    consumido numa thread à parte: enquanto a listagem espera o PNCP, os
+    itens que já chegaram continuam sendo entregues. No máximo
+    'max_em_andamento' licitações ficam em andamento ao mesmo tempo, então a
+    memória não cresce com o relatório.
+
+    erros: lista onde são anotadas as licitações cujos itens falharam
+           ({'etapa': 'itens', 'licitacao_id', 'erro', 'licitacao'}).
+    """
+    max_em_andamento = max_em_andamento or MAX_WORKERS_THREADS * TAREFAS_EM_ANDAMENTO_POR_THREAD
+    # Prepara a função a ser chamada, fixando o argumento 'cnpj'
+    # (propagar: se esta thread está sendo perfilada, as tarefas do pool também são)
+    func_partial = perfilamento.propagar(partial(_fetch_itens_normalizados, cnpj=cnpj))
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS_THREADS)
+    vagas = threading.Semaphore(max_em_andamento)
+    parar = threading.Event()
+    concluidas = queue.Queue()
+    submetidas = {} # {future: licitacao}, ainda não entregues
+    alimentador = threading.Thread(
+        target=perfilamento.propagar(_alimentar_itens), name='listagem-itens',
+        args=(iter(licitacoes), executor, func_partial, vagas, parar, concluidas, submetidas)
+    )
+    alimentador.start()
+
+    listagem_terminou, erro_listagem = False, None
+    try:
+        # Até a listagem terminar e todas as licitações submetidas serem entregues
+        while not listagem_terminou or submetidas:
+            mensagem = concluidas.get()
+            if isinstance(mensagem, tuple) and mensagem[0] is _FIM_LISTAGEM:
+                listagem_terminou, erro_listagem = True, mensagem[1]
+                continue
+            licitacao = submetidas.pop(mensagem)
+            vagas.release()
+            licitacao_id, _, itens, erro = mensagem.result()
+            if erro:
+                if erros is not None:
+                    # Guardamos a licitação para poder buscar só os itens dela depois
+                    erros.append({
+                        'etapa': 'itens',
+                        'licitacao_id': licitacao_id,
+                        'erro': erro,
+                        'licitacao': licitacao
+                    })
+                continue
+            yield from itens
+
+        if erro_listagem is not None:
+            raise erro_listagem
+    finally:
+        parar.set()
+        vagas.release(max_em_andamento) # Destrava o alimentador se ele espera uma vaga
+        # Se a listagem espera uma página do PNCP, não seguramos o consumidor até
+        # ela chegar: o alimentador vê 'parar' logo depois e encerra a listagem
+        alimentador.join(ESPERA_ENCERRAMENTO_LISTAGEM_SEG)
+        if alimentador.is_alive():
+            print("  Listagem ainda aguarda o PNCP; ela será encerrada em segundo plano.")
+        for future in list(submetidas):
+            # Tarefas que nem começaram não passam pelo 'finally' de _fetch_itens_normalizados
+            if future.cancel():
+                metricas.ajustar('tarefas_pendentes', -1, etapa='itens')
+        executor.shutdown(wait=True)
+
+
+def iterar_relatorio(cnpj, data_inicio_str, data_fim_str, erros=None):
+    """
+    Relatório em fluxo: a busca de itens começa enquanto a listagem ainda
+    está em andamento, e cada item é entregue assim que chega. Cada
+    registros.Item aponta para o registro da sua licitação.
+    Lança ValueError se o período for inválido.
+    """
+    _validar_periodo(data_inicio_str, data_fim_str)
+    licitacoes = _cronometrar_listagem(iterar_licitacoes(cnpj, data_inicio_str, data_fim_str, erros=erros))
+    return iterar_itens(licitacoes, cnpj, erros=erros)
+
+
+def _cronometrar_listagem(licitacoes):
+    """Etapa 'listagem' do relatório em fluxo: da primeira página até a listagem acabar (ou ser fechada)."""
+    with metricas.medir_etapa('listagem'):
+        yield from licitacoes
+
+
+def _validar_periodo(data_inicio_str, data_fim_str):
     try:
         d_inicio = datetime.strptime(data_inicio_str, '%Y%m%d')
         d_fim = datetime.strptime(data_fim_str, '%Y%m%d')
-        if (d_fim - d_inicio).days > 366:
-            print("Erro: Período excede 1 ano.")
-            return []
     except ValueError:
-        print("Erro: Formato de data inválido. Use YYYYMMDD.")
-        return []
+        raise ValueError("Formato de data inválido. Use YYYYMMDD.")
+    if (d_fim - d_inicio).days > 366:
+        raise ValueError("Período excede 1 ano.")
+
+
+def _buscar_itens_das_licitacoes(licitacoes, cnpj, relatorio):
+    """Etapa 2: busca os itens das licitações EM PARALELO e acrescenta ao relatório."""
+    print(f"\n--- Processando {len(licitacoes)} licitações para buscar itens (EM PARALELO) ---")
+
+    with metricas.medir_etapa('itens'):
+        # Os itens chegam na ordem em que cada licitação termina
+        for item in iterar_itens(licitacoes, cnpj, erros=relatorio['erros']):
+            relatorio['licitacoes'].setdefault(item.licitacao_id, item.licitacao)
+            relatorio['itens'].append(item)
+
+
+def gerar_relatorio_normalizado(cnpj, data_inicio_str, data_fim_str):
+    """
+    Função principal que orquestra a busca de licitações e seus itens,
+    agora usando paralelismo para ambas as etapas.
+
+    Retorna {'licitacoes': {licitacao_id: Licitacao}, 'itens': [Item, ...], 'erros': [...]}
+    (registros de registros.py), onde os dados de cada licitação aparecem uma
+    única vez e os itens apenas apontam para eles. 'erros' lista as
+    páginas e licitações que não puderam ser obtidas do PNCP; o relatório
+    pode ser completado depois com retomar_relatorio().
+    """
+    relatorio = {'licitacoes': {}, 'itens': [], 'erros': []}
+
+    try:
+        _validar_periodo(data_inicio_str, data_fim_str)
+    except ValueError as e:
+        print(f"Erro: {e}")
+        return relatorio
 
     # --- Etapa 1: Buscar licitações (Já está em paralelo) ---
-    licitacoes = buscar_licitacoes_recentes(cnpj, data_inicio_str, data_fim_str)
+    with metricas.medir_etapa('listagem'):
+        licitacoes = buscar_licitacoes_recentes(cnpj, data_inicio_str, data_fim_str, erros=relatorio['erros'])
     
     if not licitacoes:
         print("Nenhuma licitação encontrada.")
-        return []
+        return relatorio
 
-    print(f"\n--- Processando {len(licitacoes)} licitações para buscar itens (EM PARALELO) ---")
-    
-    todos_os_itens = []
-    
     # --- Etapa 2: Buscar itens (EM PARALELO) ---
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS_THREADS) as executor:
-        # Prepara a função a ser chamada, fixando o argumento 'cnpj'
-        func_partial = partial(_fetch_e_enriquece_itens, cnpj=cnpj)
-        
-        # 'map' aplica a função 'func_partial' a cada item da lista 'licitacoes'
-        # e retorna os resultados na ordem
-        resultados_listas_de_itens = executor.map(func_partial, licitacoes)
-        
-        # 'resultados' é uma lista de listas (ex: [[item1, item2], [item3], []])
-        for lista_de_itens in resultados_listas_de_itens:
-            todos_os_itens.extend(lista_de_itens)
+    _buscar_itens_das_licitacoes(licitacoes, cnpj, relatorio)
+
+    print(f"\n--- Relatório Concluído: {len(relatorio['itens'])} itens encontrados, "
+          f"{len(relatorio['erros'])} falhas ---")
+    return relatorio
+
+
+def retomar_relatorio(relatorio, cnpj, data_inicio_str, data_fim_str):
+    """
+    Completa um relatório que teve falhas, sem refazer o que já deu certo:
+    as modalidades são retomadas a partir da página que falhou e só as
+    licitações cujos itens falharam são buscadas de novo.
+    """
+    erros_anteriores = relatorio['erros']
+    relatorio['erros'] = []
+
+    paginas_iniciais = {
+        erro['modalidade']: erro['pagina'] for erro in erros_anteriores if erro['etapa'] == 'listagem'
+    }
+    licitacoes_pendentes = [erro['licitacao'] for erro in erros_anteriores if erro['etapa'] == 'itens']
 
-    print(f"\n--- Relatório Concluído: {len(todos_os_itens)} itens encontrados ---")
-    return todos_os_itens
+    print(f"\n--- Retomando relatório: {len(paginas_iniciais)} modalidades, "
+          f"{len(licitacoes_pendentes)} licitações pendentes ---")
+
+    if paginas_iniciais:
+        with metricas.medir_etapa('listagem'):
+            novas = buscar_licitacoes_recentes(
+                cnpj, data_inicio_str, data_fim_str,
+                erros=relatorio['erros'], paginas_iniciais=paginas_iniciais
+            )
+        licitacoes_pendentes.extend(
+            lic for lic in novas if f"{lic.get('ano')}/{lic.get('sequencial')}" not in relatorio['licitacoes']
+        )
+
+    if licitacoes_pendentes:
+        _buscar_itens_das_licitacoes(licitacoes_pendentes, cnpj, relatorio)
+    return relatorio
+
+
+def gerar_relatorio_bruto(cnpj, data_inicio_str, data_fim_str):
+    """Mesmo relatório, com os dados da licitação copiados em cada item."""
+    relatorio = gerar_relatorio_normalizado(cnpj, data_inicio_str, data_fim_str)
+    return list(desnormalizar_itens(relatorio))
 
 # --- Exemplo de uso dessa nova função ---
 if __name__ == "__main__":
     
-    CNPJ_CIDADE = "13825484000150" # CNPJ de Amargosa
-    DATA_INICIO = "20251001"
-    DATA_FIM = "20251021"
+    parser = argparse.ArgumentParser(description="Gera o relatório bruto de itens de um órgão no PNCP.")
+    parser.add_argument('--cnpj', default="13825484000150", help="CNPJ do órgão (padrão: Amargosa)")
+    parser.add_argument('--inicio', default="20251001", help="Data inicial (YYYYMMDD)")
+    parser.add_argument('--fim', default="20251021", help="Data final (YYYYMMDD)")
+    parser.add_argument('--metricas', metavar='ARQUIVO', help="Salva as métricas da execução em JSON")
+    parser.add_argument('--perfil', metavar='ARQUIVO', nargs='?', const='',
+                        help="Perfila a execução (cProfile) e salva o .pstats (padrão: pasta perfis/)")
+    parser.add_argument('--indexar', action='store_true',
+                        help="Grava os itens no banco local de busca em vez do CSV")
+    args = parser.parse_args()
+
+    if args.perfil is not None:
+        perfilamento.perfilar_execucao('buscador', args.perfil or None)
 
     # Medindo o tempo
     start_time = time.time()
-    
-    itens_do_relatorio = gerar_relatorio_bruto(CNPJ_CIDADE, DATA_INICIO, DATA_FIM)
-    
-    
+
+    # Os itens são gravados à medida que chegam, sem guardar o relatório em memória
+    erros = []
+    try:
+        itens = iterar_relatorio(args.cnpj, args.inicio, args.fim, erros=erros)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Em fluxo as etapas se sobrepõem: 'itens' vai do início até o último item
+    # gravado e inclui a 'listagem' (medida em iterar_relatorio)
+    with metricas.medir_etapa('itens'):
+        if args.indexar:
+            total = dados_locais.indexar_em_lotes(itens)
+            destino = f"no banco local '{dados_locais.CAMINHO_BANCO_LOCAL}'"
+        else:
+            total = registros.escrever_csv(itens, "relatorio_bruto_colaborativo.csv")
+            destino = "em 'relatorio_bruto_colaborativo.csv'"
+
     end_time = time.time()
     print(f"\nTempo total da busca: {end_time - start_time:.2f} segundos")
+    print(f"{total} itens salvos {destino}.")
 
-    if itens_do_relatorio:
-        df = pd.DataFrame(itens_do_relatorio)
-        colunas = [
-            'licitacao_id', 'licitacao_data_publicacao', 'licitacao_modalidade', 
-            'numero_item', 'descricao', 'quantidade', 'valor_unit_estimado', 
-            'valor_total_estimado', 'tipo', 'licitacao_objeto', 'id_pncp'
-        ]
-        colunas_finais = [col for col in colunas if col in df.columns]
-        df = df[colunas_finais]
-
-        print(df.head())
-        
-        df.to_csv("relatorio_bruto_colaborativo.csv", index=False, sep=';', decimal=',', encoding='utf-8-sig')
-        print("\nRelatório bruto salvo em 'relatorio_bruto_colaborativo.csv'")
\ No newline at end of file
+    for erro in erros:
+        print(f"  FALHA ({erro['etapa']}): {erro.get('licitacao_id') or erro.get('modalidade')} - {erro['erro']}")
+
+    if args.metricas:
+        metricas.salvar_json(args.metricas)
+        print(f"Métricas salvas em '{args.metricas}'")
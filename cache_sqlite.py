@@ -0,0 +1,299 @@
+"""
+Backend de cache em SQLite, compatível com o Flask-Caching e compartilhado
+por todos os processos da máquina (workers do Gunicorn, aquecedor, CLI).
+
+- Escritas atômicas: cada set é uma transação (modo WAL, leitores não travam).
+- Tamanho limitado: ao passar de 'limite_bytes', remove primeiro as entradas
+  vencidas e depois as usadas há mais tempo (LRU).
+- Namespaces: o trecho da chave antes do primeiro ':' ("relatorio",
+  "pncp_itens"...), que pode ser invalidado de uma vez.
+- Acertos/falhas por namespace nas métricas do processo (metricas.py).
+
+No app: CACHE_TYPE = "cache_sqlite.CacheSQLite" (padrão). Linha de comando:
+    python cache_sqlite.py                         # entradas e bytes por namespace
+    python cache_sqlite.py --invalidar relatorio
+"""
+import argparse
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from flask_caching.backends.base import BaseCache
+
+import metricas
+
+# --- CONFIGURAÇÕES ---
+basedir = os.path.abspath(os.path.dirname(__file__))
+CAMINHO_CACHE_SQLITE = os.environ.get('CACHE_SQLITE_CAMINHO', os.path.join(basedir, 'cache.db'))
+LIMITE_CACHE_MB = int(os.environ.get('CACHE_SQLITE_LIMITE_MB', 512))
+FRACAO_APOS_REMOCAO = 0.9 # A remoção libera espaço até 90% do limite, para não remover a cada escrita
+# Leituras não abrem transação de escrita a cada acerto: o último acesso só é
+# atualizado se tiver mudado mais que RESOLUCAO_LRU_SEG, e essas atualizações
+# ficam na memória do processo e são gravadas juntas, numa transação só, a cada
+# INTERVALO_GRAVACAO_ACESSOS_SEG (ou MAXIMO_ACESSOS_PENDENTES chaves) e antes
+# de uma remoção LRU. A ordem LRU fica aproximada, o que basta para o limite.
+RESOLUCAO_LRU_SEG = 300
+INTERVALO_GRAVACAO_ACESSOS_SEG = 60
+MAXIMO_ACESSOS_PENDENTES = 500
+TIMEOUT_BANCO_SEG = 30
+NAMESPACE_PADRAO = 'geral'
+
+ESQUEMA_CACHE = """
+CREATE TABLE IF NOT EXISTS entradas (
+    chave TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    valor BLOB NOT NULL,
+    tamanho INTEGER NOT NULL,
+    expira_em REAL,            -- NULL = não expira
+    ultimo_acesso REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entradas_namespace ON entradas (namespace);
+CREATE INDEX IF NOT EXISTS idx_entradas_expira_em ON entradas (expira_em);
+-- Índice de cobertura da remoção LRU: lê o tamanho sem passar pelas páginas do BLOB
+CREATE INDEX IF NOT EXISTS idx_entradas_lru ON entradas (ultimo_acesso, tamanho);
+
+-- Total de bytes mantido pelos gatilhos na mesma transação de cada escrita,
+-- para não somar a tabela inteira a cada set
+CREATE TABLE IF NOT EXISTS metadados (
+    nome TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO metadados (nome, valor)
+    SELECT 'total_bytes', COALESCE(SUM(tamanho), 0) FROM entradas;
+
+CREATE TRIGGER IF NOT EXISTS entradas_total_insercao AFTER INSERT ON entradas BEGIN
+    UPDATE metadados SET valor = valor + NEW.tamanho WHERE nome = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS entradas_total_remocao AFTER DELETE ON entradas BEGIN
+    UPDATE metadados SET valor = valor - OLD.tamanho WHERE nome = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS entradas_total_atualizacao AFTER UPDATE OF tamanho ON entradas BEGIN
+    UPDATE metadados SET valor = valor - OLD.tamanho + NEW.tamanho WHERE nome = 'total_bytes';
+END;
+"""
+
+
+def namespace_da_chave(chave):
+    return chave.split(':', 1)[0] if ':' in chave else NAMESPACE_PADRAO
+
+
+class CacheSQLite(BaseCache):
+    """Cache compartilhado entre processos, com limite de tamanho e remoção LRU."""
+
+    def __init__(self, caminho=CAMINHO_CACHE_SQLITE, limite_bytes=LIMITE_CACHE_MB * 2**20,
+                 default_timeout=300, **kwargs):
+        super().__init__(default_timeout=default_timeout, **kwargs)
+        self.caminho = caminho
+        self.limite_bytes = limite_bytes
+        self._local = threading.local()
+        self._acessos_pendentes = {} # {chave: momento do acesso}, ainda não gravados
+        self._trava_acessos = threading.Lock()
+        self._ultima_gravacao_acessos = time.time()
+
+        with self._conexao() as conexao:
+            conexao.executescript(ESQUEMA_CACHE)
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        """Chamado pelo Flask-Caching; lê CACHE_SQLITE_CAMINHO e CACHE_SQLITE_LIMITE_MB."""
+        kwargs.update(
+            caminho=config.get('CACHE_SQLITE_CAMINHO', CAMINHO_CACHE_SQLITE),
+            limite_bytes=int(config.get('CACHE_SQLITE_LIMITE_MB', LIMITE_CACHE_MB)) * 2**20
+        )
+        return cls(*args, **kwargs)
+
+    def _conexao(self):
+        # Uma conexão por thread e por processo (conexões SQLite não sobrevivem a um fork)
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None or self._local.pid != os.getpid():
+            conexao = sqlite3.connect(self.caminho, timeout=TIMEOUT_BANCO_SEG)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexao, self._local.pid = conexao, os.getpid()
+        return conexao
+
+    def _expira_em(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else None
+
+    # --- Interface do Flask-Caching ---
+
+    def get(self, key):
+        namespace = namespace_da_chave(key)
+        agora = time.time()
+        conexao = self._conexao()
+        linha = conexao.execute(
+            "SELECT valor, expira_em, ultimo_acesso FROM entradas WHERE chave = ?", (key,)
+        ).fetchone()
+
+        if linha is None or (linha[1] is not None and linha[1] <= agora):
+            metricas.incrementar('cache_sqlite_consultas_total', namespace=namespace, resultado='falha')
+            return None
+
+        if agora - linha[2] > RESOLUCAO_LRU_SEG:
+            self._registrar_acesso(key, agora)
+        metricas.incrementar('cache_sqlite_consultas_total', namespace=namespace, resultado='acerto')
+        try:
+            return pickle.loads(linha[0])
+        except (pickle.UnpicklingError, AttributeError, ImportError, EOFError):
+            # Entrada gravada por uma versão incompatível do código
+            self.delete(key)
+            return None
+
+    def set(self, key, value, timeout=None):
+        valor = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        agora = time.time()
+        conexao = self._conexao()
+        with conexao:
+            conexao.execute(
+                """
+                INSERT INTO entradas (chave, namespace, valor, tamanho, expira_em, ultimo_acesso)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (chave) DO UPDATE SET
+                    valor = excluded.valor,
+                    tamanho = excluded.tamanho,
+                    expira_em = excluded.expira_em,
+                    ultimo_acesso = excluded.ultimo_acesso
+                """,
+                (key, namespace_da_chave(key), valor, len(valor), self._expira_em(timeout), agora)
+            )
+        self._liberar_espaco()
+        return True
+
+    def add(self, key, value, timeout=None):
+        """Só grava se a chave não existir (ou estiver vencida)."""
+        valor = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        agora = time.time()
+        conexao = self._conexao()
+        with conexao:
+            conexao.execute(
+                "DELETE FROM entradas WHERE chave = ? AND expira_em IS NOT NULL AND expira_em <= ?", (key, agora)
+            )
+            cursor = conexao.execute(
+                """
+                INSERT INTO entradas (chave, namespace, valor, tamanho, expira_em, ultimo_acesso)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (chave) DO NOTHING
+                """,
+                (key, namespace_da_chave(key), valor, len(valor), self._expira_em(timeout), agora)
+            )
+        if cursor.rowcount:
+            self._liberar_espaco()
+        return bool(cursor.rowcount)
+
+    def delete(self, key):
+        conexao = self._conexao()
+        with conexao:
+            cursor = conexao.execute("DELETE FROM entradas WHERE chave = ?", (key,))
+        return bool(cursor.rowcount)
+
+    def delete_many(self, *keys):
+        conexao = self._conexao()
+        with conexao:
+            conexao.executemany("DELETE FROM entradas WHERE chave = ?", [(chave,) for chave in keys])
+        return list(keys)
+
+    def has(self, key):
+        linha = self._conexao().execute(
+            "SELECT 1 FROM entradas WHERE chave = ? AND (expira_em IS NULL OR expira_em > ?)", (key, time.time())
+        ).fetchone()
+        return linha is not None
+
+    def clear(self):
+        conexao = self._conexao()
+        with conexao:
+            conexao.execute("DELETE FROM entradas")
+        return True
+
+    # --- Extras ---
+
+    def invalidar_namespace(self, namespace):
+        """Remove todas as entradas de um namespace. Retorna quantas foram removidas."""
+        conexao = self._conexao()
+        with conexao:
+            cursor = conexao.execute("DELETE FROM entradas WHERE namespace = ?", (namespace,))
+        return cursor.rowcount
+
+    def estatisticas(self):
+        """{namespace: {'entradas', 'bytes'}} do banco inteiro (todos os processos)."""
+        return {
+            namespace: {'entradas': entradas, 'bytes': tamanho}
+            for namespace, entradas, tamanho in self._conexao().execute(
+                "SELECT namespace, COUNT(*), SUM(tamanho) FROM entradas GROUP BY namespace ORDER BY namespace"
+            )
+        }
+
+    def _total_bytes(self, conexao):
+        (total,) = conexao.execute("SELECT valor FROM metadados WHERE nome = 'total_bytes'").fetchone()
+        return total
+
+    def _registrar_acesso(self, chave, momento):
+        with self._trava_acessos:
+            self._acessos_pendentes[chave] = momento
+            gravar = (len(self._acessos_pendentes) >= MAXIMO_ACESSOS_PENDENTES
+                      or momento - self._ultima_gravacao_acessos >= INTERVALO_GRAVACAO_ACESSOS_SEG)
+        if gravar:
+            self._gravar_acessos()
+
+    def _gravar_acessos(self):
+        """Grava de uma vez os últimos acessos acumulados por este processo."""
+        with self._trava_acessos:
+            pendentes, self._acessos_pendentes = self._acessos_pendentes, {}
+            self._ultima_gravacao_acessos = time.time()
+        if not pendentes:
+            return
+        conexao = self._conexao()
+        try:
+            with conexao:
+                conexao.executemany(
+                    "UPDATE entradas SET ultimo_acesso = MAX(ultimo_acesso, ?) WHERE chave = ?",
+                    [(momento, chave) for chave, momento in pendentes.items()]
+                )
+        except sqlite3.OperationalError as e:
+            # Ex.: banco travado por outro processo; perder alguns acessos só deixa a LRU menos precisa
+            print(f"Cache: não foi possível gravar {len(pendentes)} acesso(s): {e}")
+
+    def _liberar_espaco(self):
+        """Remove vencidas e depois as menos usadas até ficar abaixo do limite."""
+        conexao = self._conexao()
+        if self._total_bytes(conexao) <= self.limite_bytes:
+            return
+
+        self._gravar_acessos() # A ordem LRU precisa dos acessos ainda na memória
+        alvo = self.limite_bytes * FRACAO_APOS_REMOCAO
+        removidas = 0
+        with conexao:
+            removidas += conexao.execute(
+                "DELETE FROM entradas WHERE expira_em IS NOT NULL AND expira_em <= ?", (time.time(),)
+            ).rowcount
+            total = self._total_bytes(conexao)
+            if total > alvo:
+                # Percorre só o índice (ultimo_acesso, tamanho) até liberar o necessário
+                a_remover = []
+                for id_linha, tamanho in conexao.execute(
+                    "SELECT rowid, tamanho FROM entradas INDEXED BY idx_entradas_lru ORDER BY ultimo_acesso"
+                ):
+                    if total <= alvo:
+                        break
+                    a_remover.append((id_linha,))
+                    total -= tamanho
+                conexao.executemany("DELETE FROM entradas WHERE rowid = ?", a_remover)
+                removidas += len(a_remover)
+        if removidas:
+            print(f"Cache: {removidas} entrada(s) removida(s) por falta de espaço (vencidas e LRU).")
+            metricas.incrementar('cache_sqlite_remocoes_total', removidas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manutenção do cache SQLite compartilhado.")
+    parser.add_argument('--caminho', default=CAMINHO_CACHE_SQLITE)
+    parser.add_argument('--invalidar', metavar='NAMESPACE', help="Remove todas as entradas do namespace")
+    args = parser.parse_args()
+
+    cache_compartilhado = CacheSQLite(caminho=args.caminho)
+    if args.invalidar:
+        print(f"{cache_compartilhado.invalidar_namespace(args.invalidar)} entrada(s) removida(s) de '{args.invalidar}'.")
+    for nome, dados in cache_compartilhado.estatisticas().items():
+        print(f"  {nome:<20} {dados['entradas']:>8} entradas {dados['bytes'] / 2**20:>10.2f} MB")
@@ -0,0 +1,140 @@
+"""
+Coalescência de requisições ("single-flight"): quando várias requisições
+pedem o mesmo relatório ao mesmo tempo, só uma consulta o PNCP; as outras
+esperam e reaproveitam o resultado.
+
+Entre threads do mesmo processo a espera é feita com threading.Event.
+Entre processos do mesmo servidor (workers do Gunicorn) usamos uma trava
+de arquivo (fcntl.flock): quem chega depois bloqueia até o primeiro
+terminar e então encontra o resultado no cache compartilhado. Se o
+processo que segura a trava morrer, o sistema operacional a libera.
+
+As travas são um conjunto fixo de NUMERO_TRAVAS arquivos em PASTA_TRAVAS,
+escolhidos pelo hash da chave, para a pasta não crescer com cada período
+consultado. Duas chaves no mesmo arquivo só esperam uma pela outra; o
+resultado de cada uma continua separado.
+"""
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+import metricas
+
+# fcntl só existe em sistemas Unix; sem ele a coalescência fica só entre threads
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# --- CONFIGURAÇÕES ---
+basedir = os.path.abspath(os.path.dirname(__file__))
+PASTA_TRAVAS = os.environ.get('PASTA_TRAVAS', os.path.join(basedir, 'travas'))
+NUMERO_TRAVAS = 64
+
+
+class _Voo:
+    """Uma execução em andamento para uma chave, com o resultado a compartilhar."""
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+_voos_em_andamento = {}
+_lock_voos = threading.Lock()
+
+
+@contextmanager
+def trava_entre_processos(chave):
+    """Trava exclusiva por chave (ver NUMERO_TRAVAS), compartilhada por todos os processos da máquina."""
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(PASTA_TRAVAS, exist_ok=True)
+    indice = int.from_bytes(hashlib.sha1(chave.encode('utf-8')).digest()[:4], 'big') % NUMERO_TRAVAS
+    nome_arquivo = f"{indice:02d}.lock"
+    with open(os.path.join(PASTA_TRAVAS, nome_arquivo), 'a') as arquivo:
+        fcntl.flock(arquivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(arquivo, fcntl.LOCK_UN)
+
+
+def executar_unico(chave, calcular):
+    """
+    Executa calcular() uma única vez entre as chamadas concorrentes com a
+    mesma chave, e devolve o mesmo resultado (ou a mesma exceção) a todas.
+
+    Como outro processo pode ter terminado o cálculo enquanto esperávamos a
+    trava, calcular() deve primeiro conferir o cache compartilhado.
+    """
+    with _lock_voos:
+        voo = _voos_em_andamento.get(chave)
+        lider = voo is None
+        if lider:
+            voo = _voos_em_andamento[chave] = _Voo()
+
+    if not lider:
+        metricas.incrementar('coalescencia_total', papel='seguidor')
+        voo.evento.wait()
+        if voo.erro is not None:
+            raise voo.erro
+        if voo.resultado is None:
+            # A líder era um fluxo (liderar) interrompido antes do fim: calcula de novo
+            return executar_unico(chave, calcular)
+        return voo.resultado
+
+    metricas.incrementar('coalescencia_total', papel='lider')
+    try:
+        with trava_entre_processos(chave):
+            voo.resultado = calcular()
+        return voo.resultado
+    except Exception as e:
+        voo.erro = e
+        raise
+    finally:
+        with _lock_voos:
+            del _voos_em_andamento[chave]
+        voo.evento.set()
+
+
+@contextmanager
+def liderar(chave):
+    """
+    Versão de executar_unico para quem entrega o resultado aos poucos (ex.:
+    relatório em fluxo). Produz o _Voo se esta chamada é a líder, segurando
+    a trava entre processos até o bloco terminar; a líder deve guardar o
+    resultado completo em voo.resultado para os seguidores de executar_unico.
+    Produz None, depois que a líder em andamento terminar, para as demais:
+    elas devem ler o resultado do cache compartilhado.
+
+    Atenção: a líder segura a trava (e as seguidoras esperam) enquanto o
+    bloco não termina, ou seja, no ritmo de quem consome o fluxo. Um cliente
+    lento atrasa todas as requisições da mesma chave, nesta e nas outras
+    threads e processos, e também as chaves que caem no mesmo arquivo de
+    trava.
+    """
+    with _lock_voos:
+        voo = _voos_em_andamento.get(chave)
+        lider = voo is None
+        if lider:
+            voo = _voos_em_andamento[chave] = _Voo()
+
+    if not lider:
+        metricas.incrementar('coalescencia_total', papel='seguidor')
+        voo.evento.wait()
+        yield None
+        return
+
+    metricas.incrementar('coalescencia_total', papel='lider')
+    try:
+        with trava_entre_processos(chave):
+            yield voo
+    finally:
+        with _lock_voos:
+            del _voos_em_andamento[chave]
+        voo.evento.set()
@@ -0,0 +1,354 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from itertools import islice
+
+# --- CONFIGURAÇÕES ---
+basedir = os.path.abspath(os.path.dirname(__file__))
+CAMINHO_BANCO_LOCAL = os.environ.get('DADOS_PNCP_DB', os.path.join(basedir, 'dados_pncp.db'))
+ITENS_POR_PAGINA_BUSCA = 50
+MAXIMO_ITENS_POR_PAGINA_BUSCA = 200
+TIMEOUT_BANCO_SEG = 30
+TAMANHO_LOTE_INDEXACAO = 500 # Itens por transação ao carregar um fluxo de itens
+
+# Poda de modalidades: uma modalidade que nunca trouxe licitações para o CNPJ
+# após N consultas só é consultada de novo depois de X dias.
+MINIMO_CONSULTAS_VAZIAS_PARA_PODAR = 3
+INTERVALO_REVARREDURA_MODALIDADE_DIAS = 7
+
+# --- ESQUEMA DO BANCO LOCAL ---
+# 'itens_fts' usa o tokenizador unicode61 com remove_diacritics=2, o que torna a
+# busca insensível a acentos ("licitação" == "licitacao") e a maiúsculas.
+ESQUEMA_BANCO = """
+CREATE TABLE IF NOT EXISTS licitacoes (
+    licitacao_key TEXT PRIMARY KEY,
+    id_pncp TEXT,
+    cnpj TEXT NOT NULL,
+    ano INTEGER,
+    sequencial INTEGER,
+    modalidade_nome TEXT,
+    objeto TEXT,
+    data_publicacao TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_licitacoes_cnpj_data ON licitacoes (cnpj, data_publicacao);
+
+CREATE TABLE IF NOT EXISTS itens (
+    id INTEGER PRIMARY KEY,
+    item_key TEXT NOT NULL UNIQUE,
+    licitacao_key TEXT NOT NULL REFERENCES licitacoes (licitacao_key),
+    numero_item INTEGER,
+    tipo TEXT,
+    descricao TEXT,
+    quantidade REAL,
+    valor_unit_estimado REAL,
+    valor_total_estimado REAL
+);
+CREATE INDEX IF NOT EXISTS idx_itens_licitacao ON itens (licitacao_key);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS itens_fts USING fts5 (
+    descricao,
+    objeto,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE TABLE IF NOT EXISTS estatisticas_modalidades (
+    cnpj TEXT NOT NULL,
+    modalidade INTEGER NOT NULL,
+    consultas INTEGER NOT NULL DEFAULT 0,
+    consultas_com_dados INTEGER NOT NULL DEFAULT 0,
+    ultima_consulta TEXT,
+    ultima_com_dados TEXT,
+    PRIMARY KEY (cnpj, modalidade)
+);
+"""
+
+_esquema_criado = False
+_lock_esquema = threading.Lock()
+
+
+def conectar():
+    """Abre uma conexão com o banco local, criando o esquema na primeira vez."""
+    global _esquema_criado
+    conexao = sqlite3.connect(CAMINHO_BANCO_LOCAL, timeout=TIMEOUT_BANCO_SEG)
+    conexao.row_factory = sqlite3.Row
+    conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.execute("PRAGMA synchronous=NORMAL")
+
+    if not _esquema_criado:
+        with _lock_esquema:
+            if not _esquema_criado:
+                conexao.executescript(ESQUEMA_BANCO)
+                _esquema_criado = True
+    return conexao
+
+
+def chave_licitacao(cnpj, ano, sequencial):
+    return f"{cnpj}-{ano}-{sequencial}"
+
+
+def chave_item(cnpj, ano, sequencial, numero_item):
+    """Mesma chave usada pelo site colaborativo (Contribution.item_key)."""
+    return f"{cnpj}-{ano}-{sequencial}-{numero_item}"
+
+
+# --- INDEXAÇÃO ---
+
+def indexar_itens(itens):
+    """
+    Grava (ou atualiza) no banco local os itens retornados por
+    buscador_pncp.gerar_relatorio_bruto e mantém o índice FTS sincronizado.
+    Retorna o número de itens indexados.
+    """
+    total = 0
+    conexao = conectar()
+    try:
+        with conexao:  # Uma única transação para o lote inteiro
+            for item in itens:
+                cnpj, ano, sequencial = item.get('cnpj'), item.get('ano'), item.get('sequencial')
+                if not cnpj or not ano or not sequencial:
+                    continue
+
+                lic_key = chave_licitacao(cnpj, ano, sequencial)
+                conexao.execute(
+                    """
+                    INSERT INTO licitacoes (licitacao_key, id_pncp, cnpj, ano, sequencial,
+                                            modalidade_nome, objeto, data_publicacao)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (licitacao_key) DO UPDATE SET
+                        id_pncp = excluded.id_pncp,
+                        modalidade_nome = excluded.modalidade_nome,
+                        objeto = excluded.objeto,
+                        data_publicacao = excluded.data_publicacao
+                    """,
+                    (lic_key, item.get('id_pncp'), cnpj, ano, sequencial,
+                     item.get('licitacao_modalidade'), item.get('licitacao_objeto'),
+                     item.get('licitacao_data_publicacao'))
+                )
+
+                item_key = chave_item(cnpj, ano, sequencial, item.get('numero_item'))
+                linha = conexao.execute(
+                    """
+                    INSERT INTO itens (item_key, licitacao_key, numero_item, tipo, descricao,
+                                       quantidade, valor_unit_estimado, valor_total_estimado)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (item_key) DO UPDATE SET
+                        tipo = excluded.tipo,
+                        descricao = excluded.descricao,
+                        quantidade = excluded.quantidade,
+                        valor_unit_estimado = excluded.valor_unit_estimado,
+                        valor_total_estimado = excluded.valor_total_estimado
+                    RETURNING id
+                    """,
+                    (item_key, lic_key, item.get('numero_item'), item.get('tipo'),
+                     item.get('descricao'), item.get('quantidade'),
+                     item.get('valor_unit_estimado'), item.get('valor_total_estimado'))
+                ).fetchone()
+
+                # O FTS5 não tem UPSERT: removemos a linha antiga e inserimos de novo
+                conexao.execute("DELETE FROM itens_fts WHERE rowid = ?", (linha['id'],))
+                conexao.execute(
+                    "INSERT INTO itens_fts (rowid, descricao, objeto) VALUES (?, ?, ?)",
+                    (linha['id'], item.get('descricao') or '', item.get('licitacao_objeto') or '')
+                )
+                total += 1
+    finally:
+        conexao.close()
+    return total
+
+
+def indexar_em_lotes(itens, tamanho_lote=TAMANHO_LOTE_INDEXACAO):
+    """
+    Consome um fluxo de itens (ex.: buscador_pncp.iterar_relatorio) gravando
+    um lote por transação, para não acumular o relatório inteiro em memória.
+    Aceita registros.Item ou dicionários no formato "bruto". Retorna o total.
+    """
+    itens = iter(itens)
+    total = 0
+    while True:
+        lote = [
+            item if isinstance(item, dict) else item.para_dict(completo=True)
+            for item in islice(itens, tamanho_lote)
+        ]
+        if not lote:
+            return total
+        total += indexar_itens(lote)
+
+
+# --- ESTATÍSTICAS DE MODALIDADES ---
+
+def modalidades_a_consultar(cnpj, modalidades, varredura_completa=False, agora=None):
+    """
+    Filtra as modalidades que valem a pena consultar para o CNPJ. Ficam de
+    fora só as que, após MINIMO_CONSULTAS_VAZIAS_PARA_PODAR consultas, nunca
+    trouxeram licitações e foram consultadas nos últimos
+    INTERVALO_REVARREDURA_MODALIDADE_DIAS dias; assim cada modalidade podada
+    ainda é reconferida periodicamente.
+    """
+    if varredura_completa:
+        return list(modalidades)
+
+    conexao = conectar()
+    try:
+        estatisticas = {
+            linha['modalidade']: linha for linha in conexao.execute(
+                "SELECT modalidade, consultas, consultas_com_dados, ultima_consulta "
+                "FROM estatisticas_modalidades WHERE cnpj = ?", (cnpj,)
+            )
+        }
+    finally:
+        conexao.close()
+
+    limite = ((agora or datetime.now()) - timedelta(days=INTERVALO_REVARREDURA_MODALIDADE_DIAS)).isoformat()
+    escolhidas = []
+    for modalidade in modalidades:
+        estatistica = estatisticas.get(modalidade)
+        if (estatistica is None
+                or estatistica['consultas_com_dados'] > 0
+                or estatistica['consultas'] < MINIMO_CONSULTAS_VAZIAS_PARA_PODAR
+                or estatistica['ultima_consulta'] < limite):
+            escolhidas.append(modalidade)
+    return escolhidas
+
+
+def registrar_consultas_modalidades(cnpj, resultados, agora=None):
+    """Registra o resultado da primeira página de cada modalidade: {modalidade: teve_dados}."""
+    if not resultados:
+        return
+    momento = (agora or datetime.now()).isoformat(timespec='seconds')
+    conexao = conectar()
+    try:
+        with conexao:
+            conexao.executemany(
+                """
+                INSERT INTO estatisticas_modalidades
+                    (cnpj, modalidade, consultas, consultas_com_dados, ultima_consulta, ultima_com_dados)
+                VALUES (?, ?, 1, ?, ?, ?)
+                ON CONFLICT (cnpj, modalidade) DO UPDATE SET
+                    consultas = consultas + 1,
+                    consultas_com_dados = consultas_com_dados + excluded.consultas_com_dados,
+                    ultima_consulta = excluded.ultima_consulta,
+                    ultima_com_dados = COALESCE(excluded.ultima_com_dados, ultima_com_dados)
+                """,
+                [
+                    (cnpj, modalidade, int(teve_dados), momento, momento if teve_dados else None)
+                    for modalidade, teve_dados in resultados.items()
+                ]
+            )
+    finally:
+        conexao.close()
+
+
+# --- BUSCA ---
+
+def _montar_consulta_fts(termo):
+    """
+    Converte o texto digitado pelo usuário em uma consulta FTS5 segura.
+    Cada palavra vira um prefixo ("toner" casa com "toners"), todas obrigatórias.
+    """
+    palavras = re.findall(r'\w+', termo or '')
+    if not palavras:
+        raise ValueError("Informe ao menos uma palavra para a busca.")
+    return " ".join(f'"{palavra}"*' for palavra in palavras)
+
+
+def _converter_data(data_str, nome):
+    try:
+        return datetime.strptime(data_str, '%Y%m%d')
+    except ValueError:
+        raise ValueError(f"Parâmetro '{nome}' inválido. Use YYYYMMDD.")
+
+
+def buscar_itens(termo, cnpj=None, data_inicio=None, data_fim=None, modalidade=None,
+                 preco_min=None, preco_max=None, pagina=1, por_pagina=ITENS_POR_PAGINA_BUSCA):
+    """
+    Busca textual nos itens indexados localmente (nunca consulta o PNCP).
+    Resultados ordenados por relevância (bm25), com peso maior para a descrição
+    do item do que para o objeto da licitação.
+    Lança ValueError para parâmetros inválidos.
+    """
+    consulta_fts = _montar_consulta_fts(termo)
+
+    if pagina < 1:
+        raise ValueError("Parâmetro 'pagina' deve ser maior ou igual a 1.")
+    if not 1 <= por_pagina <= MAXIMO_ITENS_POR_PAGINA_BUSCA:
+        raise ValueError(f"Parâmetro 'por_pagina' deve estar entre 1 e {MAXIMO_ITENS_POR_PAGINA_BUSCA}.")
+
+    filtros = ["itens_fts MATCH ?"]
+    parametros = [consulta_fts]
+
+    if cnpj:
+        filtros.append("l.cnpj = ?")
+        parametros.append(cnpj)
+    if data_inicio:
+        filtros.append("l.data_publicacao >= ?")
+        parametros.append(_converter_data(data_inicio, 'inicio').strftime('%Y-%m-%d'))
+    if data_fim:
+        # data_publicacao vem com horário (ISO), então comparamos com o dia seguinte
+        dia_seguinte = _converter_data(data_fim, 'fim') + timedelta(days=1)
+        filtros.append("l.data_publicacao < ?")
+        parametros.append(dia_seguinte.strftime('%Y-%m-%d'))
+    if modalidade:
+        filtros.append("l.modalidade_nome = ?")
+        parametros.append(modalidade)
+    if preco_min is not None:
+        filtros.append("i.valor_unit_estimado >= ?")
+        parametros.append(preco_min)
+    if preco_max is not None:
+        filtros.append("i.valor_unit_estimado <= ?")
+        parametros.append(preco_max)
+
+    sql_base = f"""
+        FROM itens_fts
+        JOIN itens i ON i.id = itens_fts.rowid
+        JOIN licitacoes l ON l.licitacao_key = i.licitacao_key
+        WHERE {' AND '.join(filtros)}
+    """
+
+    conexao = conectar()
+    try:
+        total = conexao.execute(f"SELECT COUNT(*) {sql_base}", parametros).fetchone()[0]
+        linhas = conexao.execute(
+            f"""
+            SELECT i.item_key, i.numero_item, i.tipo, i.descricao, i.quantidade,
+                   i.valor_unit_estimado, i.valor_total_estimado,
+                   l.id_pncp, l.cnpj, l.ano, l.sequencial, l.modalidade_nome,
+                   l.objeto, l.data_publicacao,
+                   bm25(itens_fts, 2.0, 1.0) AS relevancia
+            {sql_base}
+            ORDER BY relevancia
+            LIMIT ? OFFSET ?
+            """,
+            parametros + [por_pagina, (pagina - 1) * por_pagina]
+        ).fetchall()
+    finally:
+        conexao.close()
+
+    resultados = []
+    for linha in linhas:
+        resultados.append({
+            'item_key': linha['item_key'],
+            'numero_item': linha['numero_item'],
+            'tipo': linha['tipo'],
+            'descricao': linha['descricao'],
+            'quantidade': linha['quantidade'],
+            'valor_unit_estimado': linha['valor_unit_estimado'],
+            'valor_total_estimado': linha['valor_total_estimado'],
+            'id_pncp': linha['id_pncp'],
+            'cnpj': linha['cnpj'],
+            'ano': linha['ano'],
+            'sequencial': linha['sequencial'],
+            'licitacao_modalidade': linha['modalidade_nome'],
+            'licitacao_objeto': linha['objeto'],
+            'licitacao_data_publicacao': linha['data_publicacao'],
+            # bm25 retorna valores negativos (menor = mais relevante)
+            'relevancia': round(-linha['relevancia'], 4)
+        })
+
+    return {
+        'total': total,
+        'pagina': pagina,
+        'por_pagina': por_pagina,
+        'resultados': resultados
+    }
@@ -0,0 +1,145 @@
+"""
+Estado persistente do monitor (SQLite) para execuções incrementais:
+  - checkpoint: até quando cada CNPJ já foi processado;
+  - itens: impressão digital do conteúdo de cada item já analisado e o
+    resultado da análise, para só reprocessar o que mudou;
+  - licitações pendentes: as que têm itens sem preço de varejo (Buscapé
+    falhou ou bloqueou), revisitadas nas execuções seguintes.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+# --- CONFIGURAÇÕES ---
+basedir = os.path.abspath(os.path.dirname(__file__))
+CAMINHO_ESTADO_MONITOR = os.environ.get('ESTADO_MONITOR_DB', os.path.join(basedir, 'estado_monitor.db'))
+# Gravada no lugar da impressão digital quando a análise precisa ser refeita
+# (nunca coincide com uma impressão real, então o item não é pulado)
+IMPRESSAO_PENDENTE = 'pendente'
+
+ESQUEMA_ESTADO = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    cnpj TEXT PRIMARY KEY,
+    processado_ate TEXT NOT NULL  -- Data (YYYYMMDD) do início da última execução completa
+);
+
+CREATE TABLE IF NOT EXISTS itens_analisados (
+    item_key TEXT PRIMARY KEY,
+    impressao_digital TEXT NOT NULL,
+    alerta INTEGER NOT NULL,
+    resultado TEXT NOT NULL,        -- JSON com a linha do relatório do monitor
+    analisado_em TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS licitacoes_pendentes (
+    chave TEXT PRIMARY KEY,         -- cnpj-ano-sequencial
+    cnpj TEXT NOT NULL,
+    licitacao TEXT NOT NULL,        -- JSON da licitação, como veio da listagem
+    tentativas INTEGER NOT NULL,
+    atualizado_em TEXT NOT NULL
+);
+"""
+
+
+def conectar(caminho=None):
+    conexao = sqlite3.connect(caminho or CAMINHO_ESTADO_MONITOR)
+    conexao.row_factory = sqlite3.Row
+    conexao.executescript(ESQUEMA_ESTADO)
+    return conexao
+
+
+def impressao_digital(item):
+    """Muda sempre que a descrição, a quantidade, o preço estimado ou o tipo mudam."""
+    conteudo = json.dumps([
+        item.get('descricao'), item.get('quantidade'),
+        item.get('valor_unit_estimado'), item.get('tipo')
+    ], ensure_ascii=False)
+    return hashlib.sha1(conteudo.encode('utf-8')).hexdigest()
+
+
+# --- CHECKPOINT ---
+
+def obter_checkpoint(conexao, cnpj):
+    linha = conexao.execute("SELECT processado_ate FROM checkpoints WHERE cnpj = ?", (cnpj,)).fetchone()
+    return linha['processado_ate'] if linha else None
+
+
+def salvar_checkpoint(conexao, cnpj, processado_ate):
+    with conexao:
+        conexao.execute(
+            """
+            INSERT INTO checkpoints (cnpj, processado_ate) VALUES (?, ?)
+            ON CONFLICT (cnpj) DO UPDATE SET processado_ate = excluded.processado_ate
+            """,
+            (cnpj, processado_ate)
+        )
+
+
+# --- ITENS ANALISADOS ---
+
+def obter_analise(conexao, item_key):
+    """Retorna (impressao_digital, alerta, resultado) ou None se o item nunca foi analisado."""
+    linha = conexao.execute(
+        "SELECT impressao_digital, alerta, resultado FROM itens_analisados WHERE item_key = ?", (item_key,)
+    ).fetchone()
+    if linha is None:
+        return None
+    return linha['impressao_digital'], bool(linha['alerta']), json.loads(linha['resultado'])
+
+
+def salvar_analise(conexao, item_key, impressao, resultado):
+    with conexao:
+        conexao.execute(
+            """
+            INSERT INTO itens_analisados (item_key, impressao_digital, alerta, resultado, analisado_em)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (item_key) DO UPDATE SET
+                impressao_digital = excluded.impressao_digital,
+                alerta = excluded.alerta,
+                resultado = excluded.resultado,
+                analisado_em = excluded.analisado_em
+            """,
+            (item_key, impressao, int(bool(resultado.get('alerta'))),
+             json.dumps(resultado, ensure_ascii=False),
+             datetime.now().isoformat(timespec='seconds'))
+        )
+
+
+# --- LICITAÇÕES PENDENTES ---
+
+def _chave_licitacao(cnpj, lic):
+    return f"{cnpj}-{lic['ano']}-{lic['sequencial']}"
+
+
+def marcar_licitacao_pendente(conexao, cnpj, lic):
+    """Registra (ou conta mais uma tentativa de) uma licitação com itens a reanalisar."""
+    with conexao:
+        conexao.execute(
+            """
+            INSERT INTO licitacoes_pendentes (chave, cnpj, licitacao, tentativas, atualizado_em)
+            VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT (chave) DO UPDATE SET
+                licitacao = excluded.licitacao,
+                tentativas = tentativas + 1,
+                atualizado_em = excluded.atualizado_em
+            """,
+            (_chave_licitacao(cnpj, lic), cnpj, json.dumps(lic, ensure_ascii=False),
+             datetime.now().isoformat(timespec='seconds'))
+        )
+
+
+def remover_licitacao_pendente(conexao, cnpj, lic):
+    with conexao:
+        conexao.execute("DELETE FROM licitacoes_pendentes WHERE chave = ?", (_chave_licitacao(cnpj, lic),))
+
+
+def licitacoes_pendentes(conexao, cnpj):
+    """Retorna [(licitacao, tentativas)] do CNPJ."""
+    return [
+        (json.loads(linha['licitacao']), linha['tentativas'])
+        for linha in conexao.execute(
+            "SELECT licitacao, tentativas FROM licitacoes_pendentes WHERE cnpj = ? ORDER BY chave", (cnpj,)
+        )
+    ]
@@ -0,0 +1,168 @@
+"""
+Métricas em memória (contadores, medidores e histogramas) no formato do
+Prometheus. Usadas pelo buscador, pelo monitor e pelo app Flask.
+
+Cada processo tem seu próprio registro: com vários workers do Gunicorn,
+cada um expõe os próprios números em /metrics e o Prometheus soma.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Limites (em segundos) dos buckets dos histogramas de duração
+BUCKETS_DURACAO_SEG = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _chave_rotulos(rotulos):
+    return tuple(sorted((nome, str(valor)) for nome, valor in rotulos.items()))
+
+
+def _escapar(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar_rotulos(chave_rotulos, extra=()):
+    pares = list(chave_rotulos) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + "}"
+
+
+class RegistroMetricas:
+    """Registro thread-safe. Métricas são criadas no primeiro uso."""
+
+    def __init__(self, buckets=BUCKETS_DURACAO_SEG):
+        self._lock = threading.Lock()
+        self._buckets = tuple(buckets)
+        self._contadores = {}  # nome -> {chave_rotulos: valor}
+        self._medidores = {}   # nome -> {chave_rotulos: valor}
+        self._histogramas = {} # nome -> {chave_rotulos: [contagens_por_bucket, soma, total]}
+
+    # --- Atualização ---
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = _chave_rotulos(rotulos)
+        with self._lock:
+            serie = self._contadores.setdefault(nome, {})
+            serie[chave] = serie.get(chave, 0) + valor
+
+    def definir(self, nome, valor, **rotulos):
+        with self._lock:
+            self._medidores.setdefault(nome, {})[_chave_rotulos(rotulos)] = valor
+
+    def ajustar(self, nome, delta, **rotulos):
+        chave = _chave_rotulos(rotulos)
+        with self._lock:
+            serie = self._medidores.setdefault(nome, {})
+            serie[chave] = serie.get(chave, 0) + delta
+
+    def observar(self, nome, valor, **rotulos):
+        chave = _chave_rotulos(rotulos)
+        with self._lock:
+            serie = self._histogramas.setdefault(nome, {})
+            if chave not in serie:
+                serie[chave] = [[0] * len(self._buckets), 0.0, 0]
+            contagens, _, _ = dados = serie[chave]
+            for i, limite in enumerate(self._buckets):
+                if valor <= limite:
+                    contagens[i] += 1
+            dados[1] += valor
+            dados[2] += 1
+
+    @contextmanager
+    def cronometrar(self, nome, **rotulos):
+        """Observa no histograma 'nome' a duração do bloco (mesmo se ele falhar)."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nome, time.perf_counter() - inicio, **rotulos)
+
+    def zerar(self):
+        with self._lock:
+            self._contadores.clear()
+            self._medidores.clear()
+            self._histogramas.clear()
+
+    # --- Exportação ---
+
+    def exportar_prometheus(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+        linhas = []
+        with self._lock:
+            for nome, serie in sorted(self._contadores.items()):
+                linhas.append(f"# TYPE {nome} counter")
+                for chave, valor in sorted(serie.items()):
+                    linhas.append(f"{nome}{_formatar_rotulos(chave)} {valor}")
+
+            for nome, serie in sorted(self._medidores.items()):
+                linhas.append(f"# TYPE {nome} gauge")
+                for chave, valor in sorted(serie.items()):
+                    linhas.append(f"{nome}{_formatar_rotulos(chave)} {valor}")
+
+            for nome, serie in sorted(self._histogramas.items()):
+                linhas.append(f"# TYPE {nome} histogram")
+                for chave, (contagens, soma, total) in sorted(serie.items()):
+                    for limite, contagem in zip(self._buckets, contagens):
+                        linhas.append(f"{nome}_bucket{_formatar_rotulos(chave, [('le', str(limite))])} {contagem}")
+                    linhas.append(f"{nome}_bucket{_formatar_rotulos(chave, [('le', '+Inf')])} {total}")
+                    linhas.append(f"{nome}_sum{_formatar_rotulos(chave)} {soma}")
+                    linhas.append(f"{nome}_count{_formatar_rotulos(chave)} {total}")
+        return "\n".join(linhas) + "\n"
+
+    def exportar_dict(self):
+        """Mesmos dados em estrutura simples, para salvar como JSON nas execuções de linha de comando."""
+        with self._lock:
+            return {
+                'contadores': {
+                    nome: [{'rotulos': dict(chave), 'valor': valor} for chave, valor in sorted(serie.items())]
+                    for nome, serie in sorted(self._contadores.items())
+                },
+                'medidores': {
+                    nome: [{'rotulos': dict(chave), 'valor': valor} for chave, valor in sorted(serie.items())]
+                    for nome, serie in sorted(self._medidores.items())
+                },
+                'histogramas': {
+                    nome: [
+                        {
+                            'rotulos': dict(chave),
+                            'contagem': total,
+                            'soma': round(soma, 6),
+                            'media': round(soma / total, 6) if total else None,
+                            'buckets': {str(limite): contagem for limite, contagem in zip(self._buckets, contagens)}
+                        }
+                        for chave, (contagens, soma, total) in sorted(serie.items())
+                    ]
+                    for nome, serie in sorted(self._histogramas.items())
+                }
+            }
+
+    def salvar_json(self, caminho):
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump(self.exportar_dict(), f, ensure_ascii=False, indent=2)
+
+
+# --- REGISTRO GLOBAL DO PROCESSO ---
+REGISTRO = RegistroMetricas()
+
+incrementar = REGISTRO.incrementar
+definir = REGISTRO.definir
+ajustar = REGISTRO.ajustar
+observar = REGISTRO.observar
+cronometrar = REGISTRO.cronometrar
+exportar_prometheus = REGISTRO.exportar_prometheus
+salvar_json = REGISTRO.salvar_json
+
+
+def medir_etapa(etapa):
+    """Cronometra uma etapa do processamento (listagem, itens, nlp, preco_varejo, sobreposicao_db)."""
+    return REGISTRO.cronometrar('etapa_duracao_segundos', etapa=etapa)
+
+
+def registrar_requisicao_externa(servico, status, duracao_seg, bytes_baixados=0):
+    """Registra uma chamada ao PNCP ou ao Buscapé. 'status' é o código HTTP ou 'erro'."""
+    REGISTRO.incrementar('requisicoes_externas_total', servico=servico, status=status)
+    REGISTRO.observar('requisicao_externa_duracao_segundos', duracao_seg, servico=servico)
+    if bytes_baixados:
+        REGISTRO.incrementar('bytes_baixados_total', bytes_baixados, servico=servico)
@@ -1,3 +1,4 @@
+import argparse
 import json
 import re
 import time
@@ -8,6 +9,10 @@ import requests
 import spacy  # Importa a biblioteca de IA (NLP)
 from bs4 import BeautifulSoup
 
+import estado_monitor
+import metricas
+import perfilamento
+
 # --- CONFIGURAÇÕES ---
 CNPJ_AMARGOSA = "13825484000150"
 DIAS_PARA_BUSCAR = 30 # Buscar licitações dos últimos 30 dias
@@ -15,11 +20,20 @@ LIMITE_ALERTA_PERCENTUAL = 0.30 # 30% acima do preço de referência
 ITENS_POR_PAGINA_LICITACOES = 50
 MAXIMO_PAGINAS_POR_MODALIDADE = 2 # Limite para não sobrecarregar (máx 2 páginas por modalidade)
 PAUSA_ENTRE_REQUISICOES_SEG = 1
+FONTE_VAREJO = "Varejo (Buscapé/IA)"
+# Buscapé fora do ar, bloqueando ou com página que não conseguimos ler: o item
+# fica pendente e é refeito. "Nenhuma oferta" é resultado, não falha.
+FONTE_VAREJO_INDISPONIVEL = "Varejo (Buscapé/IA) - indisponível"
+# Execuções seguidas em que uma licitação com itens sem preço de varejo é revisitada
+MAXIMO_REVISITAS_PRECO_VAREJO = 7
 
 # --- URLs DAS APIs ---
 URL_API_PNCP_CONSULTA_BASE = "https://pncp.gov.br/api/consulta"
 ENDPOINT_PNCP_BUSCA_LICITACOES = "/v1/contratacoes/publicacao"
+# Licitações publicadas OU alteradas no período (usado nas execuções incrementais)
+ENDPOINT_PNCP_BUSCA_ATUALIZADAS = "/v1/contratacoes/atualizacao"
 URL_API_PNCP_INTEGRACAO_BASE = "https://pncp.gov.br/api/pncp"
+URL_BUSCAPE_BUSCA = "https://www.buscape.com.br/search"
 
 # --- Códigos de Modalidade (Manual Tabela 5.2) ---
 MODALIDADES = list(range(1, 14)) # De 1 a 13
@@ -62,18 +76,29 @@ PALAVRAS_REMOVER_LICITACAO = {
 
 # --- FUNÇÕES AUXILIARES ---
 
-def buscar_licitacoes_recentes(cnpj, dias_atras):
-    """Busca licitações publicadas no PNCP iterando por todas as modalidades."""
-    print(f"\n--- Buscando licitações para {cnpj} (últimos {dias_atras} dias) ---")
-    licitacoes_encontradas_total = []
+def buscar_licitacoes_recentes(cnpj, dias_atras, desde=None, erros=None):
+    """
+    Busca licitações publicadas no PNCP iterando por todas as modalidades.
 
+    desde: data (YYYYMMDD) do último checkpoint; se informada, busca as
+           licitações publicadas ou atualizadas a partir dela, em vez dos
+           últimos 'dias_atras' dias.
+    erros: lista onde são anotadas as páginas que falharam.
+    """
     data_hoje = datetime.now()
-    data_inicio = data_hoje - timedelta(days=dias_atras)
     formato_data = "%Y%m%d"
     data_final_str = data_hoje.strftime(formato_data)
-    data_inicial_str = data_inicio.strftime(formato_data)
 
-    url_busca = f"{URL_API_PNCP_CONSULTA_BASE}{ENDPOINT_PNCP_BUSCA_LICITACOES}"
+    if desde:
+        print(f"\n--- Buscando licitações para {cnpj} (publicadas ou alteradas desde {desde}) ---")
+        data_inicial_str = desde
+        url_busca = f"{URL_API_PNCP_CONSULTA_BASE}{ENDPOINT_PNCP_BUSCA_ATUALIZADAS}"
+    else:
+        print(f"\n--- Buscando licitações para {cnpj} (últimos {dias_atras} dias) ---")
+        data_inicial_str = (data_hoje - timedelta(days=dias_atras)).strftime(formato_data)
+        url_busca = f"{URL_API_PNCP_CONSULTA_BASE}{ENDPOINT_PNCP_BUSCA_LICITACOES}"
+
+    licitacoes_encontradas_total = []
     headers = {'Accept': 'application/json'}
 
     for cod_modalidade in MODALIDADES:
@@ -93,7 +118,11 @@ def buscar_licitacoes_recentes(cnpj, dias_atras):
 
             try:
                 time.sleep(PAUSA_ENTRE_REQUISICOES_SEG)
+                inicio_req = time.perf_counter()
                 response = requests.get(url_busca, headers=headers, params=params, timeout=60)
+                metricas.registrar_requisicao_externa(
+                    'pncp_consulta', response.status_code, time.perf_counter() - inicio_req, len(response.content)
+                )
 
                 if response.status_code == 200:
                     dados = response.json()
@@ -124,16 +153,22 @@ def buscar_licitacoes_recentes(cnpj, dias_atras):
                     break
                 else:
                     print(f"  Erro ao buscar Modalidade {cod_modalidade} (Página {pagina_atual}): Status {response.status_code}")
+                    _anotar_erro(erros, f"Modalidade {cod_modalidade}, página {pagina_atual}: status {response.status_code}")
                     break
 
             except requests.Timeout:
+                metricas.incrementar('requisicoes_externas_total', servico='pncp_consulta', status='erro')
                 print(f"  TIMEOUT (Modalidade {cod_modalidade}, Página {pagina_atual}): A API demorou mais de 60 segundos para responder.")
+                _anotar_erro(erros, f"Modalidade {cod_modalidade}, página {pagina_atual}: timeout")
                 break
             except requests.RequestException as e:
+                metricas.incrementar('requisicoes_externas_total', servico='pncp_consulta', status='erro')
                 print(f"  Erro de conexão (Modalidade {cod_modalidade}, Página {pagina_atual}): {e}")
+                _anotar_erro(erros, f"Modalidade {cod_modalidade}, página {pagina_atual}: {e}")
                 break
             except json.JSONDecodeError:
                 print(f"  Erro JSON (Modalidade {cod_modalidade}, Página {pagina_atual}).")
+                _anotar_erro(erros, f"Modalidade {cod_modalidade}, página {pagina_atual}: JSON inválido")
                 break
 
         if licitacoes_modalidade:
@@ -143,8 +178,13 @@ def buscar_licitacoes_recentes(cnpj, dias_atras):
     print(f"\n--- Total de {len(licitacoes_encontradas_total)} licitações encontradas em todas as modalidades. ---")
     return licitacoes_encontradas_total
 
-def buscar_itens_licitacao(cnpj, ano, sequencial):
-    """Busca os itens de uma licitação específica."""
+def _anotar_erro(erros, mensagem):
+    if erros is not None:
+        erros.append(mensagem)
+
+
+def buscar_itens_licitacao(cnpj, ano, sequencial, erros=None):
+    """Busca os itens de uma licitação específica. Falhas são anotadas em 'erros'."""
     print(f"  Buscando itens para licitação {ano}/{sequencial}...")
     itens_encontrados = []
     url_itens = f"{URL_API_PNCP_INTEGRACAO_BASE}/v1/orgaos/{cnpj}/compras/{ano}/{sequencial}/itens"
@@ -152,7 +192,11 @@ def buscar_itens_licitacao(cnpj, ano, sequencial):
 
     try:
         time.sleep(PAUSA_ENTRE_REQUISICOES_SEG)
+        inicio_req = time.perf_counter()
         response = requests.get(url_itens, headers=headers, timeout=20)
+        metricas.registrar_requisicao_externa(
+            'pncp_itens', response.status_code, time.perf_counter() - inicio_req, len(response.content)
+        )
 
         if response.status_code == 200:
             itens_bruto = response.json()
@@ -166,12 +210,16 @@ def buscar_itens_licitacao(cnpj, ano, sequencial):
                     'valor_total_estimado': item.get('valorTotalEstimado')
                 })
             print(f"  Encontrados {len(itens_encontrados)} itens.")
-        else:
+        elif response.status_code not in (204, 404):
             print(f"  Erro ao buscar itens para {ano}/{sequencial}: Status {response.status_code}")
+            _anotar_erro(erros, f"Itens de {ano}/{sequencial}: status {response.status_code}")
     except requests.RequestException as e:
+        metricas.incrementar('requisicoes_externas_total', servico='pncp_itens', status='erro')
         print(f"  Erro de conexão ao buscar itens para {ano}/{sequencial}: {e}")
+        _anotar_erro(erros, f"Itens de {ano}/{sequencial}: {e}")
     except json.JSONDecodeError:
         print(f"  Erro ao decodificar JSON da API de itens para {ano}/{sequencial}.")
+        _anotar_erro(erros, f"Itens de {ano}/{sequencial}: JSON inválido")
 
     return itens_encontrados
 
@@ -225,11 +273,17 @@ def detectar_inconsistencia_quantidade(descricao, quantidade):
     return None, False
 
 
+class ErroBuscaVarejo(Exception):
+    """Falha passageira ao consultar o Buscapé (rede, bloqueio, página ilegível)."""
+
+
 # --- FUNÇÃO buscar_preco_varejo REFINADA COM IA (spaCy) ---
 def buscar_preco_varejo(descricao_completa):
     """
     Busca o preço mediano de um item no Buscapé, usando IA (spaCy) para
     normalizar o nome do item e extrair palavras-chave relevantes.
+    Retorna None se o Buscapé não tiver ofertas para o termo e lança
+    ErroBuscaVarejo se a consulta falhar (vale tentar de novo depois).
     """
     if not descricao_completa:
         return None
@@ -275,7 +329,7 @@ def buscar_preco_varejo(descricao_completa):
     # --- FIM DA NORMALIZAÇÃO COM IA ---
 
     termo_formatado = termo_busca.replace(' ', '+')
-    url_buscape = f"https://www.buscape.com.br/search?q={termo_formatado}"
+    url_buscape = f"{URL_BUSCAPE_BUSCA}?q={termo_formatado}"
 
     print(f"      Buscando varejo para termo normalizado: '{termo_busca}' (Original: '{descricao_completa[:30]}...')...")
 
@@ -285,7 +339,11 @@ def buscar_preco_varejo(descricao_completa):
 
     try:
         time.sleep(PAUSA_ENTRE_REQUISICOES_SEG)
+        inicio_req = time.perf_counter()
         response = requests.get(url_buscape, headers=headers, timeout=20)
+        metricas.registrar_requisicao_externa(
+            'buscape', response.status_code, time.perf_counter() - inicio_req, len(response.content)
+        )
 
         if response.status_code == 200:
             soup = BeautifulSoup(response.content, 'html.parser')
@@ -324,30 +382,167 @@ def buscar_preco_varejo(descricao_completa):
                 return mediana
             else:
                 print(f"      Preços encontrados, mas não extraídos numericamente para '{termo_busca}'.")
-                return None
+                raise ErroBuscaVarejo(f"Preços ilegíveis para '{termo_busca}'")
 
         else:
             print(f"      Erro ao acessar Buscapé ({response.status_code}) para '{termo_busca}'. Possível bloqueio.")
-            return None
+            raise ErroBuscaVarejo(f"Status {response.status_code}")
 
     except requests.RequestException as e:
+        metricas.incrementar('requisicoes_externas_total', servico='buscape', status='erro')
         print(f"      Erro de conexão com Buscapé para '{termo_busca}': {e}")
-        return None
+        raise ErroBuscaVarejo(str(e))
 # --- FIM DA FUNÇÃO buscar_preco_varejo REFINADA ---
 
 
+# --- ANÁLISE DE UM ITEM ---
+def analisar_item(lic, item):
+    """Roda as heurísticas e a comparação de preço de um item. Retorna a linha do relatório."""
+    print(f"  Analisando Item {item['numero_item']}: '{item['descricao'][:60]}...' (Tipo: {item.get('tipo', 'Desconhecido')})")
+
+    # --- OBTÉM OS DADOS ESSENCIAIS ---
+    preco_estimado_lic = item.get('valor_unit_estimado')
+    quantidade_lic = item.get('quantidade') # Pega a quantidade
+
+    # --- Verificação de Inconsistência (Trava de Segurança) ---
+    with metricas.medir_etapa('nlp'):
+        aviso_inconsistencia, parar_comparacao = detectar_inconsistencia_quantidade(item['descricao'], quantidade_lic)
+    
+    if aviso_inconsistencia:
+        print(f"      ⚠️ AVISO: {aviso_inconsistencia}.")
+        if preco_estimado_lic:
+             print(f"      O valor estimado (R$ {preco_estimado_lic:.2f}) pode ser referente ao Lote/Kit e não à unidade.")
+    # --- FIM DA VERIFICAÇÃO ---
+
+    preco_referencia = None
+    fonte_referencia = None
+
+    # --- LÓGICA DE COMPARAÇÃO ATUALIZADA ---
+    
+    # Se a heurística mandou parar, pulamos a busca de preço
+    if parar_comparacao:
+        print("      Comparação de preço de varejo PULADA devido à inconsistência de quantidade.")
+        fonte_referencia = "N/A (Inconsistência Qtd/Descrição)"
+    
+    elif item.get('tipo') == 'Material':
+        fonte_referencia = FONTE_VAREJO
+        with metricas.medir_etapa('preco_varejo'):
+            try:
+                preco_referencia = buscar_preco_varejo(item['descricao'])
+            except ErroBuscaVarejo:
+                fonte_referencia = FONTE_VAREJO_INDISPONIVEL
+    
+    # <<< CORREÇÃO AQUI: Mudado de 'Servico' para 'Serviço' (com acento)
+    elif item.get('tipo') == 'Serviço':
+        print("      Item é um Serviço. Busca de preço de referência não aplicável (varejo).") 
+        fonte_referencia = "N/A (Serviço)"
+    
+    else:
+        print(f"      Tipo de item não identificado ou não é Material/Serviço: '{item.get('tipo')}'")
+        fonte_referencia = "N/A (Tipo Desconhecido)"
+    
+    # --- FIM DA LÓGICA DE COMPARAÇÃO ---
+
+    alerta = False
+    diferenca_percentual = None
+
+    if preco_estimado_lic is not None and preco_referencia is not None and preco_estimado_lic > 0 and preco_referencia > 0:
+        diferenca_percentual = (preco_estimado_lic - preco_referencia) / preco_referencia
+
+        if diferenca_percentual > LIMITE_ALERTA_PERCENTUAL:
+            alerta = True
+            print(f"      🚨 ALERTA! Preço estimado (R$ {preco_estimado_lic:.2f}) é {diferenca_percentual:.1%} acima da referência de {fonte_referencia} (R$ {preco_referencia:.2f})")
+        else:
+            print(f"      Preço estimado (R$ {preco_estimado_lic:.2f}) está {diferenca_percentual:.1%} em relação à referência de {fonte_referencia} (R$ {preco_referencia:.2f})")
+    
+    elif preco_estimado_lic is not None and preco_estimado_lic > 0 and not preco_referencia:
+        print(f"      Preço estimado: R$ {preco_estimado_lic:.2f}. Não foi possível obter preço de referência (Fonte: {fonte_referencia}).")
+    
+    elif preco_referencia is not None:
+        print(f"      Preço de referência ({fonte_referencia}): R$ {preco_referencia:.2f}. Licitação não informou preço estimado unitário (>0).")
+    
+    elif not aviso_inconsistencia: 
+         print(f"      Não foi possível obter preço estimado da licitação (>0) nem preço de referência.")
+
+    return {
+        'licitacao_id': f"{lic['ano']}/{lic['sequencial']}",
+        'modalidade': lic.get('modalidade_nome', lic['modalidade_cod']),
+        'item_num': item['numero_item'],
+        'item_desc': item['descricao'],
+        'item_tipo': item.get('tipo'),
+        'item_quantidade_lic': quantidade_lic,
+        'preco_estimado_lic': preco_estimado_lic,
+        'preco_ref': float(preco_referencia) if preco_referencia is not None else None,
+        'fonte_ref': fonte_referencia,
+        'diferenca_perc': diferenca_percentual,
+        'alerta': alerta,
+        'aviso_inconsistencia': aviso_inconsistencia
+    }
+
+
+def salvar_csv(linhas, prefixo_arquivo):
+    df_resultados = pd.DataFrame(linhas)
+    
+    colunas_ordem = [
+        'licitacao_id', 'modalidade', 'item_num', 'item_desc', 'item_tipo', 
+        'item_quantidade_lic', 'preco_estimado_lic', 'preco_ref', 'fonte_ref', 
+        'diferenca_perc', 'alerta', 'aviso_inconsistencia'
+    ]
+    colunas_finais = [col for col in colunas_ordem if col in df_resultados.columns]
+    df_resultados = df_resultados[colunas_finais]
+
+    nome_arquivo = f"{prefixo_arquivo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    try:
+        df_resultados.to_csv(nome_arquivo, index=False, sep=';', decimal=',', encoding='utf-8-sig')
+        print(f"\nRelatório salvo em: {nome_arquivo}")
+    except Exception as e:
+        print(f"\nErro ao salvar relatório CSV: {e}")
+
+
 # --- FLUXO PRINCIPAL ATUALIZADO ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monitor de preços das licitações recentes.")
+    parser.add_argument('--metricas', metavar='ARQUIVO', help="Salva as métricas da execução em JSON")
+    parser.add_argument('--perfil', metavar='ARQUIVO', nargs='?', const='',
+                        help="Perfila a execução (cProfile) e salva o .pstats (padrão: pasta perfis/)")
+    parser.add_argument('--completo', action='store_true',
+                        help=f"Ignora o checkpoint e reanalisa todos os itens dos últimos {DIAS_PARA_BUSCAR} dias")
+    args = parser.parse_args()
+
+    if args.perfil is not None:
+        perfilamento.perfilar_execucao('monitor', args.perfil or None)
+
     print("--- INICIANDO MONITOR DE LICITAÇÕES ---")
 
-    licitacoes = buscar_licitacoes_recentes(CNPJ_AMARGOSA, DIAS_PARA_BUSCAR)
+    # O estado guarda o checkpoint e o resultado de cada item já analisado:
+    # execuções seguintes só buscam o que foi publicado/alterado desde então
+    # e só reanalisam itens cujo conteúdo mudou.
+    conexao_estado = estado_monitor.conectar()
+    inicio_execucao = datetime.now().strftime("%Y%m%d")
+    desde = None if args.completo else estado_monitor.obter_checkpoint(conexao_estado, CNPJ_AMARGOSA)
+    erros_busca = []
+
+    with metricas.medir_etapa('listagem'):
+        licitacoes = buscar_licitacoes_recentes(CNPJ_AMARGOSA, DIAS_PARA_BUSCAR, desde=desde, erros=erros_busca)
+
+    # Licitações com itens que ficaram sem preço de varejo em execuções
+    # anteriores (Buscapé falhou/bloqueou) voltam a ser processadas
+    ja_listadas = {(lic.get('ano'), lic.get('sequencial')) for lic in licitacoes}
+    for lic_pendente, tentativas in estado_monitor.licitacoes_pendentes(conexao_estado, CNPJ_AMARGOSA):
+        if tentativas >= MAXIMO_REVISITAS_PRECO_VAREJO:
+            print(f"Licitação {lic_pendente['ano']}/{lic_pendente['sequencial']}: preço de varejo ainda "
+                  f"indisponível após {tentativas} tentativas; deixando de revisitar.")
+            estado_monitor.remover_licitacao_pendente(conexao_estado, CNPJ_AMARGOSA, lic_pendente)
+        elif (lic_pendente['ano'], lic_pendente['sequencial']) not in ja_listadas:
+            licitacoes.append(lic_pendente)
 
     if not licitacoes:
-        print("\nNenhuma licitação encontrada ou erro na busca. Encerrando.")
-        exit()
+        print("\nNenhuma licitação nova ou alterada encontrada.")
 
     print("\n--- Processando Itens e Comparando Preços ---")
     resultados_finais = []
+    alertas_novos = []
+    itens_inalterados = 0
 
     for lic in licitacoes:
         if not lic.get('ano') or not lic.get('sequencial'):
@@ -356,105 +551,65 @@ if __name__ == "__main__":
 
         print(f"\nProcessando Licitação: {lic['ano']}/{lic['sequencial']} (Modalidade: {lic.get('modalidade_nome', lic['modalidade_cod'])}) - {lic['objeto'][:50]}...")
 
-        itens = buscar_itens_licitacao(CNPJ_AMARGOSA, lic['ano'], lic['sequencial'])
+        with metricas.medir_etapa('itens'):
+            itens = buscar_itens_licitacao(CNPJ_AMARGOSA, lic['ano'], lic['sequencial'], erros=erros_busca)
 
         if not itens:
             print("  Nenhum item encontrado para esta licitação.")
             continue
 
+        precos_pendentes = False
         for item in itens:
-            print(f"  Analisando Item {item['numero_item']}: '{item['descricao'][:60]}...' (Tipo: {item.get('tipo', 'Desconhecido')})")
-
-            # --- OBTÉM OS DADOS ESSENCIAIS ---
-            preco_estimado_lic = item.get('valor_unit_estimado')
-            quantidade_lic = item.get('quantidade') # Pega a quantidade
-
-            # --- Verificação de Inconsistência (Trava de Segurança) ---
-            aviso_inconsistencia, parar_comparacao = detectar_inconsistencia_quantidade(item['descricao'], quantidade_lic)
-            
-            if aviso_inconsistencia:
-                print(f"      ⚠️ AVISO: {aviso_inconsistencia}.")
-                if preco_estimado_lic:
-                     print(f"      O valor estimado (R$ {preco_estimado_lic:.2f}) pode ser referente ao Lote/Kit e não à unidade.")
-            # --- FIM DA VERIFICAÇÃO ---
-
-            preco_referencia = None
-            fonte_referencia = None
-
-            # --- LÓGICA DE COMPARAÇÃO ATUALIZADA ---
-            
-            # Se a heurística mandou parar, pulamos a busca de preço
-            if parar_comparacao:
-                print("      Comparação de preço de varejo PULADA devido à inconsistência de quantidade.")
-                fonte_referencia = "N/A (Inconsistência Qtd/Descrição)"
-            
-            elif item.get('tipo') == 'Material':
-                preco_referencia = buscar_preco_varejo(item['descricao']) 
-                fonte_referencia = "Varejo (Buscapé/IA)"
-            
-            # <<< CORREÇÃO AQUI: Mudado de 'Servico' para 'Serviço' (com acento)
-            elif item.get('tipo') == 'Serviço':
-                print("      Item é um Serviço. Busca de preço de referência não aplicável (varejo).") 
-                fonte_referencia = "N/A (Serviço)"
-            
-            else:
-                print(f"      Tipo de item não identificado ou não é Material/Serviço: '{item.get('tipo')}'")
-                fonte_referencia = "N/A (Tipo Desconhecido)"
-            
-            # --- FIM DA LÓGICA DE COMPARAÇÃO ---
-
-            alerta = False
-            diferenca_percentual = None
-
-            if preco_estimado_lic is not None and preco_referencia is not None and preco_estimado_lic > 0 and preco_referencia > 0:
-                diferenca_percentual = (preco_estimado_lic - preco_referencia) / preco_referencia
-
-                if diferenca_percentual > LIMITE_ALERTA_PERCENTUAL:
-                    alerta = True
-                    print(f"      🚨 ALERTA! Preço estimado (R$ {preco_estimado_lic:.2f}) é {diferenca_percentual:.1%} acima da referência de {fonte_referencia} (R$ {preco_referencia:.2f})")
-                else:
-                    print(f"      Preço estimado (R$ {preco_estimado_lic:.2f}) está {diferenca_percentual:.1%} em relação à referência de {fonte_referencia} (R$ {preco_referencia:.2f})")
-            
-            elif preco_estimado_lic is not None and preco_estimado_lic > 0 and not preco_referencia:
-                print(f"      Preço estimado: R$ {preco_estimado_lic:.2f}. Não foi possível obter preço de referência (Fonte: {fonte_referencia}).")
-            
-            elif preco_referencia is not None:
-                print(f"      Preço de referência ({fonte_referencia}): R$ {preco_referencia:.2f}. Licitação não informou preço estimado unitário (>0).")
-            
-            elif not aviso_inconsistencia: 
-                 print(f"      Não foi possível obter preço estimado da licitação (>0) nem preço de referência.")
-
-            resultados_finais.append({
-                'licitacao_id': f"{lic['ano']}/{lic['sequencial']}",
-                'modalidade': lic.get('modalidade_nome', lic['modalidade_cod']),
-                'item_num': item['numero_item'],
-                'item_desc': item['descricao'],
-                'item_tipo': item.get('tipo'),
-                'item_quantidade_lic': quantidade_lic,
-                'preco_estimado_lic': preco_estimado_lic,
-                'preco_ref': preco_referencia,
-                'fonte_ref': fonte_referencia,
-                'diferenca_perc': diferenca_percentual,
-                'alerta': alerta,
-                'aviso_inSISTENCIA': aviso_inconsistencia
-            })
+            # Mesma chave usada pelo site colaborativo
+            item_key = f"{CNPJ_AMARGOSA}-{lic['ano']}-{lic['sequencial']}-{item['numero_item']}"
+            impressao = estado_monitor.impressao_digital(item)
+            analise_anterior = estado_monitor.obter_analise(conexao_estado, item_key)
+
+            if not args.completo and analise_anterior and analise_anterior[0] == impressao:
+                itens_inalterados += 1
+                continue
+
+            resultado = analisar_item(lic, item)
+            # Buscapé indisponível: a comparação não aconteceu, o item não é dado
+            # como analisado e a próxima execução tenta de novo (sem ofertas, não)
+            if resultado['fonte_ref'] == FONTE_VAREJO_INDISPONIVEL:
+                impressao = estado_monitor.IMPRESSAO_PENDENTE
+                precos_pendentes = True
+            estado_monitor.salvar_analise(conexao_estado, item_key, impressao, resultado)
+            resultados_finais.append(resultado)
+
+            # Delta: só entra o alerta que não existia na análise anterior do item
+            if resultado['alerta'] and not (analise_anterior and analise_anterior[1]):
+                alertas_novos.append(resultado)
+
+        if precos_pendentes:
+            estado_monitor.marcar_licitacao_pendente(conexao_estado, CNPJ_AMARGOSA, lic)
+        else:
+            estado_monitor.remover_licitacao_pendente(conexao_estado, CNPJ_AMARGOSA, lic)
 
     print("\n--- Monitoramento Concluído ---")
+    print(f"Itens analisados: {len(resultados_finais)} | Inalterados (pulados): {itens_inalterados} | "
+          f"Alertas novos: {len(alertas_novos)}")
+
+    # O checkpoint só avança se nada falhou; senão a próxima execução repete o período
+    if erros_busca:
+        print(f"\n{len(erros_busca)} falha(s) na busca; checkpoint mantido em {desde or 'nenhum'}.")
+        for erro in erros_busca:
+            print(f"  FALHA: {erro}")
+    else:
+        estado_monitor.salvar_checkpoint(conexao_estado, CNPJ_AMARGOSA, inicio_execucao)
+    conexao_estado.close()
 
     if resultados_finais:
-        df_resultados = pd.DataFrame(resultados_finais)
-        
-        colunas_ordem = [
-            'licitacao_id', 'modalidade', 'item_num', 'item_desc', 'item_tipo', 
-            'item_quantidade_lic', 'preco_estimado_lic', 'preco_ref', 'fonte_ref', 
-            'diferenca_perc', 'alerta', 'aviso_inconsistencia'
-        ]
-        colunas_finais = [col for col in colunas_ordem if col in df_resultados.columns]
-        df_resultados = df_resultados[colunas_finais]
-
-        nome_arquivo = f"relatorio_monitoramento_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        try:
-            df_resultados.to_csv(nome_arquivo, index=False, sep=';', decimal=',', encoding='utf-8-sig')
-            print(f"\nRelatório salvo em: {nome_arquivo}")
-        except Exception as e:
-            print(f"\nErro ao salvar relatório CSV: {e}")
\ No newline at end of file
+        salvar_csv(resultados_finais, "relatorio_monitoramento")
+
+    if alertas_novos:
+        print("\n--- ALERTAS NOVOS ---")
+        for alerta in alertas_novos:
+            print(f"  🚨 {alerta['licitacao_id']} item {alerta['item_num']}: {alerta['item_desc'][:60]} "
+                  f"({alerta['diferenca_perc']:.1%} acima da referência)")
+        salvar_csv(alertas_novos, "alertas_novos")
+
+    if args.metricas:
+        metricas.salvar_json(args.metricas)
+        print(f"Métricas salvas em: {args.metricas}")
@@ -0,0 +1,140 @@
+"""
+Perfilamento sob demanda (cProfile) de execuções da linha de comando e de
+requisições da API, salvo em arquivos .pstats.
+
+Os arquivos abrem com pstats, snakeviz ou flameprof/gprof2dot (flamegraph):
+    python -m pstats perfis/buscador_20251021_101500.pstats
+    snakeviz perfis/buscador_20251021_101500.pstats
+
+As buscas no PNCP rodam em ThreadPools, e o cProfile só enxerga a thread
+que o ligou. Por isso as tarefas enviadas a outras threads passam por
+propagar(): se quem envia está sendo perfilado, a tarefa liga (e desliga,
+na própria thread) um perfil só dela, somado ao do perfilador no final.
+Threads de outras requisições nunca entram no perfil. Desligado, não há
+custo algum: propagar() devolve a própria função.
+"""
+import atexit
+import cProfile
+import functools
+import os
+import pstats
+import threading
+from datetime import datetime
+
+# --- CONFIGURAÇÕES ---
+basedir = os.path.abspath(os.path.dirname(__file__))
+PASTA_PERFIS = os.environ.get('PASTA_PERFIS', os.path.join(basedir, 'perfis'))
+LINHAS_RESUMO = 15 # Funções mostradas no resumo impresso ao salvar
+ORDENACAO_RESUMO = 'cumulative'
+
+# Um perfilamento por vez no processo: a partir do Python 3.12 o cProfile
+# não permite dois perfis ligados ao mesmo tempo, mesmo em threads diferentes
+_perfilamento_ativo = threading.Lock()
+# Perfilador da thread atual (a que chamou iniciar() ou uma tarefa propagada)
+_contexto = threading.local()
+
+
+def perfilador_atual():
+    return getattr(_contexto, 'perfilador', None)
+
+
+def propagar(funcao):
+    """
+    Envolve uma tarefa que vai rodar em outra thread (ThreadPool, Thread)
+    para que ela entre no perfil da thread que a enviou, se houver um.
+    """
+    perfilador = perfilador_atual()
+    if perfilador is None:
+        return funcao
+
+    @functools.wraps(funcao)
+    def executar_perfilada(*args, **kwargs):
+        return perfilador._executar_tarefa(funcao, args, kwargs)
+    return executar_perfilada
+
+
+class Perfilador:
+    """Perfil da thread que chamou iniciar() e das tarefas que ela enviou (ver propagar)."""
+
+    def __init__(self):
+        self._perfil_principal = cProfile.Profile()
+        self._estatisticas_tarefas = []
+        self._trava = threading.Lock()
+        self.ativo = False
+
+    def _executar_tarefa(self, funcao, args, kwargs):
+        anterior = perfilador_atual()
+        _contexto.perfilador = self # Tarefas enviadas por esta também são propagadas
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+            ligado = True
+        except ValueError:
+            ligado = False # Outro perfil ligado (Python 3.12+): a tarefa roda sem perfil
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            _contexto.perfilador = anterior
+            if ligado:
+                # Desligado e consolidado na própria thread, sem disputar com parar()
+                perfil.disable()
+                try:
+                    estatisticas = pstats.Stats(perfil)
+                except TypeError: # Perfil vazio
+                    estatisticas = None
+                with self._trava:
+                    if self.ativo and estatisticas is not None:
+                        self._estatisticas_tarefas.append(estatisticas)
+
+    def iniciar(self):
+        """Liga o perfilamento. Retorna False se outro já estiver em andamento."""
+        if not _perfilamento_ativo.acquire(blocking=False):
+            return False
+        self.ativo = True
+        _contexto.perfilador = self
+        self._perfil_principal.enable()
+        return True
+
+    def parar(self):
+        """
+        Desliga e devolve as estatísticas somadas (pstats.Stats). Tarefas
+        ainda em andamento ficam de fora.
+        """
+        self._perfil_principal.disable()
+        if perfilador_atual() is self:
+            _contexto.perfilador = None
+        with self._trava:
+            self.ativo = False
+            estatisticas_tarefas = list(self._estatisticas_tarefas)
+        _perfilamento_ativo.release()
+
+        estatisticas = pstats.Stats(self._perfil_principal)
+        if estatisticas_tarefas:
+            estatisticas.add(*estatisticas_tarefas)
+        return estatisticas
+
+    def salvar(self, caminho, mostrar_resumo=True):
+        """Para, grava o .pstats em 'caminho' e (opcionalmente) imprime as funções mais caras."""
+        estatisticas = self.parar()
+        os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        estatisticas.dump_stats(caminho)
+        print(f"\n--- Perfil salvo em '{caminho}' ({len(self._estatisticas_tarefas)} tarefa(s) em outras threads) ---")
+        if mostrar_resumo:
+            estatisticas.sort_stats(ORDENACAO_RESUMO).print_stats(LINHAS_RESUMO)
+        return caminho
+
+
+def caminho_perfil(nome):
+    """perfis/<nome>_<AAAAMMDD_HHMMSS_ffffff>.pstats"""
+    return os.path.join(PASTA_PERFIS, f"{nome}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.pstats")
+
+
+def perfilar_execucao(nome, caminho=None):
+    """
+    Para as linhas de comando (--perfil): perfila o resto da execução e
+    salva o arquivo ao sair do processo, mesmo em saídas antecipadas.
+    """
+    perfilador = Perfilador()
+    perfilador.iniciar()
+    atexit.register(perfilador.salvar, caminho or caminho_perfil(nome))
+    return perfilador
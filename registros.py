@@ -0,0 +1,124 @@
+"""
+Registros compactos para os dados do PNCP em memória.
+
+Em relatórios grandes (ano inteiro, vários órgãos) os itens são centenas de
+milhares; um dicionário por item, com cópias dos textos da licitação, era o
+que mais ocupava memória no worker do Flask. Aqui cada item é uma dataclass
+com __slots__ (sem __dict__ por instância) e guarda só uma REFERÊNCIA para
+a licitação, que existe uma única vez.
+"""
+import csv
+from dataclasses import dataclass, fields
+
+
+@dataclass(slots=True)
+class Licitacao:
+    cnpj: str
+    ano: int
+    sequencial: int
+    id_pncp: str = None
+    licitacao_objeto: str = None
+    licitacao_modalidade: str = None
+    licitacao_data_publicacao: str = None
+
+    @classmethod
+    def do_pncp(cls, licitacao, cnpj):
+        """Cria o registro a partir de uma licitação de buscar_licitacoes_recentes."""
+        return cls(
+            cnpj=cnpj,
+            ano=licitacao.get('ano'),
+            sequencial=licitacao.get('sequencial'),
+            id_pncp=licitacao.get('id_pncp'),
+            licitacao_objeto=licitacao.get('objeto'),
+            licitacao_modalidade=licitacao.get('modalidade_nome'),
+            licitacao_data_publicacao=licitacao.get('data_publicacao')
+        )
+
+    @property
+    def licitacao_id(self):
+        return f"{self.ano}/{self.sequencial}"
+
+    def para_dict(self):
+        return {campo: getattr(self, campo) for campo in CAMPOS_LICITACAO}
+
+
+@dataclass(slots=True)
+class Item:
+    licitacao: Licitacao
+    numero_item: int
+    tipo: str
+    descricao: str
+    quantidade: float
+    valor_unit_estimado: float
+    valor_total_estimado: float
+
+    @classmethod
+    def do_pncp(cls, item, licitacao):
+        """Cria o registro a partir de um item da API de integração do PNCP."""
+        return cls(
+            licitacao=licitacao,
+            numero_item=item.get('numeroItem'),
+            tipo=item.get('materialOuServicoNome'),
+            descricao=(item.get('descricao') or '').strip(),
+            quantidade=item.get('quantidade'),
+            valor_unit_estimado=item.get('valorUnitarioEstimado'),
+            valor_total_estimado=item.get('valorTotalEstimado')
+        )
+
+    @property
+    def licitacao_id(self):
+        return self.licitacao.licitacao_id
+
+    @property
+    def item_key(self):
+        """Mesma chave usada pelo site colaborativo (Contribution.item_key)."""
+        lic = self.licitacao
+        return f"{lic.cnpj}-{lic.ano}-{lic.sequencial}-{self.numero_item}"
+
+    def valor(self, campo):
+        """Lê um campo do item ou, se for da licitação, do registro dela."""
+        if campo in CAMPOS_ITEM:
+            return getattr(self, campo)
+        return getattr(self.licitacao, campo)
+
+    def para_dict(self, completo=False):
+        """
+        completo=False: campos do item mais 'licitacao_id' (formato normalizado).
+        completo=True: com os campos da licitação copiados (formato "bruto").
+        """
+        dados = {campo: getattr(self, campo) for campo in CAMPOS_ITEM}
+        dados['licitacao_id'] = self.licitacao_id
+        if completo:
+            dados.update(self.licitacao.para_dict())
+        return dados
+
+
+CAMPOS_LICITACAO = tuple(campo.name for campo in fields(Licitacao))
+CAMPOS_ITEM = tuple(campo.name for campo in fields(Item) if campo.name != 'licitacao')
+
+# Colunas do relatório bruto em CSV, na ordem em que são gravadas
+COLUNAS_CSV = (
+    'licitacao_id', 'licitacao_data_publicacao', 'licitacao_modalidade',
+    'numero_item', 'descricao', 'quantidade', 'valor_unit_estimado',
+    'valor_total_estimado', 'tipo', 'licitacao_objeto', 'id_pncp'
+)
+
+
+def _valor_csv(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float):
+        return str(valor).replace('.', ',') # Decimal com vírgula, como o Excel em pt-BR espera
+    return valor
+
+
+def escrever_csv(itens, caminho, colunas=COLUNAS_CSV):
+    """Grava os itens (registros Item) direto no CSV, sem montar um DataFrame. Retorna o total."""
+    total = 0
+    with open(caminho, 'w', newline='', encoding='utf-8-sig') as f:
+        escritor = csv.writer(f, delimiter=';')
+        escritor.writerow(colunas)
+        for item in itens:
+            escritor.writerow([_valor_csv(item.valor(coluna)) for coluna in colunas])
+            total += 1
+    return total
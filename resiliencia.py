@@ -0,0 +1,214 @@
+"""
+Camada de resiliência para as chamadas HTTP ao PNCP: retentativas com
+backoff exponencial e jitter, respeito ao cabeçalho Retry-After, um
+disjuntor (circuit breaker) que para de chamar a API quando ela está fora
+e um limitador de taxa (token bucket) compartilhado entre as threads.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import metricas
+
+# --- CONFIGURAÇÕES ---
+MAXIMO_TENTATIVAS = 4
+ESPERA_BASE_SEG = 0.5
+ESPERA_MAXIMA_SEG = 30
+# Códigos que indicam falha passageira (vale a pena tentar de novo)
+STATUS_RETENTAVEIS = {429, 500, 502, 503, 504}
+# Falhas de rede passageiras: conexão, timeout e resposta cortada ou corrompida no caminho
+EXCECOES_RETENTAVEIS = (
+    requests.Timeout, requests.ConnectionError,
+    requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError
+)
+
+# Disjuntor: abre após N falhas seguidas e fica aberto por T segundos
+LIMITE_FALHAS_DISJUNTOR = 8
+TEMPO_ABERTURA_DISJUNTOR_SEG = 60
+
+
+class ErroPNCP(Exception):
+    """Falha definitiva numa chamada ao PNCP (após esgotar as retentativas)."""
+
+    def __init__(self, mensagem, status=None):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class CircuitoAberto(ErroPNCP):
+    """O disjuntor está aberto: a chamada nem foi feita."""
+
+
+class LimitadorTaxa:
+    """
+    Token bucket: libera no máximo 'taxa_por_seg' chamadas por segundo, com
+    rajadas de até 'capacidade'. Compartilhado por todas as threads do processo.
+    """
+
+    def __init__(self, nome, taxa_por_seg, capacidade=None):
+        self.nome = nome
+        self.taxa_por_seg = taxa_por_seg
+        self.capacidade = capacidade or max(1, taxa_por_seg)
+        self._lock = threading.Lock()
+        self._fichas = self.capacidade
+        self._ultima_reposicao = time.monotonic()
+
+    def aguardar(self):
+        """Bloqueia até haver uma ficha disponível e a consome."""
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._fichas = min(
+                    self.capacidade, self._fichas + (agora - self._ultima_reposicao) * self.taxa_por_seg
+                )
+                self._ultima_reposicao = agora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) / self.taxa_por_seg
+            metricas.incrementar('limitador_esperas_total', servico=self.nome)
+            time.sleep(espera)
+
+
+class DisjuntorCircuito:
+    """
+    Disjuntor simples com três estados:
+      fechado     -> chamadas liberadas; falhas seguidas são contadas
+      aberto      -> chamadas bloqueadas até passar o tempo de abertura
+      meio_aberto -> libera uma única chamada de teste; sucesso fecha, falha reabre
+    """
+
+    def __init__(self, nome, limite_falhas=LIMITE_FALHAS_DISJUNTOR,
+                 tempo_abertura_seg=TEMPO_ABERTURA_DISJUNTOR_SEG):
+        self.nome = nome
+        self.limite_falhas = limite_falhas
+        self.tempo_abertura_seg = tempo_abertura_seg
+        self._lock = threading.Lock()
+        self._falhas_seguidas = 0
+        self._aberto_ate = None
+        self._teste_em_andamento = False
+
+    @property
+    def estado(self):
+        with self._lock:
+            return self._estado()
+
+    def _estado(self):
+        if self._aberto_ate is None:
+            return 'fechado'
+        if time.monotonic() < self._aberto_ate:
+            return 'aberto'
+        return 'meio_aberto'
+
+    def permitir(self):
+        with self._lock:
+            estado = self._estado()
+            if estado == 'fechado':
+                return True
+            if estado == 'meio_aberto' and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self._falhas_seguidas = 0
+            self._aberto_ate = None
+            self._teste_em_andamento = False
+        metricas.definir('disjuntor_aberto', 0, servico=self.nome)
+
+    def liberar_teste(self):
+        """Libera a chamada de teste sem contar sucesso nem falha (ex.: erro na montagem da requisição)."""
+        with self._lock:
+            self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self._falhas_seguidas += 1
+            abriu = self._teste_em_andamento or self._falhas_seguidas >= self.limite_falhas
+            if abriu:
+                self._aberto_ate = time.monotonic() + self.tempo_abertura_seg
+                self._teste_em_andamento = False
+        if abriu:
+            print(f"  Disjuntor '{self.nome}' ABERTO por {self.tempo_abertura_seg}s após falhas seguidas.")
+            metricas.definir('disjuntor_aberto', 1, servico=self.nome)
+
+
+def ler_retry_after(valor):
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos de espera."""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        data = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    return max(0.0, (data - datetime.now(timezone.utc)).total_seconds())
+
+
+def calcular_espera(tentativa, retry_after=None):
+    """Backoff exponencial com 'full jitter'; Retry-After do servidor tem prioridade."""
+    if retry_after is not None:
+        return min(retry_after, ESPERA_MAXIMA_SEG)
+    return random.uniform(0, min(ESPERA_MAXIMA_SEG, ESPERA_BASE_SEG * 2 ** tentativa))
+
+
+def requisitar(servico, url, disjuntor, params=None, headers=None, timeout=20, tentativas=None,
+               limitador=None):
+    """
+    GET com retentativas para falhas passageiras (timeout, conexão, 429 e 5xx).
+    Retorna a resposta para qualquer outro status (200, 204, 404...).
+    Cada tentativa (inclusive as repetidas) consome uma ficha do limitador.
+    Lança CircuitoAberto se o disjuntor estiver aberto e ErroPNCP se as
+    tentativas se esgotarem.
+    """
+    tentativas = tentativas or MAXIMO_TENTATIVAS
+    ultimo_erro, ultimo_status = None, None
+
+    for tentativa in range(tentativas):
+        if not disjuntor.permitir():
+            raise CircuitoAberto(f"Disjuntor '{disjuntor.nome}' aberto: PNCP indisponível no momento.")
+        if limitador is not None:
+            limitador.aguardar()
+
+        retry_after = None
+        inicio = time.perf_counter()
+        try:
+            response = requests.get(url, headers=headers, params=params, timeout=timeout)
+        except EXCECOES_RETENTAVEIS as e:
+            metricas.incrementar('requisicoes_externas_total', servico=servico, status='erro')
+            disjuntor.registrar_falha()
+            ultimo_erro, ultimo_status = f"Erro de conexão/timeout: {e}", None
+        except requests.RequestException as e:
+            # Erro de montagem da requisição: não adianta repetir. Não é culpa do
+            # PNCP, mas a chamada de teste do disjuntor precisa ser liberada.
+            metricas.incrementar('requisicoes_externas_total', servico=servico, status='erro')
+            disjuntor.liberar_teste()
+            raise ErroPNCP(f"Erro na requisição: {e}")
+        else:
+            metricas.registrar_requisicao_externa(
+                servico, response.status_code, time.perf_counter() - inicio, len(response.content)
+            )
+            if response.status_code not in STATUS_RETENTAVEIS:
+                disjuntor.registrar_sucesso()
+                return response
+            disjuntor.registrar_falha()
+            retry_after = ler_retry_after(response.headers.get('Retry-After'))
+            ultimo_erro, ultimo_status = f"Status {response.status_code}", response.status_code
+
+        if tentativa < tentativas - 1:
+            espera = calcular_espera(tentativa, retry_after)
+            print(f"  {servico}: {ultimo_erro}. Nova tentativa em {espera:.1f}s ({tentativa + 2}/{tentativas})...")
+            metricas.incrementar('retentativas_total', servico=servico)
+            time.sleep(espera)
+
+    raise ErroPNCP(f"{ultimo_erro} (após {tentativas} tentativas)", status=ultimo_status)
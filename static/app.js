@@ -22,6 +22,33 @@ document.addEventListener("DOMContentLoaded", () => {
     // --- NOVO: Verifica se o usuário está logado (do 'base.html') ---
     const isUserAuthenticated = document.body.dataset.isAuthenticated === 'true';
 
+    // --- Controles da tabela (ordenação e filtros feitos no servidor) ---
+    const controlesTabela = document.getElementById("controles-tabela");
+    const controleOrdenar = document.getElementById("controle-ordenar");
+    const controleDirecao = document.getElementById("controle-direcao");
+    const controleModalidade = document.getElementById("controle-modalidade");
+    const controleVotos = document.getElementById("controle-votos");
+    const controleLote = document.getElementById("controle-lote");
+    const contadorItens = document.getElementById("contador-itens");
+
+    // --- Tabela virtualizada ---
+    // Só as linhas visíveis (mais uma margem) existem no DOM. As páginas da API
+    // são buscadas sob demanda, conforme o usuário rola a tabela.
+    const ALTURA_LINHA_PX = 150; // Deve bater com .linha-item td no CSS
+    const LINHAS_EXTRAS = 10; // Linhas renderizadas acima/abaixo da área visível
+    const ITENS_POR_PAGINA = 100;
+
+    const estado = {
+        consulta: null, // Parâmetros da busca atual (cnpj, datas, filtros)
+        total: 0,
+        paginas: new Map(), // número da página -> lista de itens
+        paginasPendentes: new Set(),
+        geracao: 0 // Incrementa a cada nova busca para descartar respostas antigas
+    };
+    let areaRolagem = null;
+    let corpoTabela = null;
+    let renderizacaoAgendada = false;
+
     // Adiciona um "escutador" para o evento de "submit" (clique no botão) do formulário
     form.addEventListener("submit", async (event) => {
         // Previne o recarregamento da página
@@ -29,10 +56,19 @@ document.addEventListener("DOMContentLoaded", () => {
         await buscarResultados(); // Chama a função de busca
     });
 
+    // Mudou ordenação ou filtro: refaz a consulta (o servidor usa o cache)
+    for (const controle of [controleOrdenar, controleDirecao, controleModalidade, controleVotos, controleLote]) {
+        controle.addEventListener("change", () => {
+            if (estado.consulta) {
+                buscarResultados({ manterModalidades: true });
+            }
+        });
+    }
+
     /**
-     * Função principal que busca e exibe os resultados
+     * Função principal que busca a primeira página e monta a tabela
      */
-    async function buscarResultados() {
+    async function buscarResultados({ manterModalidades = false } = {}) {
         // 1. Prepara a busca
         resultadosContainer.innerHTML = ""; // Limpa resultados antigos
         statusMessageDiv.innerHTML = ""; // Limpa mensagens antigas
@@ -42,120 +78,260 @@ document.addEventListener("DOMContentLoaded", () => {
 
         // 2. Pega os dados do formulário
         const formData = new FormData(form);
-        const cnpj = formData.get("cnpj");
-        const dataInicio = formData.get("data_inicio").split("-").join("");
-        const dataFim = formData.get("data_fim").split("-").join("");
-
-        // 3. Monta a URL da API
-        const apiUrl = `/api/gerar-relatorio?cnpj=${cnpj}&inicio=${dataInicio}&fim=${dataFim}`;
+        if (!manterModalidades) {
+            controleModalidade.value = "";
+        }
+        estado.consulta = {
+            cnpj: formData.get("cnpj"),
+            inicio: formData.get("data_inicio").split("-").join(""),
+            fim: formData.get("data_fim").split("-").join(""),
+            ordenar: controleOrdenar.value,
+            direcao: controleDirecao.value,
+            modalidade: controleModalidade.value,
+            com_votos: controleVotos.value,
+            lote: controleLote.value
+        };
+        estado.total = 0;
+        estado.paginas.clear();
+        estado.paginasPendentes.clear();
+        estado.geracao += 1;
 
-        // 4. Chama a API (fetch)
+        // 3. Chama a API (apenas a primeira página)
         try {
-            const response = await fetch(apiUrl);
-            if (!response.ok) {
-                const errorData = await response.json();
-                throw new Error(errorData.erro || `Erro ${response.status} ao buscar dados.`);
+            const dados = await buscarPagina(1);
+            if (dados === null) {
+                return; // Uma busca mais nova já substituiu esta
             }
-            const itens = await response.json();
 
-            // 5. Processa os resultados
-            if (itens.length === 0) {
+            // 4. Processa os resultados
+            if (!manterModalidades) {
+                preencherModalidades(dados.modalidades);
+            }
+            controlesTabela.classList.remove("hidden");
+            contadorItens.textContent = `${dados.total} de ${dados.total_geral} itens`;
+
+            if (!dados.completo) {
+                // O PNCP falhou em parte da busca: o relatório está incompleto
+                mostrarMensagem(
+                    `Atenção: ${dados.erros.length} parte(s) do relatório não puderam ser obtidas do PNCP. ` +
+                    "Busque novamente para tentar completar.", "status-error");
+            } else if (dados.total === 0) {
                 mostrarMensagem("Nenhum item encontrado para este período.", "status-success");
-            } else {
-                exibirResultados(itens);
+            } else if (dados.desatualizado) {
+                // Dados antigos servidos do cache; o servidor já está atualizando
+                const horas = Math.floor(dados.idade_segundos / 3600);
+                mostrarMensagem(
+                    `Dados do PNCP de ${horas} hora(s) atrás. Uma atualização está em andamento; ` +
+                    "busque novamente em alguns minutos para ver os dados novos.", "status-success");
+            }
+            if (dados.total > 0) {
+                montarTabela();
             }
         } catch (error) {
             console.error("Erro no fetch:", error);
             mostrarMensagem(`Erro: ${error.message}`, "status-error");
         } finally {
-            // 6. Finaliza a busca
+            // 5. Finaliza a busca
             loadingDiv.classList.add("hidden"); // Esconde "Buscando..."
             buscarButton.disabled = false; // Reabilita o botão
         }
     }
 
+    /**
+     * Busca uma página da API e guarda no estado.
+     * Retorna null se a resposta pertence a uma busca já descartada.
+     */
+    async function buscarPagina(numeroPagina) {
+        const geracao = estado.geracao;
+        const params = new URLSearchParams({
+            pagina: numeroPagina,
+            por_pagina: ITENS_POR_PAGINA,
+            formato: "compacto" // Licitações enviadas uma vez, referenciadas pelos itens
+        });
+        for (const [chave, valor] of Object.entries(estado.consulta)) {
+            if (valor) {
+                params.set(chave, valor);
+            }
+        }
+
+        estado.paginasPendentes.add(numeroPagina);
+        try {
+            const response = await fetch(`/api/gerar-relatorio?${params.toString()}`);
+            if (!response.ok) {
+                const errorData = await response.json();
+                throw new Error(errorData.erro || `Erro ${response.status} ao buscar dados.`);
+            }
+            const dados = await response.json();
+            if (geracao !== estado.geracao) {
+                return null;
+            }
+            estado.total = dados.total;
+            // Junta em cada item os dados da licitação a que ele pertence
+            const itens = dados.itens.map(item => ({ ...dados.licitacoes[item.licitacao_id], ...item }));
+            estado.paginas.set(numeroPagina, itens);
+            return dados;
+        } finally {
+            if (geracao === estado.geracao) {
+                estado.paginasPendentes.delete(numeroPagina);
+            }
+        }
+    }
+
+    function preencherModalidades(modalidades) {
+        controleModalidade.innerHTML = '<option value="">Todas</option>';
+        for (const modalidade of modalidades) {
+            const option = document.createElement("option");
+            option.value = modalidade;
+            option.textContent = modalidade;
+            controleModalidade.appendChild(option);
+        }
+    }
 
     /**
-     * Exibe a tabela de resultados no HTML
-     * @param {Array} itens - A lista de itens vinda da API
+     * Cria a estrutura fixa da tabela. As linhas são desenhadas por renderizarJanela().
      */
-    function exibirResultados(itens) {
-        let html = `
-            <table>
-                <thead>
-                    <tr>
-                        <th>Descrição do Item</th>
-                        <th>Qtd.</th>
-                        <th>Valor Unitário</th>
-                        <th>Modalidade</th>
-                        <th>Link (Edital)</th>
-                    </tr>
-                </thead>
-                <tbody>
+    function montarTabela() {
+        resultadosContainer.innerHTML = `
+            <div class="tabela-virtual">
+                <table>
+                    <thead>
+                        <tr>
+                            <th>Descrição do Item</th>
+                            <th>Qtd.</th>
+                            <th>Valor Unitário</th>
+                            <th>Modalidade</th>
+                            <th>Link (Edital)</th>
+                        </tr>
+                    </thead>
+                    <tbody></tbody>
+                </table>
+            </div>
         `;
+        areaRolagem = resultadosContainer.querySelector(".tabela-virtual");
+        corpoTabela = areaRolagem.querySelector("tbody");
+        areaRolagem.addEventListener("scroll", agendarRenderizacao);
+        renderizarJanela();
+    }
 
-        const keywords = ["TERMO DE REFERÊNCIA", "ANEXO", "EDITAL", "LOTE"];
-
-        for (const item of itens) {
-            const pncpLink = `https://pncp.gov.br/app/editais/${item.cnpj}/${item.ano}/${item.sequencial}`;
-            let descricao = item.descricao || 'N/D';
-            let linhaClass = ""; 
-            const valorUnit = item.valor_unit_estimado || 0;
-            let isLote = keywords.some(key => descricao.toUpperCase().includes(key));
+    function agendarRenderizacao() {
+        if (!renderizacaoAgendada) {
+            renderizacaoAgendada = true;
+            requestAnimationFrame(() => {
+                renderizacaoAgendada = false;
+                renderizarJanela();
+            });
+        }
+    }
 
-            if (isLote || (valorUnit === 0 && item.quantidade === 1)) {
-                linhaClass = "linha-aviso"; 
-                descricao = `⚠️ <strong>${descricao}</strong><br><small>(Itens provavelmente detalhados no Termo de Referência. Clique no link ao lado para ver os anexos no PNCP.)</small>`;
-                // (Aqui no futuro entrará a Feature B: "Detalhar Lote")
+    /**
+     * Desenha apenas as linhas da área visível. Espaçadores no topo e no fim
+     * mantêm a altura total da tabela, para a barra de rolagem ficar correta.
+     */
+    function renderizarJanela() {
+        if (!corpoTabela) {
+            return;
+        }
+        const primeira = Math.max(0, Math.floor(areaRolagem.scrollTop / ALTURA_LINHA_PX) - LINHAS_EXTRAS);
+        const ultima = Math.min(
+            estado.total,
+            Math.ceil((areaRolagem.scrollTop + areaRolagem.clientHeight) / ALTURA_LINHA_PX) + LINHAS_EXTRAS
+        );
+
+        let html = `<tr class="espacador" style="height: ${primeira * ALTURA_LINHA_PX}px"></tr>`;
+        const paginasFaltando = new Set();
+        for (let indice = primeira; indice < ultima; indice++) {
+            const numeroPagina = Math.floor(indice / ITENS_POR_PAGINA) + 1;
+            const itensPagina = estado.paginas.get(numeroPagina);
+            if (itensPagina) {
+                html += renderizarLinha(itensPagina[indice % ITENS_POR_PAGINA], indice);
+            } else {
+                paginasFaltando.add(numeroPagina);
+                html += `<tr class="linha-item linha-carregando"><td colspan="5">Carregando...</td></tr>`;
             }
+        }
+        html += `<tr class="espacador" style="height: ${(estado.total - ultima) * ALTURA_LINHA_PX}px"></tr>`;
+        corpoTabela.innerHTML = html;
 
-            // --- NOVO: Renderiza a seção de votação ---
-            const contribuicoes = item.contribuicoes || [];
-            
-            // Conta os votos
-            const votosSobrepreco = contribuicoes.filter(c => c.status === 'SOBREPRECO').length;
-            const votosPrecoOk = contribuicoes.filter(c => c.status === 'PRECO_OK').length;
-            const votosAbaixoPreco = contribuicoes.filter(c => c.status === 'ABAIXO_PRECO').length;
-
-            let voteSectionHTML = `
-                <div class="vote-section">
-                    <div class="vote-counts">
-                        <span>📈 ${votosSobrepreco}</span>
-                        <span>✅ ${votosPrecoOk}</span>
-                        <span>📉 ${votosAbaixoPreco}</span>
-                    </div>
-            `;
+        for (const numeroPagina of paginasFaltando) {
+            carregarPagina(numeroPagina);
+        }
+    }
 
-            if (isUserAuthenticated) {
-                voteSectionHTML += `
-                    <div class="vote-buttons">
-                        <button class="btn-vote" data-item-key="${item.item_key}" data-vote-status="SOBREPRECO" data-item-desc="${item.descricao.substring(0, 50)}...">📈 Acima</button>
-                        <button class="btn-vote" data-item-key="${item.item_key}" data-vote-status="PRECO_OK" data-item-desc="${item.descricao.substring(0, 50)}...">✅ Na Média</button>
-                        <button class="btn-vote" data-item-key="${item.item_key}" data-vote-status="ABAIXO_PRECO" data-item-desc="${item.descricao.substring(0, 50)}...">📉 Abaixo</button>
-                    </div>
-                `;
+    async function carregarPagina(numeroPagina) {
+        if (estado.paginasPendentes.has(numeroPagina)) {
+            return;
+        }
+        try {
+            const dados = await buscarPagina(numeroPagina);
+            if (dados !== null) {
+                renderizarJanela();
             }
-            voteSectionHTML += '</div>';
-            // --- FIM DA SEÇÃO DE VOTAÇÃO ---
-
-
-            html += `
-                <tr class="${linhaClass}">
-                    <td>
-                        ${descricao}
-                        ${voteSectionHTML} </td>
-                    <td>${item.quantidade || 'N/D'}</td>
-                    <td>${formatarMoeda(item.valor_unit_estimado)}</td>
-                    <td>${item.licitacao_modalidade || 'N/D'}</td>
-                    <td>
-                        <a href="${pncpLink}" target="_blank" class="link-pncp">Ver Edital</a>
-                    </td>
-                </tr>
-            `;
+        } catch (error) {
+            console.error("Erro ao carregar página:", error);
+            mostrarMensagem(`Erro: ${error.message}`, "status-error");
+        }
+    }
+
+    /**
+     * Monta o HTML de uma linha da tabela
+     * @param {Object} item - Um item vindo da API
+     * @param {number} indice - Posição do item no resultado
+     */
+    function renderizarLinha(item, indice) {
+        const pncpLink = `https://pncp.gov.br/app/editais/${item.cnpj}/${item.ano}/${item.sequencial}`;
+        let descricao = escaparHtml(item.descricao || 'N/D');
+        let linhaClass = indice % 2 === 1 ? "linha-item linha-par" : "linha-item";
+
+        if (item.lote_suspeito) {
+            linhaClass += " linha-aviso";
+            descricao = `⚠️ <strong>${descricao}</strong><br><small>(Itens provavelmente detalhados no Termo de Referência. Clique no link ao lado para ver os anexos no PNCP.)</small>`;
+            // (Aqui no futuro entrará a Feature B: "Detalhar Lote")
         }
 
-        html += `</tbody></table>`;
-        resultadosContainer.innerHTML = html;
+        // --- Renderiza a seção de votação ---
+        const contribuicoes = item.contribuicoes || [];
+        
+        // Conta os votos
+        const votosSobrepreco = contribuicoes.filter(c => c.status === 'SOBREPRECO').length;
+        const votosPrecoOk = contribuicoes.filter(c => c.status === 'PRECO_OK').length;
+        const votosAbaixoPreco = contribuicoes.filter(c => c.status === 'ABAIXO_PRECO').length;
+
+        let voteSectionHTML = `
+            <div class="vote-section">
+                <div class="vote-counts">
+                    <span>📈 ${votosSobrepreco}</span>
+                    <span>✅ ${votosPrecoOk}</span>
+                    <span>📉 ${votosAbaixoPreco}</span>
+                </div>
+        `;
+
+        if (isUserAuthenticated) {
+            const descCurta = escaparHtml((item.descricao || '').substring(0, 50));
+            voteSectionHTML += `
+                <div class="vote-buttons">
+                    <button class="btn-vote" data-item-key="${item.item_key}" data-vote-status="SOBREPRECO" data-item-desc="${descCurta}...">📈 Acima</button>
+                    <button class="btn-vote" data-item-key="${item.item_key}" data-vote-status="PRECO_OK" data-item-desc="${descCurta}...">✅ Na Média</button>
+                    <button class="btn-vote" data-item-key="${item.item_key}" data-vote-status="ABAIXO_PRECO" data-item-desc="${descCurta}...">📉 Abaixo</button>
+                </div>
+            `;
+        }
+        voteSectionHTML += '</div>';
+        // --- FIM DA SEÇÃO DE VOTAÇÃO ---
+
+        return `
+            <tr class="${linhaClass}">
+                <td>
+                    <div class="celula-descricao">${descricao}</div>
+                    ${voteSectionHTML}
+                </td>
+                <td>${item.quantidade || 'N/D'}</td>
+                <td>${formatarMoeda(item.valor_unit_estimado)}</td>
+                <td>${escaparHtml(item.licitacao_modalidade || 'N/D')}</td>
+                <td>
+                    <a href="${pncpLink}" target="_blank" class="link-pncp">Ver Edital</a>
+                </td>
+            </tr>
+        `;
     }
 
     // --- NOVOS EVENT LISTENERS PARA O MODAL ---
@@ -229,9 +405,10 @@ document.addEventListener("DOMContentLoaded", () => {
             modal.classList.add('hidden');
             mostrarMensagem("Obrigado pela sua contribuição!", "status-success");
             
-            // Recarrega os resultados para mostrar o novo voto
-            // (O cache foi limpo no backend, então esta busca trará dados novos)
-            await buscarResultados(); 
+            // Recarrega as páginas visíveis para mostrar o novo voto
+            // (os votos são cruzados a cada requisição no backend)
+            estado.paginas.clear();
+            renderizarJanela();
 
         } catch (error) {
             alert(error.message); // Mostra o erro
@@ -254,6 +431,14 @@ document.addEventListener("DOMContentLoaded", () => {
         });
     }
 
+    function escaparHtml(texto) {
+        return String(texto)
+            .replace(/&/g, "&amp;")
+            .replace(/</g, "&lt;")
+            .replace(/>/g, "&gt;")
+            .replace(/"/g, "&quot;");
+    }
+
     function mostrarMensagem(mensagem, tipo) {
         statusMessageDiv.innerHTML = mensagem;
         statusMessageDiv.className = tipo;
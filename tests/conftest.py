@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# Os módulos do projeto ficam na raiz do repositório
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+@pytest.fixture
+def pasta_travas(tmp_path, monkeypatch):
+    """Travas entre processos da coalescência numa pasta temporária (e não em travas/)."""
+    import coalescencia
+    pasta = tmp_path / 'travas'
+    monkeypatch.setattr(coalescencia, 'PASTA_TRAVAS', str(pasta))
+    return pasta
@@ -0,0 +1,160 @@
+import pickle
+import time
+
+import pytest
+
+import cache_sqlite
+
+TAMANHO_VALOR = 1000
+
+
+def _valor(marca='x'):
+    return marca * TAMANHO_VALOR
+
+
+def _tamanho_serializado(valor):
+    return len(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+@pytest.fixture
+def caminho(tmp_path):
+    return str(tmp_path / 'cache.db')
+
+
+@pytest.fixture
+def cache(caminho):
+    return cache_sqlite.CacheSQLite(caminho=caminho, limite_bytes=10 * 2**20)
+
+
+def _total_contabilizado(cache):
+    return cache._total_bytes(cache._conexao())
+
+
+def _soma_real(cache):
+    (soma,) = cache._conexao().execute("SELECT COALESCE(SUM(tamanho), 0) FROM entradas").fetchone()
+    return soma
+
+
+def _envelhecer(cache, segundos):
+    conexao = cache._conexao()
+    with conexao:
+        conexao.execute("UPDATE entradas SET ultimo_acesso = ultimo_acesso - ?", (segundos,))
+
+
+def _chaves(cache):
+    return sorted(chave for (chave,) in cache._conexao().execute("SELECT chave FROM entradas"))
+
+
+# --- Contabilidade de bytes ---
+
+def test_total_acompanha_insercao_atualizacao_e_remocao(cache):
+    cache.set('relatorio:a', _valor())
+    cache.set('relatorio:b', _valor())
+    assert _total_contabilizado(cache) == 2 * _tamanho_serializado(_valor())
+
+    cache.set('relatorio:a', _valor() * 3) # Substitui com um valor maior
+    assert _total_contabilizado(cache) == _tamanho_serializado(_valor() * 3) + _tamanho_serializado(_valor())
+
+    cache.delete('relatorio:b')
+    cache.add('relatorio:c', _valor())
+    cache.delete_many('relatorio:c')
+    assert _total_contabilizado(cache) == _soma_real(cache) == _tamanho_serializado(_valor() * 3)
+
+    cache.clear()
+    assert _total_contabilizado(cache) == 0
+
+
+def test_total_e_compartilhado_entre_instancias(caminho):
+    # Duas instâncias no mesmo arquivo fazem o papel de dois processos
+    primeira = cache_sqlite.CacheSQLite(caminho=caminho)
+    segunda = cache_sqlite.CacheSQLite(caminho=caminho)
+    primeira.set('relatorio:a', _valor())
+    segunda.set('pncp_itens:b', _valor())
+    primeira.invalidar_namespace('pncp_itens')
+
+    assert _total_contabilizado(segunda) == _soma_real(segunda) == _tamanho_serializado(_valor())
+
+
+# --- Remoção por limite de tamanho ---
+
+def test_remocao_mantem_o_cache_abaixo_do_limite(caminho):
+    limite = 10 * _tamanho_serializado(_valor())
+    cache = cache_sqlite.CacheSQLite(caminho=caminho, limite_bytes=limite)
+    for indice in range(30):
+        cache.set(f"relatorio:{indice:02d}", _valor())
+        assert _total_contabilizado(cache) <= limite
+
+    assert _total_contabilizado(cache) == _soma_real(cache)
+    # As últimas gravadas continuam lá
+    assert cache.get('relatorio:29') == _valor()
+
+
+def test_remocao_tira_primeiro_as_vencidas(caminho):
+    # Cinco entradas passam do limite; sem a vencida ficam abaixo do alvo (90%)
+    limite = int(4.5 * _tamanho_serializado(_valor()))
+    cache = cache_sqlite.CacheSQLite(caminho=caminho, limite_bytes=limite)
+    cache.set('relatorio:antiga', _valor())
+    cache.set('relatorio:vencida', _valor(), timeout=1)
+    _envelhecer(cache, 1000) # 'antiga' passa a ser a menos usada
+    conexao = cache._conexao()
+    with conexao:
+        conexao.execute("UPDATE entradas SET expira_em = ? WHERE chave = 'relatorio:vencida'", (time.time() - 1,))
+
+    for indice in range(3):
+        cache.set(f"relatorio:nova{indice}", _valor())
+
+    assert 'relatorio:vencida' not in _chaves(cache)
+    assert 'relatorio:antiga' in _chaves(cache)
+
+
+def test_remocao_lru_considera_os_acessos_pendentes(caminho):
+    limite = 4 * _tamanho_serializado(_valor())
+    cache = cache_sqlite.CacheSQLite(caminho=caminho, limite_bytes=limite)
+    for indice in range(4):
+        cache.set(f"relatorio:{indice}", _valor())
+    _envelhecer(cache, cache_sqlite.RESOLUCAO_LRU_SEG * 2)
+
+    # Leitura recente: fica na memória do processo até a próxima remoção
+    assert cache.get('relatorio:0') == _valor()
+    cache.set('relatorio:nova', _valor())
+
+    restantes = _chaves(cache)
+    assert 'relatorio:0' in restantes
+    assert 'relatorio:1' not in restantes
+    assert _total_contabilizado(cache) <= limite * cache_sqlite.FRACAO_APOS_REMOCAO
+
+
+def test_leitura_nao_grava_no_banco_a_cada_acerto(cache):
+    cache.set('relatorio:a', _valor())
+    _envelhecer(cache, cache_sqlite.RESOLUCAO_LRU_SEG * 2)
+    (antes,) = cache._conexao().execute("SELECT ultimo_acesso FROM entradas").fetchone()
+
+    for _ in range(5):
+        cache.get('relatorio:a')
+
+    (depois,) = cache._conexao().execute("SELECT ultimo_acesso FROM entradas").fetchone()
+    assert depois == antes
+    assert 'relatorio:a' in cache._acessos_pendentes
+
+
+# --- Expiração e namespaces ---
+
+def test_entrada_vencida_nao_e_devolvida(cache):
+    cache.set('relatorio:a', _valor(), timeout=1)
+    conexao = cache._conexao()
+    with conexao:
+        conexao.execute("UPDATE entradas SET expira_em = ?", (time.time() - 1,))
+
+    assert cache.get('relatorio:a') is None
+    assert not cache.has('relatorio:a')
+    assert cache.add('relatorio:a', 'novo') # add substitui a vencida
+    assert cache.get('relatorio:a') == 'novo'
+
+
+def test_invalidar_namespace(cache):
+    cache.set('relatorio:a', 1)
+    cache.set('pncp_itens:b', 2)
+    cache.set('sem_namespace', 3)
+
+    assert cache.invalidar_namespace('pncp_itens') == 1
+    assert set(cache.estatisticas()) == {'relatorio', cache_sqlite.NAMESPACE_PADRAO}
@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+import coalescencia
+
+pytestmark = pytest.mark.usefixtures('pasta_travas')
+
+
+def _em_paralelo(funcao, quantidade):
+    """Roda 'funcao' em N threads ao mesmo tempo; devolve [(resultado, erro)] de cada uma."""
+    resultados = [None] * quantidade
+    largada = threading.Barrier(quantidade)
+
+    def executar(indice):
+        largada.wait()
+        try:
+            resultados[indice] = (funcao(), None)
+        except Exception as e:
+            resultados[indice] = (None, e)
+
+    threads = [threading.Thread(target=executar, args=(indice,)) for indice in range(quantidade)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resultados
+
+
+def test_chamadas_concorrentes_calculam_uma_vez():
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        time.sleep(0.1)
+        return {'itens': [1, 2, 3]}
+
+    resultados = _em_paralelo(lambda: coalescencia.executar_unico('relatorio:a', calcular), 10)
+
+    assert len(chamadas) == 1
+    primeiro = resultados[0][0]
+    assert all(resultado is primeiro and erro is None for resultado, erro in resultados)
+
+
+def test_excecao_da_lider_chega_a_todas():
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        time.sleep(0.1)
+        raise RuntimeError("PNCP fora")
+
+    resultados = _em_paralelo(lambda: coalescencia.executar_unico('relatorio:b', calcular), 5)
+
+    assert len(chamadas) == 1
+    assert all(isinstance(erro, RuntimeError) for _, erro in resultados)
+
+
+def test_chaves_diferentes_nao_esperam_uma_pela_outra():
+    chamadas = []
+
+    def calcular(chave):
+        chamadas.append(chave)
+        return chave
+
+    assert coalescencia.executar_unico('relatorio:c', lambda: calcular('c')) == 'c'
+    assert coalescencia.executar_unico('relatorio:d', lambda: calcular('d')) == 'd'
+    assert chamadas == ['c', 'd']
+
+
+def test_chamadas_seguidas_calculam_de_novo():
+    # Só chamadas simultâneas são coalescidas; o resultado não fica guardado
+    chamadas = []
+    for _ in range(2):
+        coalescencia.executar_unico('relatorio:e', lambda: chamadas.append(1))
+    assert len(chamadas) == 2
+
+
+def test_liderar_seguidores_esperam_a_lider():
+    lider_entrou, liberar_lider = threading.Event(), threading.Event()
+    ordem = []
+
+    def lider():
+        with coalescencia.liderar('relatorio:f') as voo:
+            assert voo is not None
+            lider_entrou.set()
+            liberar_lider.wait()
+            voo.resultado = 'pronto'
+            ordem.append('lider')
+
+    def seguidor():
+        with coalescencia.liderar('relatorio:f') as voo:
+            assert voo is None
+            ordem.append('seguidor')
+
+    thread_lider = threading.Thread(target=lider)
+    thread_lider.start()
+    lider_entrou.wait()
+    seguidores = [threading.Thread(target=seguidor) for _ in range(3)]
+    for thread in seguidores:
+        thread.start()
+    time.sleep(0.05)
+    assert ordem == []
+
+    liberar_lider.set()
+    for thread in [thread_lider] + seguidores:
+        thread.join()
+    assert ordem == ['lider', 'seguidor', 'seguidor', 'seguidor']
+
+
+def test_executar_unico_recalcula_se_a_lider_em_fluxo_nao_terminou():
+    lider_entrou, liberar_lider = threading.Event(), threading.Event()
+
+    def lider_interrompida():
+        with coalescencia.liderar('relatorio:g'):
+            lider_entrou.set()
+            liberar_lider.wait()
+            # Sai sem guardar voo.resultado (ex.: cliente desconectou)
+
+    thread_lider = threading.Thread(target=lider_interrompida)
+    thread_lider.start()
+    lider_entrou.wait()
+
+    resultado = []
+    seguidor = threading.Thread(
+        target=lambda: resultado.append(coalescencia.executar_unico('relatorio:g', lambda: 'recalculado'))
+    )
+    seguidor.start()
+    time.sleep(0.05)
+    liberar_lider.set()
+    thread_lider.join()
+    seguidor.join()
+
+    assert resultado == ['recalculado']
+
+
+def test_travas_usam_um_conjunto_fixo_de_arquivos(pasta_travas):
+    for indice in range(coalescencia.NUMERO_TRAVAS * 3):
+        with coalescencia.trava_entre_processos(f"relatorio:{indice}"):
+            pass
+    assert len(list(pasta_travas.iterdir())) <= coalescencia.NUMERO_TRAVAS
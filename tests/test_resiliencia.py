@@ -0,0 +1,158 @@
+import threading
+import time
+
+import pytest
+
+import resiliencia
+
+TEMPO_ABERTURA_SEG = 0.05
+
+
+def _disjuntor(limite_falhas=3):
+    return resiliencia.DisjuntorCircuito('teste', limite_falhas=limite_falhas, tempo_abertura_seg=TEMPO_ABERTURA_SEG)
+
+
+def _abrir(disjuntor):
+    for _ in range(disjuntor.limite_falhas):
+        assert disjuntor.permitir()
+        disjuntor.registrar_falha()
+    assert disjuntor.estado == 'aberto'
+
+
+# --- Disjuntor ---
+
+def test_disjuntor_abre_apos_falhas_seguidas():
+    disjuntor = _disjuntor()
+    for _ in range(2):
+        disjuntor.registrar_falha()
+    assert disjuntor.estado == 'fechado'
+    assert disjuntor.permitir()
+
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == 'aberto'
+    assert not disjuntor.permitir()
+
+
+def test_sucesso_zera_as_falhas_seguidas():
+    disjuntor = _disjuntor()
+    disjuntor.registrar_falha()
+    disjuntor.registrar_falha()
+    disjuntor.registrar_sucesso()
+    disjuntor.registrar_falha()
+    disjuntor.registrar_falha()
+    assert disjuntor.estado == 'fechado'
+
+
+def test_meio_aberto_libera_uma_unica_chamada_de_teste():
+    disjuntor = _disjuntor()
+    _abrir(disjuntor)
+    time.sleep(TEMPO_ABERTURA_SEG * 1.5)
+
+    assert disjuntor.estado == 'meio_aberto'
+    assert disjuntor.permitir()
+    assert not disjuntor.permitir()
+
+
+def test_sucesso_no_teste_fecha_o_disjuntor():
+    disjuntor = _disjuntor()
+    _abrir(disjuntor)
+    time.sleep(TEMPO_ABERTURA_SEG * 1.5)
+
+    assert disjuntor.permitir()
+    disjuntor.registrar_sucesso()
+    assert disjuntor.estado == 'fechado'
+    assert disjuntor.permitir()
+    assert disjuntor.permitir()
+
+
+def test_falha_no_teste_reabre_o_disjuntor():
+    disjuntor = _disjuntor(limite_falhas=5)
+    _abrir(disjuntor)
+    time.sleep(TEMPO_ABERTURA_SEG * 1.5)
+
+    assert disjuntor.permitir()
+    disjuntor.registrar_falha() # Uma falha basta, mesmo abaixo do limite
+    assert disjuntor.estado == 'aberto'
+    assert not disjuntor.permitir()
+
+
+def test_liberar_teste_permite_nova_chamada_de_teste():
+    disjuntor = _disjuntor()
+    _abrir(disjuntor)
+    time.sleep(TEMPO_ABERTURA_SEG * 1.5)
+
+    assert disjuntor.permitir()
+    disjuntor.liberar_teste()
+    assert disjuntor.estado == 'meio_aberto'
+    assert disjuntor.permitir()
+
+
+def test_requisitar_libera_o_teste_em_erro_de_montagem():
+    disjuntor = _disjuntor()
+    _abrir(disjuntor)
+    time.sleep(TEMPO_ABERTURA_SEG * 1.5)
+
+    # URL sem host: requests falha antes de chegar à rede (InvalidURL, não retentável)
+    with pytest.raises(resiliencia.ErroPNCP):
+        resiliencia.requisitar('teste', 'http://', disjuntor)
+    assert disjuntor.estado == 'meio_aberto'
+    assert disjuntor.permitir()
+
+
+def test_requisitar_com_disjuntor_aberto_nem_tenta():
+    disjuntor = _disjuntor()
+    _abrir(disjuntor)
+    with pytest.raises(resiliencia.CircuitoAberto):
+        resiliencia.requisitar('teste', 'http://', disjuntor)
+
+
+# --- Limitador de taxa (token bucket) ---
+
+def _cronometrar(funcao, vezes):
+    inicio = time.monotonic()
+    for _ in range(vezes):
+        funcao()
+    return time.monotonic() - inicio
+
+
+def test_limitador_libera_rajada_ate_a_capacidade():
+    limitador = resiliencia.LimitadorTaxa('teste', taxa_por_seg=10, capacidade=5)
+    assert _cronometrar(limitador.aguardar, 5) < 0.05
+
+
+def test_limitador_segura_a_taxa_depois_da_rajada():
+    limitador = resiliencia.LimitadorTaxa('teste', taxa_por_seg=20, capacidade=5)
+    limitador.aguardar() # Consome a rajada inteira
+    for _ in range(4):
+        limitador.aguardar()
+
+    # Mais 5 fichas a 20/s: ~0,25 s
+    assert 0.2 <= _cronometrar(limitador.aguardar, 5) < 0.6
+
+
+def test_limitador_nao_acumula_alem_da_capacidade():
+    limitador = resiliencia.LimitadorTaxa('teste', taxa_por_seg=50, capacidade=3)
+    _cronometrar(limitador.aguardar, 3)
+    time.sleep(0.2) # Renderia 10 fichas, mas o balde só guarda 3
+
+    assert _cronometrar(limitador.aguardar, 3) < 0.05
+    assert _cronometrar(limitador.aguardar, 1) >= 0.01
+
+
+def test_limitador_compartilhado_entre_threads():
+    limitador = resiliencia.LimitadorTaxa('teste', taxa_por_seg=40, capacidade=1)
+    limitador.aguardar()
+
+    def consumir():
+        for _ in range(5):
+            limitador.aguardar()
+
+    threads = [threading.Thread(target=consumir) for _ in range(4)]
+    inicio = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 20 fichas a 40/s somando as threads: ~0,5 s
+    assert time.monotonic() - inicio >= 0.45